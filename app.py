@@ -6,19 +6,40 @@ import random
 import os
 import time
 import sys
+import threading
+import gc
+from concurrent.futures import ThreadPoolExecutor
 
 # תיקון עברית בווינדוס
 sys.stdout.reconfigure(encoding='utf-8')
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, send_file, redirect
 from flask_cors import CORS
 from openai import OpenAI 
-from woocommerce import API
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
 # ייבוא המוח של הבוט
 from prompts import SYSTEM_PROMPT
+from search_index import SearchIndex, CONCEPT_SYNONYMS, RANK_FLIGHTS, normalize_query, strip_stop_words
+from product_cards import select_variety, render_cards_html, card_fields
+from store_api import StoreClient, fetch_catalog
+from catalog_snapshot import (save_snapshot, load_snapshot, snapshot_id, snapshot_lock, try_refresh_lock,
+                              save_snapshot_lineage, snapshot_lineage, mark_refreshed, last_refreshed)
+from catalog_updates import CatalogUpdateQueue, UpdateJournal, PRODUCT_TOPICS, parse_product_webhook, verify_webhook_signature
+from chat_log import ConversationLogWriter
+from leads_store import LeadStore
+from session_store import create_session_store
+from streaming import DirectiveStreamFilter, sse_event
+from ttl_cache import TTLCache
+from fast_path import FastPathRouter
+from prompt_builder import PromptBuilder, history_entry, history_from_payload
+from product_record import products_from_api
+from metrics import Metrics
+from thumbnails import ThumbnailCache, THUMBNAILS_SUPPORTED
+from resilience import CircuitBreaker, CircuitOpenError, UpstreamTimer, call_timeout, check_deadline, start_deadline
+from singleflight import SingleFlight
+from speculation import SpeculationTracker
 
 app = Flask(__name__)
 CORS(app)
@@ -27,29 +48,89 @@ CORS(app)
 MAX_INPUT_LENGTH = 500  
 DAILY_LIMIT = "200 per day" 
 MINUTE_LIMIT = "60 per minute" 
+DEFAULT_LIMITS = ["200 per day", "50 per hour"]
+# RATELIMIT_ENABLED=0 רק לבדיקות עומס מול שרתי הדמה (stub_servers.py)
+RATELIMIT_ENABLED = os.getenv("RATELIMIT_ENABLED", "1") != "0"
+app.config["RATELIMIT_ENABLED"] = RATELIMIT_ENABLED
+# memory:// סופר בכל תהליך לחוד - עם כמה workers צריך אחסון משותף (למשל redis://localhost:6379)
+RATELIMIT_STORAGE_URI = os.getenv("RATELIMIT_STORAGE_URI", "memory://")
 
 limiter = Limiter(
     get_remote_address,
     app=app,
-    default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    default_limits=DEFAULT_LIMITS,
+    storage_uri=RATELIMIT_STORAGE_URI
 )
 
 # ================= הגדרות ומפתחות =================
 OPENAI_API_KEY = "X" 
 OPENAI_MODEL = "gpt-4o-mini" 
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # ריק = OpenAI האמיתי
 
 # פרטי החנות שלך (בשביל החיבור למוצרים)
-WC_URL = "https://YOUR-WEBSITE.co.il" # <--- כתובת האתר שלך
+WC_URL = os.getenv("WC_URL", "https://YOUR-WEBSITE.co.il") # <--- כתובת האתר שלך
 WC_KEY = "X"     # <--- Consumer Key
 WC_SECRET = "X"  # <--- Consumer Secret
+CATALOG_FETCH_CONCURRENCY = int(os.getenv("CATALOG_FETCH_CONCURRENCY", "8"))  # כמה עמודי קטלוג נמשכים במקביל
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "catalog_snapshot.bin")
+CATALOG_REFRESH_MINUTES = float(os.getenv("CATALOG_REFRESH_MINUTES", "60"))  # משיכה מלאה מהחנות. 0 = בלי רענון תקופתי
+CATALOG_SYNC_SECONDS = float(os.getenv("CATALOG_SYNC_SECONDS", "5"))  # כל כמה זמן כל תהליך בודק אם נשמר snapshot חדש
+CHAT_LOG_PATH = os.getenv("CHAT_LOG_PATH", "chat_logs.jsonl")
+CHAT_LOG_MAX_MB = int(os.getenv("CHAT_LOG_MAX_MB", "50"))  # רוטציה לפי גודל (וגם בכל יום חדש)
+LEADS_DB_PATH = os.getenv("LEADS_DB_PATH", "leads.db")  # leads.json קיים מיובא אוטומטית בהרצה הראשונה
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "sqlite" = משותף לכמה workers על אותה מכונה
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+STORE_CACHE_TTL_SECONDS = int(os.getenv("STORE_CACHE_TTL_SECONDS", "300"))  # עמודי קטגוריה/תגית מהחנות
+STORE_CACHE_MAX_ENTRIES = int(os.getenv("STORE_CACHE_MAX_ENTRIES", "500"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "4000"))  # תקציב טוקנים לכל הקלט שנשלח ל-AI
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))  # תקרת ההיסטוריה שנשמרת בסשן
+WC_WEBHOOK_SECRET = os.getenv("WC_WEBHOOK_SECRET", "")  # ה-Secret שהוגדר ב-WooCommerce > Webhooks. ריק = ה-webhook כבוי
+WEBHOOK_DEBOUNCE_SECONDS = float(os.getenv("WEBHOOK_DEBOUNCE_SECONDS", "2"))  # שקט לפני החלת אצווה של עדכונים
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))  # בקשה איטית מזה מודפסת עם פירוק לשלבים. 0 = כבוי
+# הכתובת הציבורית של הבוט (SERVER_URL של הווידג'ט בלי /chat). הווידג'ט רץ על האתר של החנות, ולכן
+# כתובת thumbnail חייבת להיות מלאה. ריק = הכרטיסים מצביעים על התמונה המקורית, כמו קודם
+PUBLIC_URL = os.getenv("PUBLIC_URL", "").rstrip("/")
+THUMB_CACHE_DIR = os.getenv("THUMB_CACHE_DIR", "thumb_cache")
+THUMB_CACHE_MAX_MB = int(os.getenv("THUMB_CACHE_MAX_MB", "200"))
+THUMB_SIZE = int(os.getenv("THUMB_SIZE", "160"))  # פיקסלים. הכרטיס מוצג ב-60px, כולל מסכי retina
+THUMB_FORMAT = os.getenv("THUMB_FORMAT", "webp")  # webp / jpeg
+THUMB_MAX_AGE = 365 * 24 * 3600  # הכתובת כוללת את מפתח התמונה, כך שהתוכן שלה לא משתנה לעולם
+# תקציב זמן לבקשת צ'אט ו-circuit breakers (ראה resilience.py)
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "20"))  # מקצה לקצה. 0 = בלי דדליין
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "12"))
+STORE_TIMEOUT_SECONDS = float(os.getenv("STORE_TIMEOUT_SECONDS", "5"))  # לכל עמוד מוצרים בזמן בקשה
+STORE_RESERVE_SECONDS = float(os.getenv("STORE_RESERVE_SECONDS", "3"))  # נשמר מהדדליין לשליפת המוצרים אחרי ה-AI
+LLM_SLOW_SECONDS = float(os.getenv("LLM_SLOW_SECONDS", "8"))  # קריאה איטית מזה נספרת לפתיחת ה-breaker
+STORE_SLOW_SECONDS = float(os.getenv("STORE_SLOW_SECONDS", "3"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+# חיפוש ספקולטיבי במקביל ל-AI (ראה speculation.py)
+SPECULATIVE_SEARCH = os.getenv("SPECULATIVE_SEARCH", "1") != "0"
+SPECULATIVE_STORE_LOOKUPS = int(os.getenv("SPECULATIVE_STORE_LOOKUPS", "2"))  # תקרת עמודים מהחנות לכל הודעה
 
 # ================= אתחול שירותים =================
-client = OpenAI(api_key=OPENAI_API_KEY)
+METRICS = Metrics()
+METRICS.describe("stage_seconds", "histogram", "Time spent in each stage of a chat request")
+METRICS.describe("request_seconds", "histogram", "End-to-end request latency")
+METRICS.describe("requests_total", "counter", "Requests by endpoint and status")
+METRICS.describe("llm_tokens_total", "counter", "Tokens reported by the LLM usage field")
+METRICS.describe("fallback_total", "counter", "Replies served without an upstream (failed, out of time, or circuit open)")
+METRICS.describe("speculative_saved_seconds", "histogram", "Product lookup time hidden behind the LLM call, per speculative hit")
 
-wcapi = API(
+LLM_BREAKER = CircuitBreaker("openai", slow_call_seconds=LLM_SLOW_SECONDS, open_seconds=BREAKER_OPEN_SECONDS)
+STORE_BREAKER = CircuitBreaker("woocommerce", slow_call_seconds=STORE_SLOW_SECONDS, open_seconds=BREAKER_OPEN_SECONDS)
+
+client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+
+THUMBNAILS = None
+if PUBLIC_URL and THUMBNAILS_SUPPORTED:
+    THUMBNAILS = ThumbnailCache(THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_MAX_MB * 1024 * 1024,
+                                size=THUMB_SIZE, image_format=THUMB_FORMAT)
+
+wcapi = StoreClient(
     url=WC_URL, consumer_key=WC_KEY, consumer_secret=WC_SECRET,
-    version="wc/v3", timeout=60 
+    version="wc/v3", timeout=60, pool_size=CATALOG_FETCH_CONCURRENCY
 )
 
 # ================= טעינת המוח (ID Mapping) =================
@@ -62,8 +143,8 @@ def load_id_mapping():
         return {"categories": {}, "tags": {}}
 
 ID_MAPPING = load_id_mapping()
-CAT_NAMES_LIST = ", ".join(ID_MAPPING.get("categories", {}).keys())
-TAG_NAMES_LIST = ", ".join(ID_MAPPING.get("tags", {}).keys())
+FAST_PATH = FastPathRouter(ID_MAPPING)
+PROMPT_BUILDER = PromptBuilder(SYSTEM_PROMPT, ID_MAPPING, token_budget=PROMPT_TOKEN_BUDGET)
 
 # ================= המאגר החכם =================
 SMART_CATALOG = [] 
@@ -72,334 +153,878 @@ STORE_METADATA = {
     "best_sellers_ids": [], 
     "best_sellers_names": []
 }
+SEARCH_INDEX = None  # נבנה מחדש בכל טעינת קטלוג, ומתעדכן חלקית מ-webhooks (ראה apply_catalog_changes)
+CATALOG_SNAPSHOT_ID = None  # ה-snapshot שהקטלוג שבזיכרון תואם לו (ראה sync_catalog)
+CATALOG_REFRESH_RETRY_SECONDS = 300  # אחרי משיכה (גם כושלת) התהליך לא מנסה שוב לפני כן
+CATALOG_JOURNAL = UpdateJournal(f"{CATALOG_SNAPSHOT_PATH}.updates")  # webhooks ורענונים מאז ה-snapshot
+CATALOG_JOURNAL_OFFSET = 0  # עד איפה היומן כבר הוחל בתהליך הזה
+CATALOG_JOURNAL_MAX_BYTES = 8 * 1024 * 1024  # יומן ארוך מזה מאוחד ל-snapshot מלא
+_catalog_lock = threading.Lock()  # רק בין כותבים; קוראים משתמשים בהפניה הנוכחית בלי נעילה
+_catalog_sync_pid = None
+_last_refresh_attempt = 0.0
 
-# מילון מושגים (fallback logic)
-CONCEPT_SYNONYMS = {
-    "צבעוני": ["פופ ארט", "גרפיטי", "אבסטרקט", "סטריט ארט", "צבעוני", "קולאז", "street art", "pop art", "צבעים", "שמח", "צבע", "colorful"],
-    "שמח": ["פופ ארט", "חיות", "צבעוני", "חיוך", "קוף", "אופטימי"],
-    "רגוע": ["נוף", "ים", "חוף", "שקיעה", "בז", "פסטל", "מינימליזם", "סקנדינבי", "שקט", "טבע", "בוהו", "boho", "calm"],
-    "סולידי": ["שחור לבן", "מינימליזם", "גיאומטרי", "נקי", "קלאסי"],
-    "יוקרתי": ["שחור וזהב", "מותגים", "זכוכית", "rolex", "gucci", "זהב", "יוקרה", "יוקרתי", "luxury", "black and gold"],
-    "סלון": ["אבסטרקט", "נוף", "גדול", "סט", "שלושה חלקים", "סלון", "living room"],
-    "חיות": ["חיות", "animals", "wildlife", "טבע"],
-    "ילדים": ["אנימה", "חיות", "ספורט", "גיבורי על", "דיסני", "spiderman", "batman", "ילדים", "נוער", "kids"],
-    "אנימה": ["אנימה", "anime", "מנגה", "דרגון בול", "נארוטו", "וואן פיס", "dragon ball", "naruto", "one piece"],
-}
+def install_catalog(products, best_sellers_ids, best_sellers_names, index=None):
+    global SMART_CATALOG, SEARCH_INDEX
+    # בונים את האינדקס לפני ההחלפה, כך שבקשות פעילות לא רואות קטלוג חלקי
+    if index is None:
+        index = SearchIndex(products, best_sellers_ids, CONCEPT_SYNONYMS)
+    else:
+        index.synonyms = CONCEPT_SYNONYMS  # המילון בקוד גובר על מה שנשמר ב-snapshot
+    SMART_CATALOG = products
+    STORE_METADATA["best_sellers_ids"] = best_sellers_ids
+    STORE_METADATA["best_sellers_names"] = best_sellers_names
+    STORE_METADATA["categories"] = list(ID_MAPPING.get("categories", {}).keys())
+    SEARCH_INDEX = index
+    print(f"🗂️ Search Index Ready: {len(SEARCH_INDEX)} products, {len(SEARCH_INDEX.postings)} tokens.")
+    warm_thumbnails(index, best_sellers_ids)
 
-def initialize_store_context():
-    print("🔄 Initializing Smart Catalog & Intelligence...")
-    global SMART_CATALOG
-    all_products = []
-    page = 1
-    try:
-        while True:
-            batch = wcapi.get("products", params={"per_page": 100, "page": page, "status": "publish"}).json()
-            if not batch: break
-            all_products.extend(batch)
-            page += 1
-            if len(all_products) >= 2000: break
-        
-        SMART_CATALOG = all_products
-        print(f"✅ Catalog Loaded: {len(SMART_CATALOG)} products.")
+def warm_thumbnails(index, product_ids):
+    # הנמכרים ביותר מופיעים בהכי הרבה תשובות - ה-thumbnails שלהם נוצרים מראש, ברקע
+    if THUMBNAILS is None: return
+    records = [index.products[pid] for pid in product_ids if pid in index.products]
+    THUMBNAILS.warm([(p.image, p.image_version) for p in records])
 
-        top_sellers_api = wcapi.get("products", params={"per_page": 20, "orderby": "popularity"}).json()
-        STORE_METADATA["best_sellers_ids"] = [p['id'] for p in top_sellers_api]
-        STORE_METADATA["best_sellers_names"] = [f"{p['name']}" for p in top_sellers_api[:5]]
-        STORE_METADATA["categories"] = list(ID_MAPPING.get("categories", {}).keys())
+def refresh_store_context():
+    """
+    משיכה מלאה מהחנות. כשכבר יש קטלוג נרשמים ביומן רק ההבדלים (כמו webhooks), וכל תהליך מחיל אותם
+    על הקטלוג שכבר בזיכרון שלו - workers ממשיכים לחלוק את מה שקיבלו מה-master ב-fork במקום לטעון
+    כל אחד עותק מלא משלו. בלי קטלוג (עלייה ראשונה) נשמר snapshot מלא.
+    """
+    global CATALOG_JOURNAL_OFFSET
+    started = time.time()
+    try:
+        all_products, top_sellers_api = fetch_catalog(wcapi, concurrency=CATALOG_FETCH_CONCURRENCY)
     except Exception as e:
         print(f"⚠️ Error loading catalog: {e}")
+        return False
+    best_sellers = ([p.id for p in top_sellers_api], [p.name for p in top_sellers_api[:5]])
 
-def smart_search_products(query, page=1, limit=12):
-    if not SMART_CATALOG: return []
-    clean_query = query.lower().strip().replace('"', '').replace("'", "").replace("`", "")
-    results = []
-    query_words = clean_query.split()
-    concept_terms = []
-    for concept, synonyms in CONCEPT_SYNONYMS.items():
-        if concept in clean_query: concept_terms.extend(synonyms)
-
-    for p in SMART_CATALOG:
-        score = 0
-        p_name = p.get('name', '').lower()
-        p_cats = " ".join([c['name'].lower() for c in p.get('categories', [])])
-        p_tags = " ".join([t['name'].lower() for t in p.get('tags', [])])
-        full_blob = f"{p_name} {p_cats} {p_tags}"
-        
-        for term in concept_terms:
-            if term in full_blob: score += 10
-        matched = 0
-        for word in query_words:
-            if len(word) < 2: continue 
-            if word in full_blob:
-                matched += 1
-                if word in p_name: score += 30 
-        if matched > 0:
-            if matched == len(query_words) and len(query_words) > 1: score += 150 
-            else: score += (matched * 20)
-        if score > 0:
-            if p['id'] in STORE_METADATA["best_sellers_ids"]: score += 10 
-            results.append((score, p))
-    
-    results.sort(key=lambda x: x[0], reverse=True)
-    start_idx = (page - 1) * limit
-    return [item[1] for item in results[start_idx:start_idx + limit]]
+    with _catalog_lock, snapshot_lock(CATALOG_SNAPSHOT_PATH):
+        catch_up_catalog()
+        if not SMART_CATALOG:
+            install_catalog(all_products, *best_sellers)
+            print(f"✅ Catalog Loaded: {len(SMART_CATALOG)} products.")
+            save_catalog_snapshot()
+        else:
+            # מוצרים שהגיעו ב-webhook בזמן המשיכה: הגרסה מה-webhook חדשה יותר ממה שנמשך
+            recent = set()
+            for written_at, upserts, deleted_ids, _ in CATALOG_JOURNAL.read()[0]:
+                if written_at >= started: recent.update([p.id for p in upserts] + list(deleted_ids))
+            current = {p.id: p for p in SMART_CATALOG}
+            upserts = [p for p in all_products if p.id not in recent
+                       and (p.id not in current or p.fields() != current[p.id].fields())]
+            fetched = {p.id for p in all_products}
+            deleted_ids = [pid for pid in current if pid not in fetched and pid not in recent]
+            if best_sellers == (STORE_METADATA["best_sellers_ids"], STORE_METADATA["best_sellers_names"]):
+                best_sellers = None
+            if upserts or deleted_ids or best_sellers:
+                patch_catalog(upserts, deleted_ids, best_sellers)
+                CATALOG_JOURNAL_OFFSET = CATALOG_JOURNAL.append(upserts, deleted_ids, best_sellers)
+                compact_catalog_journal()
+            print(f"✅ Catalog refreshed: {len(SMART_CATALOG)} products ({len(upserts)} changed, {len(deleted_ids)} removed).")
+        mark_refreshed(CATALOG_SNAPSHOT_PATH)
+    return True
+
+def save_catalog_snapshot(compacted=False):
+    """
+    נקרא תחת snapshot_lock. compacted: איחוד היומן - ה-snapshot החדש שווה לקודם ועוד כל היומן, ולכן
+    תהליכים שהחילו את היומן עוברים אליו בלי לטעון אותו (restore_newer_snapshot).
+    """
+    global CATALOG_SNAPSHOT_ID, CATALOG_JOURNAL_OFFSET
+    parent_id, journal_end = CATALOG_SNAPSHOT_ID, CATALOG_JOURNAL_OFFSET
+    try:
+        size = save_snapshot(CATALOG_SNAPSHOT_PATH, SMART_CATALOG,
+                             {k: STORE_METADATA[k] for k in ("best_sellers_ids", "best_sellers_names")}, SEARCH_INDEX)
+        # הקובץ הוא בדיוק מה שבזיכרון - sync_catalog לא טוען אותו שוב בתהליך הזה. היומן כבר כלול בו
+        CATALOG_SNAPSHOT_ID = snapshot_id(CATALOG_SNAPSHOT_PATH)
+        save_snapshot_lineage(CATALOG_SNAPSHOT_PATH, parent_id if compacted else None, journal_end)
+        if compacted: CATALOG_JOURNAL.rotate()
+        else: CATALOG_JOURNAL.reset()
+        CATALOG_JOURNAL_OFFSET = 0
+        print(f"💾 Catalog snapshot saved ({size // 1024} KB).")
+    except Exception as e:
+        print(f"⚠️ Error saving catalog snapshot: {e}")
 
-# ניהול סשנים בזיכרון
-USER_SESSIONS = {}
+def compact_catalog_journal():
+    # נקרא תחת snapshot_lock, אחרי שהתהליך החיל את כל היומן
+    if CATALOG_JOURNAL_OFFSET > CATALOG_JOURNAL_MAX_BYTES and CATALOG_SNAPSHOT_ID is not None:
+        save_catalog_snapshot(compacted=True)
 
-def log_conversation(session_id, user_msg, bot_msg, meta=None):
+def install_snapshot(snapshot):
+    meta = snapshot["metadata"]
+    install_catalog(snapshot["catalog"], meta["best_sellers_ids"], meta["best_sellers_names"], snapshot["index"])
+
+def restore_newer_snapshot():
+    """טוען את ה-snapshot אם תהליך אחר שמר גרסה אחרת מזו שבזיכרון. נקרא תחת _catalog_lock ו-snapshot_lock."""
+    global CATALOG_SNAPSHOT_ID, CATALOG_JOURNAL_OFFSET
+    current = snapshot_id(CATALOG_SNAPSHOT_PATH)
+    if current is None or current == CATALOG_SNAPSHOT_ID: return False
+    parent_id, journal_end = snapshot_lineage(CATALOG_SNAPSHOT_PATH)
+    if SEARCH_INDEX is not None and parent_id is not None and parent_id == CATALOG_SNAPSHOT_ID:
+        # איחוד של יומן שהתהליך הזה כבר באמצע שלו: שארית היומן הקודם מביאה אותו בדיוק ל-snapshot החדש
+        batches, end = CATALOG_JOURNAL.read(CATALOG_JOURNAL_OFFSET, previous=True)
+        if end == journal_end:
+            for _, upserts, deleted_ids, best_sellers in batches:
+                patch_catalog(upserts, deleted_ids, best_sellers)
+            CATALOG_SNAPSHOT_ID, CATALOG_JOURNAL_OFFSET = current, 0
+            return False
+    CATALOG_SNAPSHOT_ID = current  # גם קובץ פגום נבדק פעם אחת בלבד; המשיכה הבאה מהחנות תחליף אותו
+    CATALOG_JOURNAL_OFFSET = 0  # היומן התחיל מחדש עם ה-snapshot הזה
+    snapshot = load_snapshot(CATALOG_SNAPSHOT_PATH)
+    if not snapshot: return False
+    install_snapshot(snapshot)
+    return True
+
+def initialize_store_context(background_sync=True):
+    """מחזיר True אם הקטלוג עלה מ-snapshot (ואז הוא עשוי להיות ישן), False אם נטען עכשיו מהחנות."""
+    print("🔄 Initializing Smart Catalog & Intelligence...")
+    with _catalog_lock, snapshot_lock(CATALOG_SNAPSHOT_PATH):
+        restored, _ = catch_up_catalog()
+    if restored:
+        age_min = (time.time() - (last_refreshed(CATALOG_SNAPSHOT_PATH) or time.time())) / 60
+        print(f"⚡ Catalog restored from snapshot: {len(SMART_CATALOG)} products ({age_min:.0f} min old).")
+    elif not refresh_store_context():
+        install_catalog([], [], [])
+    if background_sync: start_catalog_sync()
+    return restored
+
+# ================= סנכרון הקטלוג בין תהליכים =================
+# כל תהליך (worker) בודק ברקע, כל CATALOG_SYNC_SECONDS, אם נוספו רשומות ליומן העדכונים - ומחיל אותן
+# על הקטלוג שבזיכרון (SearchIndex.updated), בלי ריסטארט ובלי לאבד בקשות פעילות, סשנים או caches.
+# כשהמשיכה האחרונה מהחנות ישנה מ-CATALOG_REFRESH_MINUTES, התהליך הראשון שתופס את נעילת הרענון מושך
+# ורושם ביומן רק את ההבדלים. snapshot מלא נטען לזיכרון רק כשהוא לא נגזר ממה שהתהליך כבר מחזיק.
+def catch_up_catalog():
+    """
+    snapshot חדש (אם נשמר) ואחריו אצוות ה-webhooks מהיומן שעוד לא הוחלו כאן, לפי הסדר שבו נרשמו.
+    מחזיר (snapshot נטען, מספר אצוות). נקרא תחת _catalog_lock ו-snapshot_lock.
+    """
+    global CATALOG_JOURNAL_OFFSET
+    restored = restore_newer_snapshot()
+    batches, CATALOG_JOURNAL_OFFSET = CATALOG_JOURNAL.read(CATALOG_JOURNAL_OFFSET)
+    for _, upserts, deleted_ids, best_sellers in batches:
+        patch_catalog(upserts, deleted_ids, best_sellers)
+    return restored, len(batches)
+
+def catalog_refresh_due():
+    # לפי הגיל בלבד: snapshot שה-master שחזר בעלייה לא נמשך מחדש רק בגלל שנשמר לפני העלייה
+    refreshed_at = last_refreshed(CATALOG_SNAPSHOT_PATH)
+    if refreshed_at is None: return True
+    return CATALOG_REFRESH_MINUTES > 0 and time.time() - refreshed_at >= CATALOG_REFRESH_MINUTES * 60
+
+def sync_catalog():
+    global _last_refresh_attempt
+    with _catalog_lock, snapshot_lock(CATALOG_SNAPSHOT_PATH):
+        restored, _ = catch_up_catalog()
+    if restored: print(f"⚡ Catalog reloaded from snapshot: {len(SMART_CATALOG)} products.")
+    if time.time() - _last_refresh_attempt < CATALOG_REFRESH_RETRY_SECONDS or not catalog_refresh_due(): return
+    with try_refresh_lock(CATALOG_SNAPSHOT_PATH) as acquired:
+        # בדיקה שנייה תחת הנעילה: תהליך אחר אולי סיים משיכה הרגע
+        if acquired and catalog_refresh_due():
+            _last_refresh_attempt = time.time()
+            refresh_store_context()
+
+def catalog_sync_loop():
+    while True:
+        try:
+            sync_catalog()
+        except Exception as e:
+            print(f"⚠️ Catalog sync failed: {e}")
+        time.sleep(CATALOG_SYNC_SECONDS)
+
+def start_catalog_sync():
+    # threads לא עוברים fork: כל worker מפעיל את שלו (מ-gunicorn.conf.py, lifespan או initialize_store_context)
+    global _catalog_sync_pid
+    if CATALOG_SYNC_SECONDS <= 0 or _catalog_sync_pid == os.getpid(): return
+    _catalog_sync_pid = os.getpid()
+    threading.Thread(target=catalog_sync_loop, name="catalog-sync", daemon=True).start()
+
+# ================= קטלוג שנטען ב-master (gunicorn --preload) =================
+# הקטלוג והאינדקס נטענים פעם אחת ב-master, וה-workers יורשים אותם ב-fork כ-copy-on-write: דף זיכרון
+# מועתק ל-worker רק כשהוא נכתב שם. gc.freeze רק מוציא את האובייקטים האלה מהסריקות של איסוף הזבל, כך
+# שמעבר GC לא נוגע בכולם בבת אחת. כל קריאה רגילה לאובייקט עדיין כותבת את ה-refcount שלו, ולכן הדפים
+# של מה שהחיפושים נוגעים בו מועתקים בהדרגה לכל worker; רק מטריצת הווקטורים (numpy, בלי refcount לכל
+# איבר) נשארת משותפת לגמרי. רענונים ו-webhooks מגיעים כעדכונים חלקיים
+# מעל הבסיס הזה (sync_catalog), כך שהוא לא מוחלף בעותק פרטי בכל worker.
+def freeze_shared_state():
+    gc.unfreeze()  # קטלוג קודם שהוחלף משתחרר, ומחזוריות שנשארה ממנו נאספת כאן
+    gc.collect()
+    gc.freeze()
+
+def preload_store_context():
+    restored = initialize_store_context(background_sync=False)
+    freeze_shared_state()
+    return restored
+
+def reload_store_context():
+    # kill -HUP ל-master: ה-workers החדשים נוצרים ממנו, אז קודם הוא עובר ל-snapshot העדכני (בלי למשוך מהחנות)
+    with _catalog_lock, snapshot_lock(CATALOG_SNAPSHOT_PATH):
+        restored, updates = catch_up_catalog()
+    if restored: print(f"⚡ Catalog reloaded from snapshot: {len(SMART_CATALOG)} products.")
+    if restored or updates: freeze_shared_state()
+
+# ================= עדכונים חלקיים מ-WooCommerce Webhooks =================
+def patch_catalog(upserts, deleted_ids, best_sellers=None):
+    # עדכון חלקי של הקטלוג והאינדקס שבזיכרון. נקרא תחת _catalog_lock. best_sellers: (ids, names) מהחנות
+    global SMART_CATALOG, SEARCH_INDEX
+    if SEARCH_INDEX is None: return
+    index = SEARCH_INDEX.updated(upserts, deleted_ids)
+    changed = {p.id: p for p in upserts}
+    removed = set(deleted_ids)
+    catalog = [changed.pop(p.id, p) for p in SMART_CATALOG if p.id not in removed]
+    catalog.extend(changed.values())  # מה שנשאר הוא מוצרים חדשים
+
+    if best_sellers is not None:
+        best_ids, best_names = best_sellers
+    else:
+        best_ids = [pid for pid in STORE_METADATA["best_sellers_ids"] if pid not in removed]
+        best_names = [index.products[pid].name for pid in best_ids if pid in index.products][:5]
+    SMART_CATALOG, SEARCH_INDEX = catalog, index
+    STORE_METADATA["best_sellers_ids"], STORE_METADATA["best_sellers_names"] = best_ids, best_names
+    warm_thumbnails(index, best_ids)  # מה שכבר על הדיסק לא נוצר שוב
+    STORE_PAGE_CACHE.clear()  # עמודי קטגוריה/תגית שנשמרו עלולים להכיל את הגרסה הישנה
+    print(f"🔁 Catalog updated: {len(upserts)} upserted, {len(removed)} removed ({len(SMART_CATALOG)} products).")
+
+def apply_catalog_changes(upserts, deleted_ids):
+    # ה-worker שקיבל את ה-webhooks: מחיל ורושם ביומן, ושאר ה-workers מחילים מהיומן ב-sync_catalog
+    global CATALOG_JOURNAL_OFFSET
+    with _catalog_lock, snapshot_lock(CATALOG_SNAPSHOT_PATH):
+        catch_up_catalog()  # קודם מה ש-workers אחרים כבר רשמו, כך שהסדר זהה בכל התהליכים
+        if SEARCH_INDEX is None: return
+        # webhook שהגיע באיחור לא דורס גרסה חדשה יותר שכבר בקטלוג (מ-webhook אחר או מרענון)
+        upserts = [p for p in upserts if not (p.id in SEARCH_INDEX.products and p.older_than(SEARCH_INDEX.products[p.id]))]
+        if not upserts and not deleted_ids: return
+        patch_catalog(upserts, deleted_ids)
+        CATALOG_JOURNAL_OFFSET = CATALOG_JOURNAL.append(upserts, deleted_ids)
+        compact_catalog_journal()  # יומן ארוך מאוחד ל-snapshot
+
+CATALOG_UPDATES = CatalogUpdateQueue(apply_catalog_changes, debounce_seconds=WEBHOOK_DEBOUNCE_SECONDS)
+
+def handle_product_webhook(body, headers):
+    """מחזיר (payload, status). משותף ל-Flask ול-ASGI."""
+    if not WC_WEBHOOK_SECRET: return {"error": "Webhooks disabled"}, 404
+    if not verify_webhook_signature(body, headers.get("X-WC-Webhook-Signature", ""), WC_WEBHOOK_SECRET):
+        return {"error": "Invalid signature"}, 401
+    topic = headers.get("X-WC-Webhook-Topic", "")
+    if topic not in PRODUCT_TOPICS: return {"status": "ignored"}, 200  # ping ביצירת ה-webhook וכו'
     try:
-        log_entry = { "timestamp": datetime.datetime.now().isoformat(), "session_id": session_id, "user_message": user_msg, "bot_response": bot_msg, "meta": meta }
-        file_path = "chat_logs.json"
-        if not os.path.exists(file_path):
-            with open(file_path, 'w', encoding='utf-8') as f: json.dump([], f)
-        with open(file_path, 'r+', encoding='utf-8') as f:
-            content = f.read().strip()
-            data = json.loads(content) if content else []
-            data.append(log_entry)
-            f.seek(0); f.truncate(); json.dump(data, f, ensure_ascii=False, indent=2)
-    except: pass
+        product_id, record = parse_product_webhook(topic, json.loads(body))
+    except Exception as e:
+        print(f"⚠️ Bad webhook payload ({topic}): {e}")
+        return {"error": "Bad payload"}, 400
+    CATALOG_UPDATES.submit(product_id, record)
+    return {"status": "queued"}, 202
+
+def smart_search_next(query, session_data, limit=12):
+    """העמוד הבא של שאילתת טקסט לפי ה-cursor של הסשן: ממשיך מאיפה שהעמוד הקודם נגמר, בלי מוצרים שכבר נצפו."""
+    index = SEARCH_INDEX
+    if not index: return []
+    with METRICS.span("search"):
+        return next_from_cursor(index, query, index.ranked(query), session_data, limit)
+
+def listing_next(kind, name, session_data, limit=12):
+    """כמו smart_search_next, למוצרי קטגוריה / תגית מהקטלוג שבזיכרון (בלי קריאה לחנות)."""
+    index = SEARCH_INDEX
+    if not index: return []
+    with METRICS.span("search"):
+        return next_from_cursor(index, (kind, name), index.listed(kind, name), session_data, limit)
+
+def next_from_cursor(index, cursor_key, ranked, session_data, limit):
+    if session_data.cursor_query != cursor_key or session_data.cursor_generation != index.generation:
+        # רשימה אחרת, או שהאינדקס התעדכן (webhook / רענון) והמיקום שייך לדירוג אחר. מתחילים מההתחלה -
+        # מוצרים שכבר נצפו מדולגים, כך ששום דבר לא חוזר ושום דבר לא נבלע
+        session_data.cursor_query, session_data.cursor_generation, session_data.cursor_offset = cursor_key, index.generation, 0
+    products, session_data.cursor_offset = index.page_of(ranked, session_data.cursor_offset, limit,
+                                                         skip=session_data.has_seen)
+    return products
+
+# ניהול סשנים (TTL + תקרת LRU)
+USER_SESSIONS = create_session_store(SESSION_BACKEND, ttl_seconds=SESSION_TTL_SECONDS,
+                                     max_sessions=MAX_SESSIONS, db_path=SESSION_DB_PATH)
+
+CHAT_LOG = ConversationLogWriter(CHAT_LOG_PATH, max_bytes=CHAT_LOG_MAX_MB * 1024 * 1024)
+
+def log_conversation(session_id, user_msg, bot_msg, meta=None):
+    log_entry = { "timestamp": datetime.datetime.now().isoformat(), "session_id": session_id, "user_message": user_msg, "bot_response": bot_msg, "meta": meta }
+    with METRICS.span("log"):
+        CHAT_LOG.write(log_entry)
+
+LEADS = LeadStore(LEADS_DB_PATH, legacy_json_path="leads.json")
 
 def save_lead(name, phone, context):
     try:
-        file_path = "leads.json"
         clean_phone = re.sub(r'\D', '', phone)
         if not (len(clean_phone) == 10 and clean_phone.startswith('05')): return False
-        
-        leads = []
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
-                    if content: leads = json.loads(content)
-            except: leads = []
-
-        for lead in leads:
-            if re.sub(r'\D', '', lead.get('phone', '')) == clean_phone: return False
-
-        leads.append({ "timestamp": datetime.datetime.now().isoformat(), "phone": phone, "name": name, "context": context })
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(leads, f, ensure_ascii=False, indent=2)
+        with METRICS.span("save_lead"):
+            if not LEADS.add(name, phone, clean_phone, context): return False
         print(f"✅ SYSTEM: Lead saved: {phone}")
         return True
     except Exception as e:
         print(f"❌ ERROR saving lead: {e}")
         return False
 
-def get_products_html(query, session_data):
-    clean_query = query.split("<")[0].replace('`', '').replace("'", "").replace('"', "").replace('.', '').strip()
-    products = []
-    
-    # שימוש בעמוד הנוכחי של הסשן
-    current_page = session_data.get('page', 1)
+# Cache משותף לעמודי קטגוריה/תגית, לפי (סוג, id, עמוד). כשעמוד N מוגש, עמוד N+1 נטען ברקע
+STORE_PAGE_CACHE = TTLCache(ttl_seconds=STORE_CACHE_TTL_SECONDS, max_entries=STORE_CACHE_MAX_ENTRIES)
+STORE_FLIGHTS = SingleFlight("store")
+SINGLE_FLIGHTS = [RANK_FLIGHTS, STORE_FLIGHTS]  # asgi_app.py מוסיף את הגרסה האסינכרונית
+PREFETCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="prefetch")
+STORE_FETCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="store-fetch")  # הקריאה המשותפת של STORE_FLIGHTS
+_prefetching = set()
+_prefetch_lock = threading.Lock()
+
+def store_page_key(params):
+    kind = "category" if "category" in params else "tag"
+    return (kind, params[kind], params.get("page", 1))
+
+def claim_next_page(params, products):
+    """פרמטרים לעמוד הבא אם כדאי לטעון אותו מראש (עמוד מלא, לא ב-cache ולא בטעינה), אחרת None."""
+    if len(products) < params.get("per_page", 12): return None
+    next_params = dict(params, page=params.get("page", 1) + 1)
+    key = store_page_key(next_params)
+    with _prefetch_lock:
+        if key in _prefetching or key in STORE_PAGE_CACHE: return None
+        _prefetching.add(key)
+    return next_params
+
+def release_prefetch(params):
+    with _prefetch_lock:
+        _prefetching.discard(store_page_key(params))
+
+def load_store_page(params, timeout):
+    # רץ דרך STORE_FLIGHTS: בקשות מקבילות לאותו עמוד (וגם טעינה מראש שכבר באמצע) חולקות קריאה אחת לחנות
+    with STORE_BREAKER.guard():
+        products = products_from_api(wcapi.get("products", params=params, timeout=timeout).json())
+    STORE_PAGE_CACHE.set(store_page_key(params), products)
+    return products
+
+def prefetch_store_page(params):
+    try:
+        STORE_FLIGHTS.do(store_page_key(params), lambda: load_store_page(params, STORE_TIMEOUT_SECONDS))
+    except CircuitOpenError:
+        pass
+    except Exception as e:
+        print(f"⚠️ Prefetch failed for {store_page_key(params)}: {e}")
+    finally:
+        release_prefetch(params)
+
+def fetch_store_products(params):
+    key = store_page_key(params)
+    products = STORE_PAGE_CACHE.get(key)
+    if products is None:
+        try:
+            timeout = call_timeout(STORE_TIMEOUT_SECONDS)
+            with METRICS.span("store_fetch"):
+                # הקריאה לחנות משותפת לכל המחכים ולכן מקבלת את ה-timeout המלא; כל בקשה מחכה לה רק עד ה-deadline שלה
+                products = STORE_FLIGHTS.do(key, lambda: load_store_page(params, STORE_TIMEOUT_SECONDS),
+                                            timeout=timeout, executor=STORE_FETCH_POOL)
+        except Exception as e:
+            store_fallback(e)
+            return []
+
+    next_params = claim_next_page(params, products)
+    if next_params: PREFETCH_POOL.submit(prefetch_store_page, next_params)
+    return products
+
+def store_fallback(error):
+    # רשימה ריקה מהחנות -> products_flow ממשיך לחיפוש בקטלוג שבזיכרון
+    METRICS.inc("fallback_total", kind="store")
+    print(f"⚠️ Store unavailable ({type(error).__name__}: {error}) - searching the in-memory catalog")
+
+def clean_search_query(query):
+    return query.split("<")[0].replace('`', '').replace("'", "").replace('"', "").replace('.', '').strip()
+
+def products_flow(query, session_data):
+    """
+    הלוגיקה של get_products כ-generator: כשצריך עמוד מהחנות הוא עושה yield לפרמטרים של הקריאה
+    ומקבל בחזרה רשימת מוצרים. כך אותה לוגיקה רצה גם בשרת הרגיל וגם במצב האסינכרוני (asgi_app.py).
+    """
+    clean_query = clean_search_query(query)
 
     # 1. חיפוש לפי ID (עם פגינציה)
     cat_id = ID_MAPPING.get("categories", {}).get(clean_query)
     tag_id = ID_MAPPING.get("tags", {}).get(clean_query)
+    # שימוש בעמוד הנוכחי של הסשן
+    current_page = session_data.page
+    products = []
 
-    if cat_id:
-        print(f"🎯 Direct Category Match: {clean_query} -> ID {cat_id} (Page {current_page})")
-        try: products = wcapi.get("products", params={"category": cat_id, "per_page": 12, "page": current_page, "status": "publish"}).json()
-        except: pass
-    elif tag_id:
-        print(f"🎯 Direct Tag Match: {clean_query} -> ID {tag_id} (Page {current_page})")
-        try: products = wcapi.get("products", params={"tag": tag_id, "per_page": 12, "page": current_page, "status": "publish"}).json()
-        except: pass
+    if cat_id or tag_id:
+        kind, item_id = ("category", cat_id) if cat_id else ("tag", tag_id)
+        print(f"🎯 Direct {kind.title()} Match: {clean_query} -> ID {item_id} (Page {current_page})")
+        products = yield {kind: item_id, "per_page": 12, "page": current_page, "status": "publish"}
+        # === מניעת לופים: עמוד שכבר נצפה כולו ===
+        # ממשיכים מאותה קטגוריה בקטלוג שבזיכרון, ולא בסיבוב נוסף לחנות על העמוד הבא
+        if products and all(session_data.has_seen(p.id) for p in products):
+            print("⚠️ All fetched products seen. Continuing from the in-memory catalog...")
+            products = listing_next(kind, clean_query, session_data)
 
     # 2. חיפוש חכם בזיכרון או רנדומלי
     if not products:
-        stop_words = ["משהו", "כזה", "בשביל", "של", "את", "על", "עם", "תמונה", "תמונות", "ציור"]
-        words = clean_query.split()
-        filtered_words = [w for w in words if w not in stop_words]
-        final_text_query = " ".join(filtered_words) if filtered_words else clean_query
+        final_text_query = strip_stop_words(clean_query)
         
         print(f"🔍 Smart Text Search: {final_text_query} (Page {current_page})")
         
         if final_text_query.upper() in ["MORE", "עוד", "נוספים"]:
-             # אם המשתמש רוצה "עוד", נביא מדגם רחב מהקטלוג בזיכרון
-             candidates = random.sample(SMART_CATALOG, min(len(SMART_CATALOG), 60))
-             products = candidates
+             # אם המשתמש רוצה "עוד", נביא מדגם רחב מהקטלוג בזיכרון - מתוך מה שעוד לא נצפה
+             unseen = [p for p in SMART_CATALOG if not session_data.has_seen(p.id)]
+             products = random.sample(unseen, min(len(unseen), 60))
         else:
-             products = smart_search_products(final_text_query, page=current_page, limit=12)
+             products = smart_search_next(final_text_query, session_data, limit=12)
 
-    # === מניעת לופים: סינון מוצרים שכבר נצפו ===
-    seen = session_data.get('seen_ids', set())
-    new_products = [p for p in products if p['id'] not in seen]
-    
-    # אם שלפנו מוצרים אבל כולם כבר נראו -> נקדם עמוד וננסה שוב (רקורסיה)
-    # הגבלה ל-5 עומק רקורסיה כדי לא להיתקע
-    if products and not new_products:
-        print("⚠️ All fetched products seen. Advancing page...")
-        session_data['page'] += 1
-        if session_data['page'] > 10: return None # עצירת חירום
-        return get_products_html(query, session_data)
-
-    products = new_products
-    
+    products = [p for p in products if not session_data.has_seen(p.id)]
     if not products: return None
 
     # עדכון המוצרים שנצפו והעמוד הבא
-    session_data['page'] += 1
+    session_data.page += 1
     for p in products:
-        session_data.setdefault('seen_ids', set()).add(p['id'])
+        session_data.mark_seen(p.id)
+    return products
 
-    # 3. יצירת HTML (בחירת מגוון)
-    candidates = { "glass": [], "framed": [], "canvas": [], "other": [] }
-    for p in products:
-        name = p.get('name', '')
-        design_match = re.search(r'דגם\s*(\d+)', name)
-        design_id = design_match.group(1) if design_match else name 
-        item_data = {"product": p, "design_id": design_id}
-        
-        if "זכוכית" in name: candidates["glass"].append(item_data)
-        elif "מסגרת" in name or "ממוסגרת" in name: candidates["framed"].append(item_data)
-        elif "קנבס" in name: candidates["canvas"].append(item_data)
-        else: candidates["other"].append(item_data)
-
-    selected_items = []
-    used_ids = set()
-    types_order = ["glass", "framed", "canvas"]
-    
-    # ניסיון לקחת אחד מכל סוג
-    for t in types_order:
-        for item in candidates[t]:
-            if item["design_id"] not in used_ids:
-                selected_items.append(item["product"])
-                used_ids.add(item["design_id"])
-                break 
-    
-    # השלמה ל-3 מוצרים
-    remaining = candidates["glass"] + candidates["framed"] + candidates["canvas"] + candidates["other"]
-    while len(selected_items) < 3 and remaining:
-        item = remaining.pop(0)
-        if item["design_id"] not in used_ids: 
-             selected_items.append(item["product"])
-             used_ids.add(item["design_id"])
-        elif len(selected_items) == 0:
-             selected_items.append(item["product"])
-
-    cards_html = "<div class='products-grid'>"
-    for p in selected_items:
-        name = p.get('name', 'יצירת אומנות')
-        raw_price = p.get('price', '')
-        price_display = f"החל מ-{raw_price} ₪" if raw_price else "מחיר באתר"
-        link = p.get('permalink', '#')
-        img_src = p['images'][0]['src'] if p.get('images') else "https://placehold.co/400x400?text=No+Image"
-        
-        cards_html += f"""
-        <div class="product-card">
-            <img src='{img_src}' alt='{name}'>
-            <div class="product-info">
-                <div class="product-title">{name}</div>
-                <div class="product-price">{price_display}</div>
-                <a href="{link}" target="_blank" class="buy-btn">לרכישה מהירה 🛒</a>
-            </div>
-        </div>
-        """
-    cards_html += "</div>"
-    return cards_html
+# ================= Thumbnails לכרטיסים =================
+def card_image_url(p):
+    """כתובת התמונה בכרטיס: thumbnail מקומי, או התמונה המקורית כשהשירות כבוי / המוצר לא בקטלוג שבזיכרון."""
+    index = SEARCH_INDEX
+    if THUMBNAILS is None or not p.image or index is None or p.id not in index.products: return p.image
+    return f"{PUBLIC_URL}/thumb/{p.id}/{THUMBNAILS.key(p.image, p.image_version)}.{THUMBNAILS.extension}"
 
-@app.route('/chat', methods=['POST'])
-@limiter.limit(MINUTE_LIMIT) 
-@limiter.limit(DAILY_LIMIT) 
-def chat():
-    data = request.json
+def resolve_thumbnail(product_id, key):
+    """
+    מחזיר (status, value, cache_control). משותף ל-Flask ול-ASGI.
+    200 -> value הוא נתיב הקובץ; 302 -> value היא התמונה המקורית (היצירה נכשלה); 404 -> value None.
+    """
+    index = SEARCH_INDEX
+    p = index.products.get(product_id) if THUMBNAILS is not None and index is not None else None
+    if p is None or not p.image: return 404, None, None
+    with METRICS.span("thumbnail"):
+        path = THUMBNAILS.get(p.image, p.image_version)
+    if path is None: return 302, p.image, "no-cache"
+    if key != THUMBNAILS.key(p.image, p.image_version):
+        # התמונה הוחלפה מאז שהכרטיס נוצר (או worker עם קטלוג ישן יותר) - מגישים את הנוכחית, בלי cache ארוך
+        return 200, path, "public, max-age=300"
+    return 200, path, f"public, max-age={THUMB_MAX_AGE}, immutable"
+
+def get_products(query, session_data):
+    flow = products_flow(query, session_data)
+    try:
+        params = next(flow)
+        while True:
+            params = flow.send(fetch_store_products(params))
+    except StopIteration as done:
+        return done.value
+
+# ================= חיפוש ספקולטיבי (במקביל לקריאה ל-AI) =================
+SPECULATION = SpeculationTracker()
+
+def search_target(query, page):
+    """
+    מה ש-products_flow יחפש בפועל בשביל query בעמוד page: עמוד מהחנות (כמו store_page_key) או דירוג טקסט.
+    שתי שאילתות עם אותו target "קרובות מספיק" - אותה קטגוריה, או אותן מילים אחרי ניקוי ומילות מילוי.
+    """
+    clean_query = clean_search_query(query)
+    cat_id = ID_MAPPING.get("categories", {}).get(clean_query)
+    if cat_id: return ("category", cat_id, page)
+    tag_id = ID_MAPPING.get("tags", {}).get(clean_query)
+    if tag_id: return ("tag", tag_id, page)
+    text = strip_stop_words(clean_query)
+    if not text or text.upper() in ["MORE", "עוד", "נוספים"]: return None
+    return ("text", normalize_query(text))
+
+def speculative_targets(user_message, session_data):
+    """
+    החיפושים שה-AI כנראה יבקש: ההודעה עצמה (גם המסלול החלופי מחפש אותה), העמוד הבא של השאילתה
+    הקודמת ("יש עוד כאלה?"), והקטגוריות/תגיות הרלוונטיות להודעה - אותם שמות שה-AI מקבל בפרומפט, לפי הסדר.
+    מחזיר [(target, cached)]: עמודים שכבר ב-cache לא נטענים שוב (אבל נספרים ב-hit rate), ועד
+    SPECULATIVE_STORE_LOOKUPS עמודים מהחנות.
+    """
+    last_q = session_data.last_query
+    cats, tags = PROMPT_BUILDER.relevant_names(user_message)
+    targets, store_lookups = [], 0
+    for query in [user_message] + ([last_q] if last_q else []) + cats + tags:
+        target = search_target(query, session_data.page if query == last_q else 1)
+        if target is None or any(target == t for t, _ in targets): continue
+        cached = target[0] != "text" and target in STORE_PAGE_CACHE
+        if target[0] != "text" and not cached:
+            if store_lookups >= SPECULATIVE_STORE_LOOKUPS: break
+            store_lookups += 1
+        targets.append((target, cached))
+    return targets
+
+def store_page_params(target):
+    kind, item_id, page = target
+    return {kind: item_id, "per_page": 12, "page": page, "status": "publish"}
+
+def speculative_lookup(target):
+    try:
+        if target[0] == "text":
+            index = SEARCH_INDEX
+            if index: index.ranked(target[1])
+        else:
+            STORE_FLIGHTS.do(target, lambda: load_store_page(store_page_params(target), STORE_TIMEOUT_SECONDS))
+    except CircuitOpenError:
+        pass
+    except Exception as e:
+        print(f"⚠️ Speculative search failed for {target}: {e}")
+
+def start_speculation(user_message, session_data):
+    if not SPECULATIVE_SEARCH: return []
+    speculations = []
+    for target, cached in speculative_targets(user_message, session_data):
+        speculation = SPECULATION.track(target, cached)
+        if not cached: PREFETCH_POOL.submit(speculation.run, speculative_lookup, target)
+        speculations.append(speculation)
+    return speculations
+
+def resolve_speculation(speculations, query, session_data):
+    # נקרא אחרי parse_bot_response, כשהעמוד של הסשן כבר מעודכן לשאילתה של ה-AI
+    if not speculations: return
+    target = search_target(query, session_data.page) if query is not None else None
+    saved = SPECULATION.resolve(speculations, target)
+    if saved: METRICS.observe("speculative_saved_seconds", saved)
+
+def parse_chat_request(data):
+    """
+    מחזיר (user_message, history, session_id, structured, error). error = (payload, status) אם צריך לעצור.
+    history = (ההיסטוריה שהווידג'ט שלח או None, historyVersion או None) - ראה resolve_history.
+    structured: הווידג'ט ביקש replyFormat=structured - טקסט + שדות המוצרים במקום כרטיסי HTML.
+    """
+    data = data or {}
     user_message = data.get('message') or ""
     
     # הגנה מפני קריסת הטסטר על היסטוריה ריקה
-    history = data.get('history')
-    if not isinstance(history, list): history = []
+    client_history = data.get('history')
+    if not isinstance(client_history, list): client_history = None
+    client_version = data.get('historyVersion')
+    if not isinstance(client_version, int) or isinstance(client_version, bool): client_version = None
+    history = (client_history, client_version)
     
     session_id = data.get('sessionId')
+    structured = data.get('replyFormat') == "structured"
 
     if len(user_message) > MAX_INPUT_LENGTH:
-        return jsonify({"reply": "ההודעה ארוכה מדי."})
+        return user_message, history, session_id, structured, ({"reply": "ההודעה ארוכה מדי."}, 200)
 
-    if not session_id: return jsonify({"error": "No Session ID"}), 400
-    
-    # אתחול סשן עם סט "מוצרים שנצפו" למניעת כפילויות
-    if session_id not in USER_SESSIONS: 
-        USER_SESSIONS[session_id] = {
-            "page": 1, 
-            "last_query": None, 
-            "seen_ids": set()
-        }
-    
-    session_data = USER_SESSIONS[session_id]
-    
-    # שמירת ליד ישיר
+    if not session_id: return user_message, history, session_id, structured, ({"error": "No Session ID"}, 400)
+    return user_message, history, session_id, structured, None
+
+def resolve_history(history, session_data):
+    """
+    ההיסטוריה לפרומפט, [(role, טקסט, טוקנים)]. מחזיר (entries, error).
+    - בלי historyVersion (פרוטוקול ישן): ההיסטוריה המלאה מה-payload, כמו קודם.
+    - עם historyVersion בלבד: ההיסטוריה שבסשן, אם הגרסה תואמת. אחרת 409 והווידג'ט שולח שוב עם history.
+    - עם שניהם: סנכרון מחדש - הסשן מאמץ את מה שהווידג'ט שלח.
+    """
+    client_history, client_version = history
+    if client_version is None:
+        return history_from_payload(client_history or []), None
+    if client_history is not None:
+        session_data.replace_history(history_from_payload(client_history), HISTORY_TOKEN_BUDGET)
+    elif client_version != session_data.history_version:
+        return None, ({"error": "History out of sync", "historyVersion": session_data.history_version}, 409)
+    return session_data.history, None
+
+def remember_turn(history, session_data, user_message, reply, cards=None):
+    """מוסיף את התור להיסטוריה שבסשן. מחזיר את הגרסה החדשה, או None בפרוטוקול הישן."""
+    if history[1] is None: return None
+    session_data.add_history([history_entry("user", user_message), history_entry("assistant", reply, cards)],
+                             HISTORY_TOKEN_BUDGET)
+    return session_data.history_version
+
+def chat_reply(reply, history_version, cards=None):
+    payload = {"reply": reply}
+    if cards is not None: payload["products"] = cards
+    if history_version is not None: payload["historyVersion"] = history_version
+    return payload
+
+def reply_log_meta(cards, **meta):
+    if cards: meta["products"] = [c["id"] for c in cards]
+    return meta
+
+LLM_FALLBACK_TEXT = "הנה כמה תמונות שמתאימות למה שכתבת:"
+
+def llm_call_options():
+    # ה-AI מקבל את מה שנשאר מהדדליין פחות מה ששמור לשליפת המוצרים. בלי retries - הם היו חורגים מהתקציב
+    return {"timeout": call_timeout(LLM_TIMEOUT_SECONDS, reserve=STORE_RESERVE_SECONDS), "max_retries": 0}
+
+def llm_fallback_response(user_message, error):
+    """כשה-AI לא זמין (breaker פתוח, שגיאה, או שנגמר הזמן): חיפוש מילות מפתח ישירות על ההודעה."""
+    METRICS.inc("fallback_total", kind="llm")
+    print(f"⚠️ LLM unavailable ({type(error).__name__}: {error}) - keyword search reply")
+    return f"{LLM_FALLBACK_TEXT} SEARCH_ACTION: {user_message}"
+
+def record_llm_usage(usage):
+    if usage is None: return
+    METRICS.inc("llm_tokens_total", usage.prompt_tokens, kind="prompt")
+    METRICS.inc("llm_tokens_total", usage.completion_tokens, kind="completion")
+
+def build_llm_messages(user_message, history, session_data):
+    return PROMPT_BUILDER.build(user_message, history, last_query=session_data.last_query,
+                                top_sellers=STORE_METADATA['best_sellers_names'])
+
+def save_direct_lead(user_message):
     direct_phone_match = re.search(r'05\d[- ]?\d{3}[- ]?\d{4}', user_message)
     if direct_phone_match:
         save_lead("User (Direct)", direct_phone_match.group(0), user_message)
+
+def parse_bot_response(bot_response, user_message, session_data):
+    """מפעיל את SAVE_LEAD ומעדכן את שאילתת הסשן לפי SEARCH_ACTION. מחזיר (bot_response, query או None)."""
+    # === הגנה מפני הזיות: ניקוי אגרסיבי ===
+    if ("<div" in bot_response or "<img" in bot_response) and not re.search("SEARCH_ACTION", bot_response, re.IGNORECASE):
+         bot_response = re.sub(r'<[^>]+>', '', bot_response) 
+         bot_response = f"SEARCH_ACTION: {user_message}"
+
+    bot_response = bot_response.replace("```html", "").replace("```", "").strip()
+    print(f"🤖 AI: {bot_response}") 
+    
+    # ניהול ליד מה-AI
+    lead_match = re.search(r"SAVE_LEAD:?\s*([\d\-\s]+)", bot_response, re.IGNORECASE)
+    if lead_match:
+        save_lead("User (AI)", lead_match.group(1), user_message)
+        bot_response = re.sub("SAVE_LEAD:", "", bot_response.replace(lead_match.group(0), ""), flags=re.IGNORECASE).strip()
+    
+    if not bot_response: bot_response = "רשמתי, תודה!"
+
+    # ניהול חיפוש
+    search_match = re.search(r"SEARCH_ACTION:\s*(.+)", bot_response, re.IGNORECASE)
+    if not search_match: return bot_response, None
+
+    raw_query = search_match.group(1).strip()
+    query = raw_query.split('\n')[0].replace('`', '').replace("'", "").replace('"', "").strip()
     
-    # בניית הפרומפט
-    recent_history = history[-10:] if len(history) > 10 else history
-    dynamic_context = f"""
-    Available Categories: {CAT_NAMES_LIST}
-    Available Style Tags: {TAG_NAMES_LIST}
-    Top Sellers: {", ".join(STORE_METADATA['best_sellers_names'])}
+    last_q = session_data.last_query
+    if any(k in query.upper() for k in ["MORE", "עוד", "נוספים"]) and last_q:
+        query = last_q
+    elif query != last_q:
+        # שאילתה חדשה: עמוד 1, cursor חדש, ומנקים את רשימת הנצפים כדי לאפשר חזרה למוצרים
+        session_data.start_query(query)
+    return bot_response, query
+
+def compose_reply(bot_response, query, products, structured=False):
+    """
+    מחזיר (reply, cards). רגיל: reply כולל את כרטיסי ה-HTML ו-cards הוא None.
+    structured: reply הוא הטקסט בלבד ו-cards רשימת שדות המוצרים (ריקה כשאין מוצרים).
     """
+    cards = [] if structured else None
+    if query is None: return bot_response, cards
+    text_part = re.split("SEARCH_ACTION", bot_response, maxsplit=1, flags=re.IGNORECASE)[0].strip()
+    if not text_part: text_part = "הנה מה שמצאתי:"
+
+    if not products: return f"חיפשתי '{query}' אך לא מצאתי תוצאות מדויקות. נסה סגנון אחר?", cards
+
+    # יצירת הכרטיסים (בחירת מגוון)
+    with METRICS.span("render"):
+        selected = select_variety(products)
+        if structured: return text_part, card_fields(selected, card_image_url)
+        return f"{text_part}<br>{render_cards_html(selected, card_image_url)}", None
+
+def process_bot_response(bot_response, user_message, session_data, structured=False, speculations=()):
+    """מפעיל את הפקודות שה-AI החזיר (SAVE_LEAD / SEARCH_ACTION). מחזיר (reply, cards, has_products)."""
+    bot_response, query = parse_bot_response(bot_response, user_message, session_data)
+    resolve_speculation(speculations, query, session_data)
+    products = get_products(query, session_data) if query is not None else None
+    return (*compose_reply(bot_response, query, products, structured), query is not None)
+
+@app.route('/chat', methods=['POST'])
+@limiter.limit(MINUTE_LIMIT) 
+@limiter.limit(DAILY_LIMIT) 
+def chat():
+    start_deadline(CHAT_DEADLINE_SECONDS)
+    with METRICS.span("parse"):
+        user_message, history, session_id, structured, error = parse_chat_request(request.json)
+    if error is not None: return jsonify(error[0]), error[1]
+    
+    # סשן חדש נוצר עם רשימת "מוצרים שנצפו" ריקה למניעת כפילויות
+    session_data = USER_SESSIONS.get(session_id)
+    history_entries, error = resolve_history(history, session_data)
+    if error is not None: return jsonify(error[0]), error[1]
     
-    messages = [{"role": "system", "content": SYSTEM_PROMPT + dynamic_context}]
-    for msg in recent_history:
-        # המרת תוכן לסטרינג למקרה של תקלה + ניקוי HTML
-        content_str = str(msg.get('content', ''))
-        clean_content = re.sub(r'<[^>]+>', '', content_str)
-        messages.append({"role": "user" if msg.get('sender')=='user' else "assistant", "content": clean_content})
-    messages.append({"role": "user", "content": user_message})
+    # שמירת ליד ישיר
+    save_direct_lead(user_message)
 
     try:
-        completion = client.chat.completions.create(model=OPENAI_MODEL, messages=messages, temperature=0.5, max_tokens=300)
-        bot_response = completion.choices[0].message.content.strip()
-        
-        # === הגנה מפני הזיות: ניקוי אגרסיבי ===
-        if ("<div" in bot_response or "<img" in bot_response) and "SEARCH_ACTION" not in bot_response:
-             bot_response = re.sub(r'<[^>]+>', '', bot_response) 
-             bot_response = f"SEARCH_ACTION: {user_message}"
+        # הודעות שהשרת פותר לבד ("עוד", שם קטגוריה מדויק, מספר טלפון בלבד) לא עוברות ב-AI
+        bot_response = FAST_PATH.route(user_message, session_data)
+        fast_path = bot_response is not None
+        speculations = []
+        if not fast_path:
+            # החיפוש שה-AI כנראה יבקש מתחיל כבר עכשיו, ברקע
+            speculations = start_speculation(user_message, session_data)
+            # בניית הפרומפט
+            messages = build_llm_messages(user_message, history_entries, session_data)
+            try:
+                options = llm_call_options()
+                with LLM_BREAKER.guard(), METRICS.span("llm"):
+                    completion = client.with_options(**options).chat.completions.create(
+                        model=OPENAI_MODEL, messages=messages, temperature=0.5, max_tokens=300)
+                record_llm_usage(completion.usage)
+                bot_response = completion.choices[0].message.content.strip()
+            except Exception as e:
+                bot_response = llm_fallback_response(user_message, e)
+        reply, cards, has_products = process_bot_response(bot_response, user_message, session_data, structured,
+                                                          speculations)
 
-        bot_response = bot_response.replace("```html", "").replace("```", "").strip()
-        print(f"🤖 AI: {bot_response}") 
-        
-        final_html = ""
-        
-        # ניהול ליד מה-AI
-        lead_match = re.search(r"SAVE_LEAD:?\s*([\d\-\s]+)", bot_response, re.IGNORECASE)
-        if lead_match:
-            save_lead("User (AI)", lead_match.group(1), user_message)
-            bot_response = bot_response.replace(lead_match.group(0), "").replace("SAVE_LEAD:", "").strip()
-        
-        if not bot_response: bot_response = "רשמתי, תודה!"
-
-        # ניהול חיפוש
-        search_match = re.search(r"SEARCH_ACTION:\s*(.+)", bot_response)
-        if search_match:
-            raw_query = search_match.group(1).strip()
-            query = raw_query.split('\n')[0].replace('`', '').replace("'", "").replace('"', "").strip()
-            
-            last_q = session_data.get('last_query')
-            if any(k in query.upper() for k in ["MORE", "עוד", "נוספים"]) and last_q:
-                query = last_q
-            elif query != last_q:
-                session_data['last_query'] = query
-                session_data['page'] = 1 
-                # אם מחליפים שאילתה, מנקים את רשימת הנצפים כדי לאפשר חזרה למוצרים
-                session_data['seen_ids'] = set()
-            
-            products_html = get_products_html(query, session_data)
-            text_part = bot_response.split("SEARCH_ACTION")[0].strip()
-            if not text_part: text_part = "הנה מה שמצאתי:"
-
-            if products_html: final_html = f"{text_part}<br>{products_html}"
-            else: final_html = f"חיפשתי '{query}' אך לא מצאתי תוצאות מדויקות. נסה סגנון אחר?"
-        else:
-            final_html = bot_response
+        history_version = remember_turn(history, session_data, user_message, reply, cards)
 
-        log_conversation(session_id, user_message, final_html, meta={"has_products": bool(search_match)})
-        return jsonify({"reply": final_html})
+        log_conversation(session_id, user_message, reply, meta=reply_log_meta(cards, has_products=has_products, fast_path=fast_path))
+        return jsonify(chat_reply(reply, history_version, cards))
 
     except Exception as e:
         print(f"CRITICAL ERROR: {e}")
         return jsonify({"reply": "סליחה, נתקלתי בבעיה רגעית. אפשר לנסות שוב?"}), 500
+    finally:
+        USER_SESSIONS.save(session_id, session_data)
+
+@app.route('/chat/stream', methods=['POST'])
+@limiter.limit(MINUTE_LIMIT) 
+@limiter.limit(DAILY_LIMIT) 
+def chat_stream():
+    # כמו /chat, אבל הטקסט נשלח ב-SSE תוך כדי שה-AI כותב. פקודות (SEARCH_ACTION / SAVE_LEAD) לא מוצגות,
+    # והתשובה הסופית (כולל כרטיסי המוצרים) נשלחת באירוע done בסוף.
+    start_deadline(CHAT_DEADLINE_SECONDS)
+    with METRICS.span("parse"):
+        user_message, history, session_id, structured, error = parse_chat_request(request.json)
+    if error is not None: return jsonify(error[0]), error[1]
+
+    session_data = USER_SESSIONS.get(session_id)
+    history_entries, error = resolve_history(history, session_data)
+    if error is not None: return jsonify(error[0]), error[1]
+    save_direct_lead(user_message)
+
+    def generate():
+        directive_filter = DirectiveStreamFilter()
+        try:
+            bot_response = FAST_PATH.route(user_message, session_data)
+            fast_path = bot_response is not None
+            speculations = []
+            if not fast_path:
+                speculations = start_speculation(user_message, session_data)
+                parts = []
+                messages = build_llm_messages(user_message, history_entries, session_data)
+                try:
+                    options = llm_call_options()
+                    timer = UpstreamTimer()  # ה-breaker סופר רק את ההמתנה ל-OpenAI, לא לקוח SSE איטי
+                    with LLM_BREAKER.guard(timer), METRICS.span("llm"):
+                        with timer.timed():
+                            stream = client.with_options(**options).chat.completions.create(
+                                model=OPENAI_MODEL, messages=messages, temperature=0.5, max_tokens=300,
+                                stream=True, stream_options={"include_usage": True})
+                        with stream:  # נסגר גם כשנגמר הזמן באמצע
+                            for chunk in timer.iterate(stream):
+                                check_deadline()  # ה-timeout של הלקוח הוא בין chunks, לא על כל התשובה
+                                if chunk.usage: record_llm_usage(chunk.usage)
+                                if not chunk.choices: continue
+                                delta = chunk.choices[0].delta.content
+                                if not delta: continue
+                                parts.append(delta)
+                                visible = directive_filter.feed(delta)
+                                if visible: yield sse_event("token", {"text": visible})
+                    bot_response = "".join(parts).strip()
+                except Exception as e:
+                    # הטקסט שכבר הוזרם מוחלף בתשובה הסופית באירוע done
+                    bot_response = llm_fallback_response(user_message, e)
+
+            reply, cards, has_products = process_bot_response(bot_response, user_message, session_data, structured,
+                                                              speculations)
+            history_version = remember_turn(history, session_data, user_message, reply, cards)
+            log_conversation(session_id, user_message, reply,
+                                  meta=reply_log_meta(cards, has_products=has_products, streamed=True, fast_path=fast_path))
+            yield sse_event("done", chat_reply(reply, history_version, cards))
+        except Exception as e:
+            print(f"CRITICAL ERROR: {e}")
+            yield sse_event("error", {"reply": "סליחה, נתקלתי בבעיה רגעית. אפשר לנסות שוב?"})
+        finally:
+            USER_SESSIONS.save(session_id, session_data)
+            g.pop("metrics_deferred", None)
+
+    g.metrics_deferred = True  # המדידה נסגרת רק כשה-stream נגמר (ראה end_request_metrics)
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def collect_stats():
+    return {
+        "sessions": USER_SESSIONS.stats(),
+        "store_page_cache": STORE_PAGE_CACHE.stats(),
+        "fast_path": FAST_PATH.stats(),
+        "catalog_products": len(SMART_CATALOG),
+        "catalog_updates": CATALOG_UPDATES.stats(),
+        "thumbnails": THUMBNAILS.stats() if THUMBNAILS is not None else None,
+        "circuits": {breaker.name: breaker.stats() for breaker in (LLM_BREAKER, STORE_BREAKER)},
+        "single_flight": {flights.name: flights.stats() for flights in SINGLE_FLIGHTS},
+        "speculative_search": SPECULATION.stats(),
+    }
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(collect_stats())
+
+# ================= מדידות (Prometheus) =================
+METRICS.register_callback("catalog_products", "gauge", "Products in the in-memory catalog", lambda: len(SMART_CATALOG))
+METRICS.register_callback("sessions_active", "gauge", "Live chat sessions", lambda: USER_SESSIONS.stats()["active"])
+METRICS.register_callback("sessions_evicted_total", "counter", "Sessions evicted by TTL / LRU",
+                          lambda: {"ttl": USER_SESSIONS.evicted_ttl, "lru": USER_SESSIONS.evicted_lru})
+METRICS.register_callback("store_page_cache_total", "counter", "Store page cache lookups and evictions",
+                          lambda: {"hit": STORE_PAGE_CACHE.hits, "miss": STORE_PAGE_CACHE.misses, "eviction": STORE_PAGE_CACHE.evictions})
+METRICS.register_callback("fast_path_total", "counter", "Chat turns answered without / with the LLM", FAST_PATH.stats)
+METRICS.register_callback("catalog_webhooks_total", "counter", "Product webhooks received and update batches applied",
+                          lambda: {k: v for k, v in CATALOG_UPDATES.stats().items() if k != "pending"})
+METRICS.register_callback("chat_log_dropped_total", "counter", "Log entries dropped on a full queue", lambda: CHAT_LOG.dropped)
+METRICS.register_callback("single_flight_coalesced_total", "counter", "Callers that shared an identical in-flight search or store fetch",
+                          lambda: {f.name: f.coalesced for f in SINGLE_FLIGHTS})
+METRICS.register_callback("single_flight_leaders_total", "counter", "Searches / store fetches actually computed by the single-flight layer",
+                          lambda: {f.name: f.leaders for f in SINGLE_FLIGHTS})
+METRICS.register_callback("speculative_search_total", "counter", "Chat turns whose LLM search matched / missed / skipped the speculative search",
+                          lambda: {"hit": SPECULATION.hits, "miss": SPECULATION.misses, "unused": SPECULATION.unused})
+METRICS.register_callback("speculative_lookups_total", "counter", "Speculative searches started alongside the LLM call",
+                          lambda: SPECULATION.started)
+METRICS.register_callback("circuit_open", "gauge", "1 while an upstream circuit breaker is open or half-open",
+                          lambda: {b.name: int(b.state != "closed") for b in (LLM_BREAKER, STORE_BREAKER)})
+METRICS.register_callback("circuit_opened_total", "counter", "Times each upstream circuit breaker tripped",
+                          lambda: {b.name: b.opened for b in (LLM_BREAKER, STORE_BREAKER)})
+METRICS.register_callback("circuit_rejected_total", "counter", "Calls skipped because the circuit was open",
+                          lambda: {b.name: b.rejected for b in (LLM_BREAKER, STORE_BREAKER)})
+if THUMBNAILS is not None:
+    METRICS.register_callback("thumbnails_total", "counter", "Thumbnail cache hits, generations, failures and evictions",
+                              lambda: {k: v for k, v in THUMBNAILS.stats().items() if k not in ("files", "bytes")})
+    METRICS.register_callback("thumbnail_cache_bytes", "gauge", "Thumbnail disk cache size", lambda: THUMBNAILS.stats()["bytes"])
+
+@app.before_request
+def begin_request_metrics():
+    METRICS.begin_request()
+
+@app.after_request
+def remember_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def end_request_metrics(exc):
+    # ב-/chat/stream זה רץ פעמיים: כשה-view מחזיר את ה-Response (מדלגים), ושוב כש-stream_with_context
+    # סוגר את ה-generator - כך שהזמן כולל את כל התשובה
+    if g.get("metrics_deferred"): return
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    status = 500 if exc is not None else g.get("response_status", 500)
+    METRICS.end_request(endpoint, status, SLOW_REQUEST_SECONDS)
+
+@app.route('/webhooks/woocommerce', methods=['POST'])
+@limiter.exempt
+def woocommerce_webhook():
+    payload, status = handle_product_webhook(request.get_data(), request.headers)
+    return jsonify(payload), status
+
+@app.route('/thumb/<int:product_id>/<key>.<ext>', methods=['GET'])
+@limiter.exempt
+def thumbnail(product_id, key, ext):
+    # תמונות נטענות על ידי הדפדפן עם כל תשובה - לא נספרות במכסת הצ'אט. רק תמונות של מוצרים מהקטלוג
+    status, value, cache_control = resolve_thumbnail(product_id, key)
+    if status == 404: return jsonify({"error": "Not found"}), 404
+    if status == 302:
+        response = redirect(value)
+    else:
+        response = send_file(value, mimetype=THUMBNAILS.media_type, conditional=True, etag=True)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+@app.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == '__main__':
     initialize_store_context()
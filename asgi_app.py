@@ -0,0 +1,358 @@
+# asgi_app.py
+
+# ================= מצב שרת אסינכרוני (ASGI) =================
+# אותו בוט - אותן פונקציות ואותו מצב (קטלוג, סשנים, לידים, לוג) מ-app.py - אבל הקריאות
+# ל-OpenAI ול-WooCommerce הן async מעל connection pool משותף, כך שתהליך אחד מחזיק
+# מאות שיחות פתוחות בלי להחזיק thread לכל אחת.
+# הרצה: uvicorn asgi_app:app --port 5000
+
+import asyncio
+import contextlib
+import os
+
+from limits import parse
+from limits.aio.strategies import FixedWindowRateLimiter
+from limits.storage import storage_from_string
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.routing import Route
+
+import app as bot
+from product_record import products_from_api
+from resilience import CircuitOpenError, UpstreamTimer, call_timeout, check_deadline, start_deadline
+from singleflight import AsyncSingleFlight
+from store_api import AsyncStoreClient
+from streaming import DirectiveStreamFilter, sse_event
+
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_POOL_SIZE", "100"))  # חיבורים פתוחים במקביל לכל שירות
+
+aclient = AsyncOpenAI(api_key=bot.OPENAI_API_KEY, base_url=bot.OPENAI_BASE_URL)
+astore = AsyncStoreClient(url=bot.WC_URL, consumer_key=bot.WC_KEY, consumer_secret=bot.WC_SECRET,
+                          version="wc/v3", timeout=60, pool_size=ASYNC_POOL_SIZE)
+
+# ================= הגבלת קצב (אותן מגבלות כמו Flask-Limiter ב-app.py) =================
+# אותו אחסון כמו ב-app.py, בגרסה האסינכרונית שלו (async+redis://...)
+_rate_limiter = FixedWindowRateLimiter(storage_from_string(
+    bot.RATELIMIT_STORAGE_URI if bot.RATELIMIT_STORAGE_URI.startswith("async+") else f"async+{bot.RATELIMIT_STORAGE_URI}"))
+CHAT_LIMITS = [parse(bot.MINUTE_LIMIT), parse(bot.DAILY_LIMIT)]
+DEFAULT_LIMITS = [parse(limit) for limit in bot.DEFAULT_LIMITS]
+
+
+async def check_rate_limit(request, limits, scope):
+    if not bot.RATELIMIT_ENABLED: return None
+    key = request.client.host if request.client else "unknown"
+    for limit in limits:
+        if not await _rate_limiter.hit(limit, scope, key):
+            return JSONResponse({"error": f"Rate limit exceeded: {limit}"}, status_code=429)
+    return None
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except Exception:
+        return {}
+
+
+# ================= חיפוש מוצרים (אותו flow, שליפה async) =================
+STORE_FLIGHTS = AsyncSingleFlight("store_async")
+bot.SINGLE_FLIGHTS.append(STORE_FLIGHTS)
+
+
+async def load_store_page(params, timeout):
+    with bot.STORE_BREAKER.guard():
+        response = await astore.get("products", params=params, timeout=timeout)
+    products = products_from_api(response.json())
+    bot.STORE_PAGE_CACHE.set(bot.store_page_key(params), products)
+    return products
+
+
+async def prefetch_store_page(params):
+    try:
+        await STORE_FLIGHTS.do(bot.store_page_key(params), lambda: load_store_page(params, bot.STORE_TIMEOUT_SECONDS))
+    except CircuitOpenError:
+        pass
+    except Exception as e:
+        print(f"⚠️ Prefetch failed for {bot.store_page_key(params)}: {e}")
+    finally:
+        bot.release_prefetch(params)
+
+
+_background_tasks = set()
+
+async def fetch_store_products(params):
+    # אותו cache ואותה טעינה מראש של העמוד הבא כמו ב-app.py
+    key = bot.store_page_key(params)
+    products = bot.STORE_PAGE_CACHE.get(key)
+    if products is None:
+        try:
+            timeout = call_timeout(bot.STORE_TIMEOUT_SECONDS)
+            with bot.METRICS.span("store_fetch"):
+                # כמו ב-app.py: הקריאה המשותפת עם ה-timeout המלא, כל בקשה מחכה רק עד ה-deadline שלה
+                products = await STORE_FLIGHTS.do(key, lambda: load_store_page(params, bot.STORE_TIMEOUT_SECONDS),
+                                                  timeout=timeout)
+        except Exception as e:
+            bot.store_fallback(e)
+            return []
+
+    next_params = bot.claim_next_page(params, products)
+    if next_params:
+        task = asyncio.create_task(prefetch_store_page(next_params))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    return products
+
+
+async def speculative_lookup(target):
+    # כמו bot.speculative_lookup: הדירוג ב-threadpool כדי לא לעכב את הקריאה ל-AI, העמוד מהחנות async
+    try:
+        if target[0] == "text":
+            index = bot.SEARCH_INDEX
+            if index: await run_in_threadpool(index.ranked, target[1])
+        else:
+            params = bot.store_page_params(target)
+            await STORE_FLIGHTS.do(target, lambda: load_store_page(params, bot.STORE_TIMEOUT_SECONDS))
+    except CircuitOpenError:
+        pass
+    except Exception as e:
+        print(f"⚠️ Speculative search failed for {target}: {e}")
+
+
+def start_speculation(user_message, session_data):
+    if not bot.SPECULATIVE_SEARCH: return []
+    speculations = []
+    for target, cached in bot.speculative_targets(user_message, session_data):
+        speculation = bot.SPECULATION.track(target, cached)
+        if not cached:
+            task = asyncio.create_task(speculation.run_async(speculative_lookup, target))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        speculations.append(speculation)
+    return speculations
+
+
+def step_flow(flow, value):
+    # StopIteration לא יכול לצאת מ-run_in_threadpool (בתוך קורוטינה הוא הופך ל-RuntimeError)
+    try:
+        return False, flow.send(value)
+    except StopIteration as done:
+        return True, done.value
+
+
+async def get_products(query, session_data):
+    # הדירוג בקטלוג (וההמתנה ב-RANK_FLIGHTS, שהוא threading) חוסם - כל צעד של ה-flow רץ ב-threadpool,
+    # ורק השליפה מהחנות async על ה-event loop
+    flow = bot.products_flow(query, session_data)
+    finished, value = await run_in_threadpool(step_flow, flow, None)
+    while not finished:
+        finished, value = await run_in_threadpool(step_flow, flow, await fetch_store_products(value))
+    return value
+
+
+async def save_session(session_id, session_data):
+    # shield: גם כשהלקוח התנתק באמצע ה-stream (והבקשה בוטלה) הסשן נשמר עד הסוף
+    await asyncio.shield(run_in_threadpool(bot.USER_SESSIONS.save, session_id, session_data))
+
+
+async def process_bot_response(bot_response, user_message, session_data, structured=False, speculations=()):
+    # SAVE_LEAD כותב ל-SQLite
+    bot_response, query = await run_in_threadpool(bot.parse_bot_response, bot_response, user_message, session_data)
+    bot.resolve_speculation(speculations, query, session_data)
+    products = await get_products(query, session_data) if query is not None else None
+    return (*bot.compose_reply(bot_response, query, products, structured), query is not None)
+
+
+# ================= נקודות קצה =================
+async def chat(request):
+    limited = await check_rate_limit(request, CHAT_LIMITS, "chat")
+    if limited: return limited
+
+    start_deadline(bot.CHAT_DEADLINE_SECONDS)
+    with bot.METRICS.span("parse"):
+        user_message, history, session_id, structured, error = bot.parse_chat_request(await read_json(request))
+    if error is not None: return JSONResponse(error[0], status_code=error[1])
+
+    # סשנים (SQLite) ולידים - ב-threadpool, לא על ה-event loop
+    session_data = await run_in_threadpool(bot.USER_SESSIONS.get, session_id)
+    history_entries, error = bot.resolve_history(history, session_data)
+    if error is not None: return JSONResponse(error[0], status_code=error[1])
+    await run_in_threadpool(bot.save_direct_lead, user_message)
+
+    try:
+        bot_response = bot.FAST_PATH.route(user_message, session_data)
+        fast_path = bot_response is not None
+        speculations = []
+        if not fast_path:
+            speculations = start_speculation(user_message, session_data)
+            messages = bot.build_llm_messages(user_message, history_entries, session_data)
+            try:
+                options = bot.llm_call_options()
+                with bot.LLM_BREAKER.guard(), bot.METRICS.span("llm"):
+                    completion = await aclient.with_options(**options).chat.completions.create(
+                        model=bot.OPENAI_MODEL, messages=messages, temperature=0.5, max_tokens=300)
+                bot.record_llm_usage(completion.usage)
+                bot_response = completion.choices[0].message.content.strip()
+            except Exception as e:
+                bot_response = bot.llm_fallback_response(user_message, e)
+        reply, cards, has_products = await process_bot_response(bot_response, user_message, session_data, structured,
+                                                                speculations)
+        history_version = bot.remember_turn(history, session_data, user_message, reply, cards)
+
+        bot.log_conversation(session_id, user_message, reply, meta=bot.reply_log_meta(cards, has_products=has_products, fast_path=fast_path))
+        return JSONResponse(bot.chat_reply(reply, history_version, cards))
+
+    except Exception as e:
+        print(f"CRITICAL ERROR: {e}")
+        return JSONResponse({"reply": "סליחה, נתקלתי בבעיה רגעית. אפשר לנסות שוב?"}, status_code=500)
+    finally:
+        await save_session(session_id, session_data)
+
+
+async def chat_stream(request):
+    limited = await check_rate_limit(request, CHAT_LIMITS, "chat_stream")
+    if limited: return limited
+
+    start_deadline(bot.CHAT_DEADLINE_SECONDS)
+    with bot.METRICS.span("parse"):
+        user_message, history, session_id, structured, error = bot.parse_chat_request(await read_json(request))
+    if error is not None: return JSONResponse(error[0], status_code=error[1])
+
+    # סשנים (SQLite) ולידים - ב-threadpool, לא על ה-event loop
+    session_data = await run_in_threadpool(bot.USER_SESSIONS.get, session_id)
+    history_entries, error = bot.resolve_history(history, session_data)
+    if error is not None: return JSONResponse(error[0], status_code=error[1])
+    await run_in_threadpool(bot.save_direct_lead, user_message)
+
+    async def generate():
+        directive_filter = DirectiveStreamFilter()
+        try:
+            bot_response = bot.FAST_PATH.route(user_message, session_data)
+            fast_path = bot_response is not None
+            speculations = []
+            if not fast_path:
+                speculations = start_speculation(user_message, session_data)
+                parts = []
+                messages = bot.build_llm_messages(user_message, history_entries, session_data)
+                try:
+                    options = bot.llm_call_options()
+                    timer = UpstreamTimer()  # ה-breaker סופר רק את ההמתנה ל-OpenAI, לא לקוח SSE איטי
+                    with bot.LLM_BREAKER.guard(timer), bot.METRICS.span("llm"):
+                        with timer.timed():
+                            stream = await aclient.with_options(**options).chat.completions.create(
+                                model=bot.OPENAI_MODEL, messages=messages, temperature=0.5, max_tokens=300,
+                                stream=True, stream_options={"include_usage": True})
+                        async with stream:
+                            async for chunk in timer.aiterate(stream):
+                                check_deadline()
+                                if chunk.usage: bot.record_llm_usage(chunk.usage)
+                                if not chunk.choices: continue
+                                delta = chunk.choices[0].delta.content
+                                if not delta: continue
+                                parts.append(delta)
+                                visible = directive_filter.feed(delta)
+                                if visible: yield sse_event("token", {"text": visible})
+                    bot_response = "".join(parts).strip()
+                except Exception as e:
+                    bot_response = bot.llm_fallback_response(user_message, e)
+
+            reply, cards, has_products = await process_bot_response(bot_response, user_message, session_data,
+                                                                    structured, speculations)
+            history_version = bot.remember_turn(history, session_data, user_message, reply, cards)
+            bot.log_conversation(session_id, user_message, reply,
+                                  meta=bot.reply_log_meta(cards, has_products=has_products, streamed=True, fast_path=fast_path))
+            yield sse_event("done", bot.chat_reply(reply, history_version, cards))
+        except Exception as e:
+            print(f"CRITICAL ERROR: {e}")
+            yield sse_event("error", {"reply": "סליחה, נתקלתי בבעיה רגעית. אפשר לנסות שוב?"})
+        finally:
+            await save_session(session_id, session_data)
+
+    return StreamingResponse(generate(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def stats(request):
+    limited = await check_rate_limit(request, DEFAULT_LIMITS, "stats")
+    if limited: return limited
+    return JSONResponse(bot.collect_stats())
+
+
+async def woocommerce_webhook(request):
+    payload, status = bot.handle_product_webhook(await request.body(), request.headers)
+    return JSONResponse(payload, status_code=status)
+
+
+async def thumbnail(request):
+    # יצירת thumbnail חדש מושכת את התמונה מהחנות ומקודדת אותה - ב-thread, לא ב-event loop
+    status, value, cache_control = await run_in_threadpool(bot.resolve_thumbnail, request.path_params["product_id"],
+                                                           request.path_params["key"])
+    if status == 404: return JSONResponse({"error": "Not found"}, status_code=404)
+    if status == 302: return RedirectResponse(value, status_code=302, headers={"Cache-Control": cache_control})
+    return FileResponse(value, media_type=bot.THUMBNAILS.media_type, headers={"Cache-Control": cache_control})
+
+
+async def metrics(request):
+    return PlainTextResponse(bot.METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+class RequestMetricsMiddleware:
+    """מודד כל בקשה מתחילתה ועד שנשלח הבייט האחרון (גם ב-stream), כמו before/teardown_request ב-app.py."""
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = paths
+        self.prefixes = [(path.split("{")[0], path) for path in paths if "{" in path]  # /thumb/{product_id:int}/...
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start": status = message["status"]
+            await send(message)
+
+        bot.METRICS.begin_request()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            endpoint = scope["path"] if scope["path"] in self.paths else next(
+                (path for prefix, path in self.prefixes if scope["path"].startswith(prefix)), "unmatched")
+            bot.METRICS.end_request(endpoint, status, bot.SLOW_REQUEST_SECONDS)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    # טעינת הקטלוג (או snapshot) לפני שמתחילים לקבל בקשות - אלא אם ה-master של gunicorn כבר טען אותו
+    if bot.SEARCH_INDEX is None:
+        await asyncio.to_thread(bot.initialize_store_context)
+    else:
+        bot.start_catalog_sync()
+    print("🚀 ArteryBot (ASGI) Running...")
+    yield
+    await astore.aclose()
+    await aclient.close()
+
+
+routes = [
+    Route("/chat", chat, methods=["POST"]),
+    Route("/chat/stream", chat_stream, methods=["POST"]),
+    Route("/stats", stats, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+    Route("/webhooks/woocommerce", woocommerce_webhook, methods=["POST"]),
+    Route("/thumb/{product_id:int}/{key}.{ext}", thumbnail, methods=["GET"]),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(RequestMetricsMiddleware, paths={route.path for route in routes}),
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+    ],
+    lifespan=lifespan,
+)
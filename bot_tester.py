@@ -3,6 +3,11 @@ import json
 import time
 import uuid
 import sys
+import random
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from colorama import init, Fore, Style
 
 # תיקון תצוגת עברית בווינדוס
@@ -185,6 +190,73 @@ def main():
 
     print_header("✨ כל הבדיקות הסתיימו! ✨")
 
+# ==========================
+# מצב עומס: הרבה סשנים סינתטיים במקביל
+# (מומלץ מול stub_servers.py כדי לא לשרוף קרדיטים ולא להעמיס על החנות)
+# ==========================
+LOAD_MESSAGES = [
+    "בא לי לראות תמונות אנימה", "משהו רגוע לסלון", "יש לכם פופ ארט?", "תראה לי עוד", "עוד",
+    "תמונה של אריה בשחור לבן", "כמה זמן המשלוח?", "משהו יוקרתי בזהב", "ים ושקיעה", "מותגים",
+]
+
+def percentile(sorted_values, pct):
+    if not sorted_values: return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+def run_load_test(url, sessions, turns, concurrency, think_time=0.0):
+    print_header(f"📈 בדיקת עומס: {sessions} סשנים x {turns} הודעות ({concurrency} במקביל)")
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    run_id = uuid.uuid4().hex[:6]
+
+    def run_session(i):
+        http = requests.Session()
+        sid = f"load_{run_id}_{i}"
+        history = []
+        for _ in range(turns):
+            message = random.choice(LOAD_MESSAGES)
+            start = time.perf_counter()
+            try:
+                response = http.post(url, json={"message": message, "history": history, "sessionId": sid}, timeout=60)
+                status = response.status_code
+                if status == 200:
+                    history += [{"sender": "user", "content": message}, {"sender": "bot", "content": response.json().get("reply", "")}]
+            except requests.exceptions.RequestException:
+                status = "error"
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+            if think_time: time.sleep(think_time)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run_session, range(sessions)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ok = statuses.get(200, 0)
+    print(f"{Fore.CYAN}בקשות: {len(latencies)}  |  זמן כולל: {wall:.2f}s  |  תפוקה: {Style.BRIGHT}{len(latencies) / wall:.1f} req/s")
+    print(f"{Fore.CYAN}Latency  p50: {percentile(latencies, 50) * 1000:.0f}ms  p95: {percentile(latencies, 95) * 1000:.0f}ms  "
+          f"p99: {percentile(latencies, 99) * 1000:.0f}ms  max: {latencies[-1] * 1000 if latencies else 0:.0f}ms")
+    color = Fore.GREEN if ok == len(latencies) else Fore.YELLOW
+    print(f"{color}סטטוסים: {dict(statuses)}")
+    if statuses.get(429): print(f"{Fore.YELLOW}⚠️ Rate Limit פעיל - להרצת עומס הפעל את השרת עם RATELIMIT_ENABLED=0")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ArteryBot integration & load tests")
+    parser.add_argument("--load", action="store_true", help="מצב עומס במקום תסריט הבדיקות")
+    parser.add_argument("--url", default=BASE_URL)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--think-time", type=float, default=0.0, help="השהיה בין הודעות באותו סשן (שניות)")
+    args = parser.parse_args()
 
-    main()
+    if args.load:
+        run_load_test(args.url, args.sessions, args.turns, args.concurrency, args.think_time)
+    else:
+        BASE_URL = args.url
+        main()
@@ -0,0 +1,119 @@
+# catalog_snapshot.py
+
+# ================= שמירת הקטלוג לדיסק (Snapshot) =================
+# קובץ בינארי: כותרת קבועה (magic, גרסה, זמן יצירה) ואחריה pickle דחוס ב-zlib.
+# מאפשר לעלות מיד אחרי ריסטארט ולרענן מול החנות ברקע. שינויים אחרי ה-snapshot (webhooks, רענון מהחנות)
+# עוברים בין תהליכים ביומן (catalog_updates.UpdateJournal), וה-snapshot נכתב מחדש רק באיחוד של היומן.
+# לצד ה-snapshot: <path>.base - ממה הוא נגזר (כדי שתהליך שכבר החיל את אותו יומן לא יטען אותו שוב),
+# ו-<path>.refreshed - מתי הקטלוג נמשך לאחרונה מהחנות.
+
+import json
+import os
+import pickle
+import struct
+import time
+import zlib
+
+from file_lock import file_lock
+
+SNAPSHOT_MAGIC = b"ARTSNAP\x00"
+SNAPSHOT_VERSION = 7  # 2: מטריצת וקטורים, 3: ProductRecord במקום JSON של WooCommerce, 4: עדכונים חלקיים באינדקס, 5: image_version, 6: generation, 7: modified
+_HEADER = struct.Struct("<8sIQ")  # magic, version, created_at (epoch seconds)
+
+
+def save_snapshot(path, catalog, metadata, index):
+    payload = zlib.compress(pickle.dumps({
+        "catalog": catalog,
+        "metadata": metadata,
+        "index": index,
+    }, protocol=pickle.HIGHEST_PROTOCOL), 6)
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, int(time.time()))
+
+    # כתיבה לקובץ זמני והחלפה אטומית, כדי ש-worker אחר לא יקרא קובץ חצי כתוב
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return len(header) + len(payload)
+
+
+def snapshot_created_at(path):
+    """זמן היצירה מהכותרת בלבד (בלי לפרוס את כל הקובץ), או None."""
+    try:
+        with open(path, "rb") as f:
+            magic, version, created_at = _HEADER.unpack(f.read(_HEADER.size))
+    except (OSError, struct.error):
+        return None
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION: return None
+    return created_at
+
+
+def snapshot_id(path):
+    """מזהה לגרסת הקובץ (inode + זמן שינוי): כל save_snapshot מחליף את הקובץ, ולכן מזהה חדש. None אם אין קובץ."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def save_snapshot_lineage(path, parent_id, journal_end):
+    """ה-snapshot שנשמר עכשיו שווה ל-parent_id ועוד היומן עד journal_end (איחוד). parent_id=None: נבנה מאפס."""
+    with open(f"{path}.base", "w") as f:
+        json.dump({"parent": parent_id, "journal_end": journal_end}, f)
+
+
+def snapshot_lineage(path):
+    """(parent_id, journal_end) מ-save_snapshot_lineage, או (None, 0)."""
+    try:
+        with open(f"{path}.base") as f:
+            lineage = json.load(f)
+    except (OSError, ValueError):
+        return None, 0
+    parent = lineage.get("parent")
+    return (tuple(parent) if parent else None), lineage.get("journal_end", 0)
+
+
+def mark_refreshed(path):
+    with open(f"{path}.refreshed", "a"):
+        pass
+    os.utime(f"{path}.refreshed")
+
+
+def last_refreshed(path):
+    """מתי הקטלוג נמשך לאחרונה מהחנות: הסימון של mark_refreshed, או זמן היצירה של ה-snapshot. None אם אין."""
+    try:
+        return os.path.getmtime(f"{path}.refreshed")
+    except OSError:
+        return snapshot_created_at(path)
+
+
+def snapshot_lock(path):
+    # כמה workers שמעדכנים את ה-snapshot (webhooks) עובדים עליו אחד אחרי השני
+    return file_lock(f"{path}.lock")
+
+
+def try_refresh_lock(path):
+    """נעילה בלי המתנה למשיכת קטלוג מלא מהחנות: מחזיר True רק לתהליך אחד, כל השאר ממשיכים הלאה."""
+    return file_lock(f"{path}.refresh.lock", blocking=False)
+
+
+def load_snapshot(path):
+    """מחזיר dict עם catalog/metadata/index/created_at, או None אם אין קובץ תקין מהגרסה הנוכחית."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size: return None
+            magic, version, created_at = _HEADER.unpack(header)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                print(f"⚠️ Ignoring catalog snapshot {path} (version {version}, expected {SNAPSHOT_VERSION})")
+                return None
+            data = pickle.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠️ Could not read catalog snapshot {path}: {e}")
+        return None
+    data["created_at"] = created_at
+    return data
@@ -0,0 +1,174 @@
+# catalog_updates.py
+
+# ================= עדכוני קטלוג מ-WooCommerce Webhooks =================
+# WooCommerce שולח product.created / product.updated / product.deleted עם חתימת HMAC-SHA256 (base64)
+# של הגוף בכותרת X-WC-Webhook-Signature. השינויים נאספים בתור ומוחלים באצווה אחת אחרי שקט קצר
+# (debounce), כך שייבוא של מאות מוצרים בונה אינדקס חדש פעם אחת ולא מאות פעמים.
+# ה-worker שקיבל את ה-webhook רושם את האצווה ביומן (UpdateJournal) ליד ה-snapshot, וכל שאר ה-workers
+# מחילים אותה אצלם מהיומן - בלי לטעון מחדש את כל הקטלוג. רענון תקופתי מהחנות נרשם שם באותה צורה.
+
+import base64
+import hashlib
+import hmac
+import os
+import pickle
+import struct
+import threading
+import time
+
+from product_record import ProductRecord
+
+PRODUCT_TOPICS = {"product.created", "product.updated", "product.deleted", "product.restored"}
+
+
+def verify_webhook_signature(body, signature, secret):
+    if not secret or not signature: return False
+    expected = base64.b64encode(hmac.new(secret.encode("utf-8"), body, hashlib.sha256).digest()).decode("ascii")
+    return hmac.compare_digest(expected, signature.strip())
+
+
+def parse_product_webhook(topic, payload):
+    """(product_id, ProductRecord או None למחיקה). מוצר שכבר לא מפורסם יוצא מהקטלוג כמו מחיקה."""
+    product_id = payload["id"]
+    if topic == "product.deleted" or payload.get("status", "publish") != "publish":
+        return product_id, None
+    return product_id, ProductRecord.from_api(payload)
+
+
+class UpdateJournal:
+    """
+    יומן אצוות העדכונים שנצברו מאז ה-snapshot האחרון: רשומות (זמן, upserts, deleted_ids, best_sellers)
+    אחת אחרי השנייה. best_sellers: (ids, names) מרענון מהחנות, או None.
+    כל הקריאות נעשות תחת snapshot_lock. snapshot שנבנה מאפס מוחק את היומן (reset); איחוד היומן
+    ל-snapshot שומר אותו כ-<path>.prev (rotate) לתהליכים שעוד לא סיימו להחיל אותו.
+    """
+    _LENGTH = struct.Struct("<I")
+
+    def __init__(self, path):
+        self.path = path
+        self.previous_path = f"{path}.prev"
+
+    def append(self, upserts, deleted_ids, best_sellers=None):
+        """מחזיר את סוף היומן אחרי הרשומה - המיקום שממנו התהליך הכותב ממשיך לקרוא."""
+        data = pickle.dumps((time.time(), upserts, deleted_ids, best_sellers), protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.path, "ab") as f:
+            f.write(self._LENGTH.pack(len(data)) + data)  # כתיבה אחת, כך שקורא לא רואה חצי רשומה
+            return f.tell()
+
+    def read(self, offset=0, previous=False):
+        """([(זמן, upserts, deleted_ids, best_sellers)], המיקום החדש) - הרשומות שנכתבו מאז offset."""
+        try:
+            with open(self.previous_path if previous else self.path, "rb") as f:
+                f.seek(offset)
+                raw = f.read()
+        except FileNotFoundError:
+            return [], 0
+        batches, pos = [], 0
+        while pos + self._LENGTH.size <= len(raw):
+            (length,) = self._LENGTH.unpack_from(raw, pos)
+            end = pos + self._LENGTH.size + length
+            if end > len(raw): break
+            try:
+                batches.append(pickle.loads(raw[pos + self._LENGTH.size:end]))
+            except Exception as e:
+                print(f"⚠️ Skipping unreadable catalog update record: {e}")
+            pos = end
+        return batches, offset + pos
+
+    def rotate(self):
+        try:
+            os.replace(self.path, self.previous_path)
+        except FileNotFoundError:
+            self.reset()
+
+    def reset(self):
+        for path in (self.path, self.previous_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class CatalogUpdateQueue:
+    def __init__(self, apply_fn, debounce_seconds=2.0, max_delay=10.0, max_batch=500, retry_seconds=30.0):
+        self.apply_fn = apply_fn  # apply_fn(upserts, deleted_ids)
+        self.debounce_seconds = debounce_seconds
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.retry_seconds = retry_seconds
+        self._pending = {}  # id -> ProductRecord / None. עדכון מאוחר דורס מוקדם, אלא אם ה-date_modified שלו ישן יותר
+        self._first_at = None
+        self._last_at = None
+        self._retry_at = 0.0  # אחרי אצווה שנכשלה ממתינים לפני ניסיון נוסף
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self.received = 0
+        self.batches = 0
+        self.failed_batches = 0
+
+    def submit(self, product_id, record):
+        with self._cond:
+            now = time.monotonic()
+            if not self._pending: self._first_at = now
+            self._last_at = now
+            self.received += 1
+            current = self._pending.get(product_id)
+            if record is None or current is None or not record.older_than(current):
+                self._pending[product_id] = record
+            self._ensure_thread()
+            self._cond.notify()
+
+    def _ensure_thread(self):
+        # נקרא תחת הנעילה. אחרי fork (gunicorn) ה-thread של האב לא קיים בבן
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(): return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="catalog-updates", daemon=True)
+        self._thread.start()
+
+    def _due_in(self, now):
+        if len(self._pending) >= self.max_batch: due = now
+        else: due = min(self._last_at + self.debounce_seconds, self._first_at + self.max_delay)
+        return max(due, self._retry_at) - now
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                wait = self._due_in(time.monotonic())
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                batch, self._pending = self._pending, {}
+            self._apply(batch)
+
+    def _apply(self, batch):
+        upserts = [record for record in batch.values() if record is not None]
+        deleted_ids = [pid for pid, record in batch.items() if record is None]
+        try:
+            self.apply_fn(upserts, deleted_ids)
+            self.batches += 1
+        except Exception as e:
+            self.failed_batches += 1
+            print(f"❌ ERROR applying catalog updates ({len(batch)} products): {e}. Retrying in {self.retry_seconds:.0f}s")
+            self._requeue(batch)
+
+    def _requeue(self, batch):
+        # האצווה חוזרת לתור. מה שהגיע בזמן הניסיון חדש יותר ונשאר, אלא אם ה-date_modified שלו ישן יותר
+        with self._cond:
+            now = time.monotonic()
+            if not self._pending: self._first_at = self._last_at = now
+            for product_id, record in batch.items():
+                current = self._pending.get(product_id, record)
+                if current is record or (current is not None and record is not None and current.older_than(record)):
+                    self._pending[product_id] = record
+            self._retry_at = now + self.retry_seconds
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "received": self.received,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+        }
@@ -0,0 +1,109 @@
+# chat_log.py
+
+# ================= לוג שיחות (JSONL, כתיבה ברקע) =================
+# הבקשה רק מכניסה רשומה לתור בזיכרון. thread רקע כותב את התור במנות לקובץ JSONL
+# (שורה לכל רשומה, append בלבד), מחליף קובץ לפי גודל או תאריך, ומרוקן את התור בכיבוי.
+# כמה workers כותבים לאותו קובץ: הבדיקה, ההחלפה והכתיבה נעשות תחת נעילת קובץ משותפת, כך שרק
+# תהליך אחד מחליף, ואף תהליך לא ממשיך לכתוב לקובץ שכבר הוחלף.
+
+import atexit
+import datetime
+import json
+import os
+import queue
+import threading
+
+from file_lock import file_lock
+
+_STOP = object()
+
+
+class ConversationLogWriter:
+    def __init__(self, path="chat_logs.jsonl", batch_size=200, flush_interval=1.0,
+                 max_bytes=50 * 1024 * 1024, rotate_daily=True, max_queue=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def write(self, entry):
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            # עדיף לאבד שורת לוג מאשר לעכב את /chat
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"⚠️ Chat log queue full, dropped {self.dropped} entries so far.")
+
+    def _ensure_thread(self):
+        # נבדק גם לפי pid: אחרי fork ה-thread של התהליך האב לא קיים בילד
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(): return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(): return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while True:
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size: break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch: self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            lines = "".join(json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in batch)
+            with file_lock(f"{self.path}.lock"):
+                self._rotate_if_needed()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            self.written += len(batch)
+        except Exception as e:
+            print(f"❌ ERROR writing chat log ({len(batch)} entries lost): {e}")
+
+    def _rotate_if_needed(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        today = datetime.date.today()
+        file_day = datetime.date.fromtimestamp(stat.st_mtime)
+        if stat.st_size < self.max_bytes and not (self.rotate_daily and file_day != today): return
+
+        root, ext = os.path.splitext(self.path)
+        stamp = datetime.datetime.fromtimestamp(stat.st_mtime).strftime("%Y%m%d-%H%M%S")
+        rotated = f"{root}-{stamp}{ext}"
+        n = 1
+        while os.path.exists(rotated):
+            rotated = f"{root}-{stamp}-{n}{ext}"
+            n += 1
+        os.replace(self.path, rotated)
+        print(f"🗄️ Chat log rotated -> {rotated}")
+
+    def close(self, timeout=5):
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid(): return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
@@ -0,0 +1,55 @@
+# fast_path.py
+
+# ================= מסלול מהיר (בלי AI) =================
+# הודעות שהשרת יודע לענות עליהן לבד מקבלות תשובה "כאילו" מה-AI (אותן פקודות SEARCH_ACTION),
+# כך שהן עוברות באותו עיבוד ומחזירות אותו מבנה תשובה - רק בלי סבב מול OpenAI.
+
+import re
+import threading
+
+MORE_WORDS = {"עוד", "more", "נוספים"}
+PHONE_ONLY_RE = re.compile(r'05\d[- ]?\d{3}[- ]?\d{4}')
+
+
+def normalize_message(message):
+    return re.sub(r'[^\w\s]', '', message).strip().lower()
+
+
+class FastPathRouter:
+    def __init__(self, id_mapping):
+        # מפתח מנורמל -> שם הקטגוריה/תגית המקורי (כפי שמופיע ב-ID_MAPPING)
+        self.lookup = {}
+        for group in ("tags", "categories"):  # קטגוריה גוברת על תגית באותו שם, כמו ב-products_flow
+            for name in id_mapping.get(group, {}):
+                self.lookup[normalize_message(name)] = name
+        self.counters = {"more": 0, "category_or_tag": 0, "phone_only": 0, "llm": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, route):
+        with self._lock:
+            self.counters[route] += 1
+
+    def route(self, user_message, session_data):
+        """תשובת bot_response סינתטית אם ההודעה לא צריכה את ה-AI, אחרת None."""
+        normalized = normalize_message(user_message)
+
+        if normalized in MORE_WORDS and session_data.last_query:
+            self._count("more")
+            return "הנה עוד אפשרויות: SEARCH_ACTION: MORE"
+
+        name = self.lookup.get(normalized)
+        if name:
+            self._count("category_or_tag")
+            return f"בטח, הנה מה שמצאתי: SEARCH_ACTION: {name}"
+
+        if PHONE_ONLY_RE.fullmatch(user_message.strip()):
+            # הליד כבר נשמר ע"י save_direct_lead
+            self._count("phone_only")
+            return "רשמתי את המספר, נציג יחזור אליך בהקדם! 🙏"
+
+        self._count("llm")
+        return None
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
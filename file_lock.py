@@ -0,0 +1,31 @@
+# file_lock.py
+
+# ================= נעילת קובץ בין תהליכים =================
+# כמה workers של gunicorn שכותבים לאותם קבצים (snapshot הקטלוג, לוג השיחות, cache ה-thumbnails)
+# עובדים עליהם אחד אחרי השני דרך flock על קובץ נעילה לידם. flock שייך לקובץ הפתוח, כך שגם threads
+# באותו תהליך מחכים אחד לשני.
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: אין נעילה בין תהליכים, וממילא אין שם gunicorn
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """נעילה בלעדית על path. blocking=False: מחזיר False מיד אם תהליך אחר מחזיק בה, אחרת True."""
+    if fcntl is None:
+        yield True
+        return
+    with open(path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
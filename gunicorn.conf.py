@@ -0,0 +1,63 @@
+# gunicorn.conf.py
+
+# ================= הרצה עם כמה workers =================
+# gunicorn -c gunicorn.conf.py app:app
+# gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi_app:app
+#
+# הקטלוג נטען פעם אחת ב-master (preload_app), וה-workers מתחילים ממנו ב-fork (copy-on-write) -
+# בלי 8 הורדות מהחנות בעלייה. gc.freeze רק מונע מאיסוף הזבל לסרוק אותו; refcounts עדיין מעתיקים
+# בהדרגה את הדפים שה-workers קוראים (ראה app.py).
+# רענון ועדכונים מ-webhooks לא מחליפים workers ולא מחליפים את הקטלוג המשותף: worker אחד מושך מהחנות
+# כל CATALOG_REFRESH_MINUTES ורושם ביומן רק את ההבדלים, וכל worker מחיל אותם בעצמו (sync_catalog).
+# kill -HUP <master pid> עדיין מחליף workers, וה-master מחיל קודם את מה שהצטבר.
+# PRELOAD_CATALOG=0: כל worker טוען את הקטלוג בעצמו (מה-snapshot, אם יש).
+
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "8"))
+worker_class = os.getenv("WORKER_CLASS", "gthread")
+threads = int(os.getenv("WORKER_THREADS", "8"))  # קריאות AI ארוכות לא תופסות worker שלם
+timeout = 120
+
+# בקשות של אותה שיחה (ושל אותו IP) מגיעות ל-workers שונים: הסשן (עמוד, מוצרים שנצפו, גרסת ההיסטוריה)
+# ומוני הגבלת הקצב חייבים להיות משותפים. לסשנים ברירת המחדל כאן היא sqlite; למונים אין אחסון משותף
+# בלי שרת, ולכן memory עם יותר מ-worker אחד לא עולה בכלל (המגבלות היו רופפות פי מספר ה-workers)
+if workers > 1:
+    if os.environ.setdefault("SESSION_BACKEND", "sqlite") == "memory":
+        raise RuntimeError("SESSION_BACKEND=memory keeps each session inside one worker - "
+                           "use SESSION_BACKEND=sqlite or WEB_CONCURRENCY=1")
+    if (os.getenv("RATELIMIT_ENABLED", "1") != "0"
+            and os.getenv("RATELIMIT_STORAGE_URI", "memory://").removeprefix("async+").startswith("memory://")):
+        raise RuntimeError("RATELIMIT_STORAGE_URI=memory:// counts requests per worker - "
+                           "set RATELIMIT_STORAGE_URI=redis://host:6379 (pip install redis) or WEB_CONCURRENCY=1")
+
+PRELOAD_CATALOG = os.getenv("PRELOAD_CATALOG", "1") != "0"
+
+preload_app = PRELOAD_CATALOG
+
+
+def when_ready(server):
+    if not PRELOAD_CATALOG: return
+    import app as bot
+    bot.preload_store_context()
+    server.log.info("Catalog preloaded in master: %d products", len(bot.SMART_CATALOG))
+
+
+def on_reload(server):
+    if not PRELOAD_CATALOG: return
+    import app as bot
+    bot.reload_store_context()
+
+
+def post_fork(server, worker):
+    if not PRELOAD_CATALOG: return
+    import app as bot
+    bot.start_catalog_sync()
+
+
+def post_worker_init(worker):
+    # בלי preload כל worker טוען לבד (ב-ASGI זה קורה ב-lifespan)
+    if PRELOAD_CATALOG or worker.cfg.worker_class_str.startswith("uvicorn"): return
+    import app as bot
+    if bot.SEARCH_INDEX is None: bot.initialize_store_context()
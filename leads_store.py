@@ -0,0 +1,73 @@
+# leads_store.py
+
+# ================= מאגר לידים (SQLite) =================
+# WAL מאפשר קוראים במקביל לכותב, ואינדקס ייחודי על הטלפון המנורמל הופך את בדיקת הכפילות
+# לחלק מה-INSERT עצמו - בלי לטעון את כל הקובץ ובלי מרוץ בין שתי בקשות.
+
+import datetime
+import json
+import os
+import re
+
+from sqlite_conn import LocalConnection
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leads (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp  TEXT NOT NULL,
+    phone      TEXT NOT NULL,
+    phone_norm TEXT NOT NULL,
+    name       TEXT,
+    context    TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS leads_phone_norm ON leads (phone_norm);
+CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class LeadStore:
+    def __init__(self, db_path="leads.db", legacy_json_path="leads.json"):
+        self.db_path = db_path
+        self._conn = LocalConnection(db_path)  # חיבור לכל thread (ולכל תהליך, אחרי fork)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        if legacy_json_path: self._import_legacy(legacy_json_path)
+
+    def add(self, name, phone, phone_norm, context):
+        """מחזיר True אם הליד נשמר, False אם הטלפון כבר קיים."""
+        cur = self._conn().execute(
+            "INSERT OR IGNORE INTO leads (timestamp, phone, phone_norm, name, context) VALUES (?, ?, ?, ?, ?)",
+            (datetime.datetime.now().isoformat(), phone, phone_norm, name, context))
+        return cur.rowcount == 1
+
+    def _import_legacy(self, path):
+        # ייבוא חד פעמי של leads.json מהגרסה הקודמת
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM store_meta WHERE key = 'legacy_imported'").fetchone(): return
+        leads = []
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    content = f.read().strip()
+                    if content: leads = json.loads(content)
+            except Exception as e:
+                print(f"⚠️ Could not import {path}: {e}")
+                return
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            imported = 0
+            for lead in leads:
+                phone = str(lead.get('phone', ''))
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO leads (timestamp, phone, phone_norm, name, context) VALUES (?, ?, ?, ?, ?)",
+                    (lead.get('timestamp') or datetime.datetime.now().isoformat(), phone, re.sub(r'\D', '', phone),
+                     lead.get('name'), lead.get('context')))
+                imported += cur.rowcount
+            conn.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('legacy_imported', ?)",
+                         (datetime.datetime.now().isoformat(),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if leads: print(f"📥 Imported {imported} leads from {path}")
@@ -0,0 +1,141 @@
+# metrics.py
+
+# ================= מדידות ו-/metrics (פורמט Prometheus) =================
+# span(stage) מודד כל שלב בבקשה (AI, חיפוש, חנות, רינדור, לוג, ליד) להיסטוגרמה,
+# ובמקביל רושם אותו ב-trace של הבקשה הנוכחית (contextvars - עובד גם ב-threads וגם ב-asyncio),
+# כדי שבקשה איטית תודפס עם הפירוק שלה לשלבים.
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(labels):
+    if not labels: return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper: self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self, prefix="artery", buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}    # (name, labels) -> float
+        self._help = {}        # name -> (type, help)
+        self._callbacks = []   # (name, type, help, fn) - ערכים שנקראים ברגע ה-scrape
+        self._lock = threading.Lock()
+        self._trace = ContextVar(f"{prefix}_trace", default=None)
+
+    def describe(self, name, metric_type, help_text):
+        self._help[name] = (metric_type, help_text)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None: hist = self._histograms[key] = Histogram(self.buckets)
+            hist.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def register_callback(self, name, metric_type, help_text, fn):
+        """fn מחזיר מספר, או dict של {label_value: מספר} ל-metric עם label אחד בשם 'kind'."""
+        self._callbacks.append((name, metric_type, help_text, fn))
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("stage_seconds", elapsed, stage=stage)
+            trace = self._trace.get()
+            if trace is not None: trace["spans"].append((stage, elapsed))
+
+    # ---- מעקב ברמת בקשה ----
+    def begin_request(self):
+        self._trace.set({"start": time.perf_counter(), "spans": []})
+
+    def end_request(self, endpoint, status, slow_threshold=0):
+        trace = self._trace.get()
+        if trace is None: return
+        self._trace.set(None)
+        elapsed = time.perf_counter() - trace["start"]
+        self.observe("request_seconds", elapsed, endpoint=endpoint)
+        self.inc("requests_total", endpoint=endpoint, status=str(status))
+        if slow_threshold and elapsed >= slow_threshold:
+            breakdown = ", ".join(f"{stage}={d * 1000:.0f}ms" for stage, d in trace["spans"])
+            print(f"🐢 Slow request {endpoint} ({status}) {elapsed:.2f}s: {breakdown}")
+
+    # ---- פורמט Prometheus ----
+    def render(self):
+        lines = []
+        seen = set()
+
+        def header(name):
+            if name in seen: return
+            seen.add(name)
+            metric_type, help_text = self._help.get(name, ("untyped", ""))
+            full = f"{self.prefix}_{name}"
+            if help_text: lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {metric_type}")
+
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            hist_snapshot = [(k, list(h.counts), h.sum, h.count) for k, h in histograms]
+
+        for (name, labels), counts, total, count in hist_snapshot:
+            header(name)
+            full = f"{self.prefix}_{name}"
+            for upper, c in zip(self.buckets, counts):
+                lines.append(f"{full}_bucket{_label_str(labels + (('le', upper),))} {c}")
+            lines.append(f"{full}_bucket{_label_str(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{full}_sum{_label_str(labels)} {total}")
+            lines.append(f"{full}_count{_label_str(labels)} {count}")
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f"{self.prefix}_{name}{_label_str(labels)} {value}")
+
+        for name, metric_type, help_text, fn in self._callbacks:
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"⚠️ Metric {name} failed: {e}")
+                continue
+            self._help.setdefault(name, (metric_type, help_text))
+            header(name)
+            if isinstance(value, dict):
+                for kind, v in sorted(value.items()):
+                    lines.append(f"{self.prefix}_{name}{_label_str((('kind', kind),))} {v}")
+            else:
+                lines.append(f"{self.prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
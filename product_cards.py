@@ -0,0 +1,84 @@
+# product_cards.py
+
+# ================= בחירת מוצרים לתצוגה וכרטיסי HTML =================
+# מתוך עמוד תוצאות נבחרים עד 3 מוצרים במגוון (זכוכית / ממוסגרת / קנבס) ובלי שני מוצרים מאותו דגם.
+# הכרטיסים יוצאים כ-HTML מוכן (ווידג'טים ישנים), או כשדות בלבד שהווידג'ט מרנדר מ-template.
+# בנפרד מ-app.py כדי שגם search_benchmark.py ימדוד בדיוק את אותה בחירה.
+
+import re
+
+
+def select_variety(products):
+    """עד 3 מוצרים, אחד מכל סוג (זכוכית / ממוסגרת / קנבס) ובלי שני מוצרים מאותו דגם."""
+    candidates = { "glass": [], "framed": [], "canvas": [], "other": [] }
+    for p in products:
+        name = p.name
+        design_match = re.search(r'דגם\s*(\d+)', name)
+        design_id = design_match.group(1) if design_match else name 
+        item_data = {"product": p, "design_id": design_id}
+        
+        if "זכוכית" in name: candidates["glass"].append(item_data)
+        elif "מסגרת" in name or "ממוסגרת" in name: candidates["framed"].append(item_data)
+        elif "קנבס" in name: candidates["canvas"].append(item_data)
+        else: candidates["other"].append(item_data)
+
+    selected_items = []
+    used_ids = set()
+    types_order = ["glass", "framed", "canvas"]
+    
+    # ניסיון לקחת אחד מכל סוג
+    for t in types_order:
+        for item in candidates[t]:
+            if item["design_id"] not in used_ids:
+                selected_items.append(item["product"])
+                used_ids.add(item["design_id"])
+                break 
+    
+    # השלמה ל-3 מוצרים
+    remaining = candidates["glass"] + candidates["framed"] + candidates["canvas"] + candidates["other"]
+    while len(selected_items) < 3 and remaining:
+        item = remaining.pop(0)
+        if item["design_id"] not in used_ids: 
+             selected_items.append(item["product"])
+             used_ids.add(item["design_id"])
+        elif len(selected_items) == 0:
+             selected_items.append(item["product"])
+    return selected_items
+
+
+def render_cards_html(selected_items, image_url=None):
+    # image_url(p): כתובת התמונה לכרטיס (thumbnail מקומי). בלעדיה - התמונה המקורית מהחנות
+    cards_html = "<div class='products-grid'>"
+    for p in selected_items:
+        name = p.name or 'יצירת אומנות'
+        raw_price = p.price
+        price_display = f"החל מ-{raw_price} ₪" if raw_price else "מחיר באתר"
+        link = p.permalink
+        img_src = (image_url(p) if image_url else p.image) or "https://placehold.co/400x400?text=No+Image"
+        
+        cards_html += f"""
+        <div class="product-card">
+            <img src='{img_src}' alt='{name}'>
+            <div class="product-info">
+                <div class="product-title">{name}</div>
+                <div class="product-price">{price_display}</div>
+                <a href="{link}" target="_blank" class="buy-btn">לרכישה מהירה 🛒</a>
+            </div>
+        </div>
+        """
+    cards_html += "</div>"
+    return cards_html
+
+
+def card_fields(selected_items, image_url=None):
+    """אותם כרטיסים כשדות בלבד (replyFormat=structured). התצוגה - מחיר, שם ברירת מחדל - נעשית בווידג'ט."""
+    return [
+        {
+            "id": p.id,
+            "name": p.name,
+            "price": p.price,
+            "permalink": p.permalink,
+            "thumbnail": (image_url(p) if image_url else p.image) or None,
+        }
+        for p in selected_items
+    ]
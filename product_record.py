@@ -0,0 +1,56 @@
+# product_record.py
+
+# ================= רשומת מוצר קומפקטית =================
+# מה-JSON המלא של WooCommerce (תיאורים, meta_data, attributes, כל התמונות והקישורים) נשמרים רק
+# השדות שהחיפוש והכרטיסים צריכים. שמות קטגוריות ותגיות עוברים sys.intern, כך שאלפי מוצרים
+# מאותה קטגוריה מחזיקים מחרוזת אחת.
+
+import sys
+
+
+class ProductRecord:
+    __slots__ = ("id", "name", "price", "permalink", "image", "image_version", "categories", "tags",
+                 "modified")
+
+    def __init__(self, id, name="", price="", permalink="#", image=None, categories=(), tags=(), image_version="",
+                 modified=""):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.permalink = permalink
+        self.image = image            # src של התמונה הראשונה, או None
+        self.image_version = image_version  # date_modified של התמונה - חלק ממפתח ה-thumbnail
+        self.categories = categories  # tuple של שמות (interned)
+        self.tags = tags
+        self.modified = modified      # date_modified של המוצר (ISO) - עדכון ישן לא דורס חדש
+
+    @classmethod
+    def from_api(cls, p):
+        images = p.get('images')
+        image = images[0] if images else None
+        return cls(
+            p['id'],
+            p.get('name', ''),
+            p.get('price', ''),
+            p.get('permalink', '#'),
+            image['src'] if image else None,
+            tuple(sys.intern(c['name']) for c in p.get('categories', [])),
+            tuple(sys.intern(t['name']) for t in p.get('tags', [])),
+            (image.get('date_modified_gmt') or image.get('date_modified') or p.get('date_modified') or "") if image else "",
+            p.get('date_modified_gmt') or p.get('date_modified') or "",
+        )
+
+    def older_than(self, other):
+        """True כשהגרסה הזו ישנה מ-other לפי date_modified (בלי תאריך באחד מהם - לא ידוע, False)."""
+        return bool(self.modified and other.modified and self.modified < other.modified)
+
+    def fields(self):
+        """כל השדות, להשוואה בין גרסאות של אותו מוצר (רענון מהחנות מול מה שבזיכרון)."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"ProductRecord({self.id}, {self.name!r})"
+
+
+def products_from_api(items):
+    return [ProductRecord.from_api(p) for p in items]
@@ -0,0 +1,110 @@
+# prompt_builder.py
+
+# ================= בניית הפרומפט לפי תקציב טוקנים =================
+# החלק הקבוע (SYSTEM_PROMPT) נבנה פעם אחת ונשלח ראשון ובדיוק באותה צורה בכל בקשה, כך שגם
+# ה-prompt caching של OpenAI תופס אותו. אחריו באות רק הקטגוריות/תגיות שרלוונטיות להודעה ולסשן
+# (מתוך אינדקס שנבנה מראש מ-id_mapping.json), וההיסטוריה נחתכת לפי טוקנים ולא לפי מספר הודעות.
+# ההיסטוריה מגיעה כבר נקייה: [(role, טקסט, טוקנים)] - מהסשן בשרת, או מה-payload דרך history_from_payload.
+
+import re
+
+HEBREW_PREFIXES = "הבלוכמש"  # "לאנימה" / "והחיות" -> "אנימה" / "חיות"
+
+
+def estimate_tokens(text):
+    # הערכה בלי tokenizer: עברית יוצאת בערך 2.5 תווים לטוקן, אנגלית בערך 4
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return int(non_ascii / 2.5 + (len(text) - non_ascii) / 4) + 1
+
+
+def history_entry(role, content, products=None):
+    """
+    (role, טקסט בלי HTML, טוקנים) או None להודעה ריקה. כרטיסי המוצרים נשארים רק כשמות ומחירים -
+    מתוך ה-HTML, או מ-products כשהתשובה הגיעה במבנה (replyFormat=structured).
+    """
+    if products:
+        content = f"{content} " + " ".join(f"{c.get('name', '')} {c.get('price', '')}" for c in products if isinstance(c, dict))
+    text = re.sub(r'\s+', ' ', re.sub(r'<[^>]+>', ' ', str(content))).strip()
+    if not text: return None
+    return (role, text, estimate_tokens(text) + 4)  # 4 = תקורה של הודעה
+
+
+def history_from_payload(history):
+    """ההיסטוריה שהווידג'ט שלח (פרוטוקול ישן או סנכרון מחדש), באותה צורה של ההיסטוריה שבשרת."""
+    entries = []
+    for msg in history[-50:]:
+        if not isinstance(msg, dict): continue
+        products = msg.get('products') if isinstance(msg.get('products'), list) else None
+        entry = history_entry("user" if msg.get('sender') == 'user' else "assistant", msg.get('content', ''), products)
+        if entry: entries.append(entry)
+    return entries
+
+
+def _words(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def _variants(word):
+    yield word
+    # הסרת עד שתי אותיות שימוש מתחילת המילה
+    for _ in range(2):
+        if len(word) > 3 and word[0] in HEBREW_PREFIXES:
+            word = word[1:]
+            yield word
+        else:
+            break
+
+
+class PromptBuilder:
+    def __init__(self, system_prompt, id_mapping, token_budget=4000, max_names=25, fallback_names=10):
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.system_tokens = estimate_tokens(system_prompt)
+        self.token_budget = token_budget
+        self.max_names = max_names
+
+        # מילה -> קטגוריות/תגיות שהיא מופיעה בשמן
+        self.categories = list(id_mapping.get("categories", {}).keys())
+        self.tags = list(id_mapping.get("tags", {}).keys())
+        self._name_kind = {name: "tag" for name in self.tags}
+        self._name_kind.update({name: "category" for name in self.categories})
+        self._word_to_names = {}
+        for name in self._name_kind:
+            for word in set(_words(name)):
+                self._word_to_names.setdefault(word, set()).add(name)
+        self.fallback_categories = self.categories[:fallback_names]
+
+    def relevant_names(self, *texts):
+        scores = {}
+        for text in texts:
+            if not text: continue
+            for word in _words(text):
+                for variant in _variants(word):
+                    for name in self._word_to_names.get(variant, ()):
+                        scores[name] = scores.get(name, 0) + 1
+        ranked = sorted(scores, key=lambda n: (-scores[n], len(n)))[:self.max_names]
+        cats = [n for n in ranked if self._name_kind[n] == "category"]
+        tags = [n for n in ranked if self._name_kind[n] == "tag"]
+        return cats, tags
+
+    def build(self, user_message, history, last_query=None, top_sellers=()):
+        cats, tags = self.relevant_names(user_message, last_query)
+        if not cats and not tags: cats = self.fallback_categories
+        dynamic_context = f"""
+    Relevant Categories: {", ".join(cats)}
+    Relevant Style Tags: {", ".join(tags)}
+    Top Sellers: {", ".join(top_sellers)}
+    """
+        context_message = {"role": "system", "content": dynamic_context}
+        user_entry = {"role": "user", "content": user_message}
+
+        remaining = (self.token_budget - self.system_tokens - estimate_tokens(dynamic_context)
+                     - estimate_tokens(user_message))
+        trimmed = []
+        # מהחדש לישן, עד שנגמר התקציב
+        for role, content, cost in reversed(history):
+            if cost > remaining: break
+            remaining -= cost
+            trimmed.append({"role": role, "content": content})
+        trimmed.reverse()
+
+        return [self.system_message, context_message] + trimmed + [user_entry]
@@ -0,0 +1,183 @@
+# resilience.py
+
+# ================= תקציב זמן לבקשה ו-Circuit Breakers =================
+# לכל בקשת צ'אט יש דדליין אחד מקצה לקצה (contextvars, כמו ה-trace ב-metrics.py), שממנו כל קריאה
+# החוצה לוקחת timeout: ה-AI מקבל את מה שנשאר פחות שמירה לשליפת המוצרים, והחנות את מה שנשאר אחריו.
+# לכל שירות חיצוני (OpenAI, WooCommerce) יש breaker שנפתח כשיותר מדי מהקריאות האחרונות נכשלו או היו
+# איטיות. כשהוא פתוח לא מחכים לשירות בכלל - הבוט עונה מהמסלול החלופי (חיפוש בזיכרון) - ואחרי
+# open_seconds קריאת בדיקה אחת עוברת: הצליחה -> סגור, נכשלה -> פתוח שוב.
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+_deadline = ContextVar("request_deadline", default=None)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def start_deadline(seconds):
+    """מתחיל את תקציב הזמן של הבקשה הנוכחית. 0 = בלי דדליין."""
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def time_left():
+    """שניות שנשארו לבקשה הנוכחית, או None אם אין דדליין (למשל טעינה ברקע)."""
+    deadline = _deadline.get()
+    if deadline is None: return None
+    return deadline - time.monotonic()
+
+
+def call_timeout(cap, reserve=0.0, minimum=0.5):
+    """timeout לקריאה החוצה: עד cap, ולא יותר ממה שנשאר פחות reserve. DeadlineExceeded אם נשאר פחות מ-minimum."""
+    left = time_left()
+    if left is None: return cap
+    timeout = min(cap, left - reserve)
+    if timeout < minimum: raise DeadlineExceeded(f"{left:.1f}s left")
+    return timeout
+
+
+def check_deadline():
+    left = time_left()
+    if left is not None and left <= 0: raise DeadlineExceeded("deadline passed")
+
+
+class CircuitBreaker:
+    def __init__(self, name, window=20, min_calls=5, failure_rate=0.5, slow_call_seconds=None, slow_rate=0.5,
+                 open_seconds=30.0):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self._calls = deque(maxlen=window)  # (ok, slow) של הקריאות האחרונות
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started = None  # half-open: מתי יצאה קריאת הבדיקה שעוד לא חזרה
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._state == CLOSED: return True
+            if self._state == OPEN:
+                if now - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self._state = HALF_OPEN
+            # half-open: קריאה אחת בכל פעם (ואם הקודמת נתקעה יותר מ-open_seconds - עוד אחת)
+            if self._probe_started is not None and now - self._probe_started < self.open_seconds:
+                self.rejected += 1
+                return False
+            self._probe_started = now
+            return True
+
+    def record(self, elapsed, ok):
+        slow = self.slow_call_seconds is not None and elapsed >= self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_started = None
+                if ok and not slow:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    print(f"✅ Circuit {self.name} closed")
+                else:
+                    self._trip()
+                return
+            self._calls.append((ok, slow))
+            if self._state == CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(1 for call_ok, _ in self._calls if not call_ok)
+                slow_calls = sum(1 for _, call_slow in self._calls if call_slow)
+                if failures >= self.failure_rate * len(self._calls) or slow_calls >= self.slow_rate * len(self._calls):
+                    self._trip()
+
+    def _trip(self):
+        # נקרא תחת הנעילה
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+        self.opened += 1
+        print(f"⛔ Circuit {self.name} opened for {self.open_seconds:.0f}s")
+
+    def _release_probe(self):
+        with self._lock:
+            self._probe_started = None
+
+    @contextmanager
+    def guard(self, timer=None):
+        """
+        עוטף קריאה לשירות: CircuitOpenError אם ה-breaker פתוח, ותוצאת הקריאה (הצלחה/חריגה, זמן) נרשמת.
+        timer (UpstreamTimer): ב-streaming נמדד רק הזמן שחיכינו לשירות, לא הזמן שבו הלקוח קרא את מה שכבר הגיע.
+        """
+        if not self.allow(): raise CircuitOpenError(f"{self.name} circuit open")
+        start = time.monotonic()
+        elapsed = (lambda: timer.elapsed) if timer is not None else (lambda: time.monotonic() - start)
+        try:
+            yield
+        except DeadlineExceeded:
+            # תקציב הזמן של הבקשה שלנו נגמר - לא כשל של השירות
+            self._release_probe()
+            raise
+        except Exception:
+            self.record(elapsed(), ok=False)
+            raise
+        except BaseException:
+            # הלקוח התנתק באמצע (GeneratorExit / ביטול) - לא אומר כלום על השירות
+            self._release_probe()
+            raise
+        self.record(elapsed(), ok=True)
+
+    def stats(self):
+        return {"state": self.state, "opened": self.opened, "rejected": self.rejected}
+
+
+class UpstreamTimer:
+    """סופר רק את הזמן שבו חיכינו לשירות: הקריאה שפותחת את ה-stream וכל קריאה של chunk ממנו."""
+    _END = object()
+
+    def __init__(self):
+        self.elapsed = 0.0
+
+    @contextmanager
+    def timed(self):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.elapsed += time.monotonic() - start
+
+    def iterate(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.timed():
+                item = next(iterator, self._END)
+            if item is self._END: return
+            yield item
+
+    async def aiterate(self, iterable):
+        iterator = aiter(iterable)
+        while True:
+            with self.timed():
+                item = await anext(iterator, self._END)
+            if item is self._END: return
+            yield item
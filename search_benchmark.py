@@ -0,0 +1,196 @@
+# search_benchmark.py
+
+# ================= בנצ'מרק חיפוש ובחירת מוצרים (offline) =================
+# מריץ שאילתות מוקלטות (JSONL, למשל chat_logs.jsonl) מול קטלוג סינתטי בגודל נתון, דרך אותו מסלול
+# של העמוד הראשון בצ'אט: strip_stop_words -> SearchIndex.next_page -> select_variety -> render_cards_html.
+# מדווח QPS, התפלגות זמנים, זיכרון, ומשווה את התוצאות מול ריצה קודמת (--save / --compare).
+#
+# הרצה:
+#   python search_benchmark.py --catalog-size 50000 --corpus chat_logs.jsonl --save before.json
+#   ... שינוי בחיפוש ...
+#   python search_benchmark.py --catalog-size 50000 --corpus chat_logs.jsonl --compare before.json --max-p95-ms 20 --min-overlap 0.9
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from bot_tester import percentile
+from product_cards import select_variety, render_cards_html
+from product_record import products_from_api
+from search_index import SearchIndex, CONCEPT_SYNONYMS, strip_stop_words
+from stub_servers import build_catalog, SUBJECTS, STYLES, FORMATS
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+PAGE_SIZE = 12
+MAX_QUERY_LENGTH = 500  # כמו MAX_INPUT_LENGTH ב-app.py
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None  # לא לינוקס
+
+
+def load_corpus(path, field=None, limit=None):
+    """שאילתות מקובץ JSONL: השדה field, או query / user_message (הפורמט של chat_logs.jsonl)."""
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            text = entry.get(field) if field else (entry.get("query") or entry.get("user_message"))
+            if isinstance(text, str) and text.strip() and len(text) <= MAX_QUERY_LENGTH:
+                queries.append(text.strip())
+            if limit and len(queries) >= limit: break
+    return queries
+
+
+def synthetic_queries(count, seed=7):
+    """שאילתות בסגנון הצ'אט, כולל שגיאות כתיב ומילות מילוי, כשאין קובץ מוקלט."""
+    rnd = random.Random(seed)
+    templates = ["{s}", "{s} {st}", "משהו עם {s}", "{f} {s}", "תמונה של {s} {st}", "{st}", "{typo}"]
+    queries = []
+    for _ in range(count):
+        subject = rnd.choice(SUBJECTS)
+        typo = subject[:-1] + rnd.choice("אוהי") if len(subject) > 3 else subject
+        queries.append(rnd.choice(templates).format(s=subject, st=rnd.choice(STYLES), f=rnd.choice(FORMATS), typo=typo))
+    return queries
+
+
+def run_benchmark(index, queries, warm=False):
+    results = {}
+    latencies, search_times = [], []
+    started = time.perf_counter()
+    for query in queries:
+        if not warm: index.clear_caches()
+        t0 = time.perf_counter()
+        page, _ = index.next_page(strip_stop_words(query), 0, PAGE_SIZE)
+        t1 = time.perf_counter()
+        selected = select_variety(page)
+        render_cards_html(selected)
+        t2 = time.perf_counter()
+        latencies.append(t2 - t0)
+        search_times.append(t1 - t0)
+        results[query] = {"page": [p.id for p in page], "selected": [p.id for p in selected]}
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    search_times.sort()
+    return results, {
+        "queries": len(queries),
+        "qps": len(queries) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        "search_p95_ms": percentile(search_times, 95) * 1000,
+        "empty_results": sum(1 for r in results.values() if not r["page"]),
+    }
+
+
+def compare_results(results, baseline):
+    """יציבות מול ריצה קודמת: כמה עמודים זהים, חפיפה ממוצעת של ה-ids בעמוד, וכמה בחירות השתנו."""
+    common = [q for q in results if q in baseline]
+    overlaps, diffs = [], []
+    identical = selection_changed = 0
+    for query in common:
+        new, old = results[query], baseline[query]
+        if new["page"] == old["page"]: identical += 1
+        union = set(new["page"]) | set(old["page"])
+        overlap = len(set(new["page"]) & set(old["page"])) / len(union) if union else 1.0
+        overlaps.append(overlap)
+        if new["selected"] != old["selected"]: selection_changed += 1
+        if overlap < 1.0: diffs.append((overlap, query, old["page"][:5], new["page"][:5]))
+    diffs.sort()
+    return {
+        "compared": len(common),
+        "identical_pages": identical,
+        "mean_overlap": sum(overlaps) / len(overlaps) if overlaps else 1.0,
+        "selection_changed": selection_changed,
+        "worst": diffs[:10],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for catalog search + card selection")
+    parser.add_argument("--catalog-size", type=int, default=5000, help="מוצרים סינתטיים (עד 50000 ומעלה)")
+    parser.add_argument("--corpus", help="קובץ JSONL של שאילתות (ברירת מחדל: שאילתות סינתטיות)")
+    parser.add_argument("--field", help="שדה השאילתה ב-JSONL (ברירת מחדל: query / user_message)")
+    parser.add_argument("--queries", type=int, default=2000, help="מקסימום שאילתות")
+    parser.add_argument("--repeat", type=int, default=1, help="כמה פעמים לעבור על הקורפוס")
+    parser.add_argument("--warm", action="store_true", help="להשאיר את ה-caches של האינדקס בין שאילתות")
+    parser.add_argument("--save", help="שמירת התוצאות והמדדים ל-JSON, כבסיס להשוואה")
+    parser.add_argument("--compare", help="השוואה מול קובץ שנשמר עם --save")
+    parser.add_argument("--max-p95-ms", type=float, help="כישלון (exit 1) אם p95 גבוה מזה")
+    parser.add_argument("--min-qps", type=float, help="כישלון אם QPS נמוך מזה")
+    parser.add_argument("--min-overlap", type=float, help="כישלון אם החפיפה הממוצעת מול --compare נמוכה מזה")
+    args = parser.parse_args()
+
+    queries = load_corpus(args.corpus, args.field, args.queries) if args.corpus else synthetic_queries(args.queries)
+    if not queries:
+        print("❌ No queries found.")
+        return 1
+    print(f"🧪 {len(queries)} queries ({args.corpus or 'synthetic'}) x {args.repeat}, catalog of {args.catalog_size} products")
+
+    rss_before = rss_mb()
+    catalog = products_from_api(build_catalog(args.catalog_size))
+    t = time.perf_counter()
+    index = SearchIndex(catalog, [p.id for p in catalog[::50]], CONCEPT_SYNONYMS)
+    build_seconds = time.perf_counter() - t
+    rss_after = rss_mb()
+    print(f"🗂️ Index built in {build_seconds:.2f}s ({len(index.postings)} tokens)")
+
+    results, stats = run_benchmark(index, queries * args.repeat, warm=args.warm)
+    stats["build_seconds"] = build_seconds
+    stats["catalog_size"] = args.catalog_size
+    if rss_after is not None:
+        stats["catalog_and_index_mb"] = rss_after - rss_before
+        stats["rss_mb"] = rss_mb()
+
+    print(f"⚡ {stats['qps']:.0f} queries/s | p50 {stats['p50_ms']:.2f}ms | p90 {stats['p90_ms']:.2f}ms | "
+          f"p95 {stats['p95_ms']:.2f}ms | p99 {stats['p99_ms']:.2f}ms | max {stats['max_ms']:.2f}ms")
+    print(f"🔍 search p95 {stats['search_p95_ms']:.2f}ms | {stats['empty_results']} queries without results")
+    if rss_after is not None:
+        print(f"💾 catalog + index {stats['catalog_and_index_mb']:.0f} MB | process RSS {stats['rss_mb']:.0f} MB")
+
+    failures = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        diff = compare_results(results, baseline["results"])
+        old = baseline["stats"]
+        print(f"📊 vs {args.compare}: {diff['identical_pages']}/{diff['compared']} identical pages, "
+              f"mean overlap {diff['mean_overlap']:.3f}, {diff['selection_changed']} selections changed")
+        print(f"   qps {old['qps']:.0f} -> {stats['qps']:.0f} | p95 {old['p95_ms']:.2f} -> {stats['p95_ms']:.2f}ms")
+        for overlap, query, before, after in diff["worst"]:
+            print(f"   ↳ {overlap:.2f} '{query}': {before} -> {after}")
+        if args.min_overlap is not None and diff["mean_overlap"] < args.min_overlap:
+            failures.append(f"mean overlap {diff['mean_overlap']:.3f} < {args.min_overlap}")
+
+    if args.max_p95_ms is not None and stats["p95_ms"] > args.max_p95_ms:
+        failures.append(f"p95 {stats['p95_ms']:.2f}ms > {args.max_p95_ms}ms")
+    if args.min_qps is not None and stats["qps"] < args.min_qps:
+        failures.append(f"qps {stats['qps']:.0f} < {args.min_qps}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"stats": stats, "results": results}, f, ensure_ascii=False)
+        print(f"💾 Saved results to {args.save}")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+# search_index.py
+
+# ================= אינדקס חיפוש לקטלוג =================
+# נבנה פעם אחת בטעינת הקטלוג. שאילתה מדרגת רק מוצרים שחולקים טוקן עם מילות החיפוש,
+# עם חוקי הניקוד של החיפוש הלינארי הישן (התאמת תת-מחרוזת ב-blob של שם/קטגוריות/תגיות),
+# ועליהם ניקוד דמיון וקטורי (vector_search.py) שתופס שגיאות כתיב שאין להן התאמה מדויקת.
+# שינויים בודדים (webhooks) יוצרים אינדקס חדש ב-updated() בלי בנייה מלאה.
+
+import copy
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+from singleflight import SingleFlight
+from vector_search import build_vectors, patch_vectors
+
+TERM_CACHE_LIMIT = 4096
+RANK_CACHE_LIMIT = 256      # דירוגים מלאים של שאילתות אחרונות, משותפים לכל הסשנים (LRU)
+VECTOR_TOP_K = 200          # כמה מוצרים דומים נכנסים לדירוג מעבר להתאמות המדויקות
+VECTOR_MIN_SIMILARITY = 0.2
+VECTOR_WEIGHT = 60          # דמיון 1.0 שווה 60 נקודות (התאמת מילה מלאה בשם = 50)
+
+# שאילתה זהה מכמה סשנים באותו רגע מדורגת פעם אחת (משותף לכל גרסאות האינדקס; המפתח כולל את האינדקס)
+RANK_FLIGHTS = SingleFlight("search")
+
+
+# מילון מושגים (fallback logic)
+CONCEPT_SYNONYMS = {
+    "צבעוני": ["פופ ארט", "גרפיטי", "אבסטרקט", "סטריט ארט", "צבעוני", "קולאז", "street art", "pop art", "צבעים", "שמח", "צבע", "colorful"],
+    "שמח": ["פופ ארט", "חיות", "צבעוני", "חיוך", "קוף", "אופטימי"],
+    "רגוע": ["נוף", "ים", "חוף", "שקיעה", "בז", "פסטל", "מינימליזם", "סקנדינבי", "שקט", "טבע", "בוהו", "boho", "calm"],
+    "סולידי": ["שחור לבן", "מינימליזם", "גיאומטרי", "נקי", "קלאסי"],
+    "יוקרתי": ["שחור וזהב", "מותגים", "זכוכית", "rolex", "gucci", "זהב", "יוקרה", "יוקרתי", "luxury", "black and gold"],
+    "סלון": ["אבסטרקט", "נוף", "גדול", "סט", "שלושה חלקים", "סלון", "living room"],
+    "חיות": ["חיות", "animals", "wildlife", "טבע"],
+    "ילדים": ["אנימה", "חיות", "ספורט", "גיבורי על", "דיסני", "spiderman", "batman", "ילדים", "נוער", "kids"],
+    "אנימה": ["אנימה", "anime", "מנגה", "דרגון בול", "נארוטו", "וואן פיס", "dragon ball", "naruto", "one piece"],
+}
+
+STOP_WORDS = {"משהו", "כזה", "בשביל", "של", "את", "על", "עם", "תמונה", "תמונות", "ציור"}
+
+
+def strip_stop_words(query):
+    """מילות מילוי ("משהו עם אריה" -> "אריה"); אם לא נשאר כלום, השאילתה כמו שהיא."""
+    filtered_words = [w for w in query.split() if w not in STOP_WORDS]
+    return " ".join(filtered_words) if filtered_words else query
+
+
+def normalize_query(query):
+    return query.lower().strip().replace('"', '').replace("'", "").replace("`", "")
+
+
+def index_generation(parent, upserts, deleted_ids=()):
+    """
+    מזהה לתוכן האינדקס: זהה בכל תהליך שבנה או עדכן אינדקס מאותם מוצרים באותו סדר, כך ש-cursor של
+    סשן (שנשמר ב-SQLite ועובר בין workers) יודע אם הדירוג שהמיקום שלו שייך אליו עדיין בתוקף.
+    """
+    text = "\n".join(f"{pid}\t{blob}" for pid, blob in upserts) + "\n" + " ".join(map(str, deleted_ids))
+    return zlib.crc32(text.encode("utf-8"), parent)
+
+
+def product_blob(p):
+    p_name = p.name.lower()
+    p_cats = " ".join([c.lower() for c in p.categories])
+    p_tags = " ".join([t.lower() for t in p.tags])
+    return p_name, f"{p_name} {p_cats} {p_tags}"
+
+
+class SearchIndex:
+    def __init__(self, products, best_seller_ids=(), synonyms=None):
+        self.products = {}   # id -> מוצר
+        self.order = {}      # id -> מיקום בקטלוג (לשמירת סדר יציב בשוויון ניקוד)
+        self.names = {}      # id -> שם באותיות קטנות
+        self.blobs = {}      # id -> שם + קטגוריות + תגיות
+        self.postings = {}   # טוקן -> set של ids
+        self.best_sellers = set(best_seller_ids)
+        self.synonyms = synonyms or {}
+        self._term_cache = {}
+        self._rank_cache = OrderedDict()
+
+        for p in products:
+            pid = p.id
+            if pid in self.products: continue
+            self.order[pid] = len(self.order)
+            self.products[pid] = p
+            self.names[pid], self.blobs[pid] = product_blob(p)
+            for token in set(self.blobs[pid].split()):
+                self.postings.setdefault(token, set()).add(pid)
+        self.generation = index_generation(0, self.blobs.items())
+        self._build_vocabulary()
+        self._build_vectors()
+
+    def _build_vectors(self):
+        self.row_ids = list(self.products)  # שורה במטריצת הוקטורים -> id (שורות של מוצרים שנמחקו נשארות מתות)
+        self.rows = {pid: row for row, pid in enumerate(self.row_ids)}
+        self.vectors = build_vectors([self.blobs[pid] for pid in self.row_ids])
+
+    def __len__(self):
+        return len(self.products)
+
+    def __getstate__(self):
+        # ה-caches לא נשמרים ב-snapshot
+        state = self.__dict__.copy()
+        state["_term_cache"] = {}
+        state["_rank_cache"] = OrderedDict()
+        return state
+
+    def updated(self, upserts=(), deleted_ids=()):
+        """
+        אינדקס חדש עם המוצרים שנוספו/השתנו ובלי אלה שנמחקו (copy-on-write): המילונים מועתקים רדודים,
+        רק רשימות ה-postings שהשתנו נבנות מחדש, והאינדקס הנוכחי ממשיך לשרת קריאות עד שמחליפים אליו.
+        """
+        new = copy.copy(self)
+        new.products, new.order, new.names, new.blobs = dict(self.products), dict(self.order), dict(self.names), dict(self.blobs)
+        new.postings, new.rows, new.row_ids = dict(self.postings), dict(self.rows), list(self.row_ids)
+        new.best_sellers = self.best_sellers - set(deleted_ids)
+        new._term_cache, new._rank_cache = {}, OrderedDict()
+
+        touched = {}  # טוקן -> עותק חדש של ה-set שלו
+        def posting(token):
+            ids = touched.get(token)
+            if ids is None: ids = touched[token] = set(new.postings.get(token, ()))
+            return ids
+
+        vector_changes = {}  # שורה -> blob חדש (None = נמחק)
+        for pid in deleted_ids:
+            if pid not in new.products: continue
+            for token in set(new.blobs[pid].split()): posting(token).discard(pid)
+            for d in (new.products, new.order, new.names, new.blobs): del d[pid]
+            vector_changes[new.rows.pop(pid)] = None
+
+        next_order = max(self.order.values(), default=-1) + 1
+        for p in upserts:
+            pid = p.id
+            if pid in new.products:
+                for token in set(new.blobs[pid].split()): posting(token).discard(pid)
+            else:
+                new.order[pid] = next_order
+                next_order += 1
+                new.rows[pid] = len(new.row_ids)
+                new.row_ids.append(pid)
+            new.products[pid] = p
+            new.names[pid], new.blobs[pid] = product_blob(p)
+            for token in set(new.blobs[pid].split()): posting(token).add(pid)
+            vector_changes[new.rows[pid]] = new.blobs[pid]
+
+        vocabulary_changed = False
+        for token, ids in touched.items():
+            if ids:
+                vocabulary_changed |= token not in new.postings
+                new.postings[token] = ids
+            elif new.postings.pop(token, None) is not None:
+                vocabulary_changed = True
+        if vocabulary_changed: new._build_vocabulary()
+        new.generation = index_generation(self.generation, [(p.id, new.blobs[p.id]) for p in upserts], deleted_ids)
+
+        if vector_changes:
+            # קטלוג שהיה ריק אין לו מטריצה לעדכן - נבנית עכשיו
+            new.vectors = patch_vectors(self.vectors, len(new.row_ids), vector_changes) if self.vectors is not None else None
+            if new.vectors is None: new._build_vectors()
+        return new
+
+    def clear_caches(self):
+        self._term_cache = {}
+        self._rank_cache = OrderedDict()
+
+    def _build_vocabulary(self):
+        # כל הטוקנים כמחרוזת אחת, כדי שחיפוש תת-מחרוזת ירוץ ב-str.find ולא בלולאה על כל טוקן
+        self._vocab = list(self.postings)
+        self._vocab_text = "\n".join(self._vocab)
+        self._vocab_starts = []
+        offset = 0
+        for token in self._vocab:
+            self._vocab_starts.append(offset)
+            offset += len(token) + 1
+        self._term_cache = {}
+
+    def _tokens_containing(self, piece):
+        tokens = []
+        pos = self._vocab_text.find(piece)
+        while pos != -1:
+            i = bisect_right(self._vocab_starts, pos) - 1
+            tokens.append(self._vocab[i])
+            if i + 1 >= len(self._vocab): break
+            pos = self._vocab_text.find(piece, self._vocab_starts[i + 1])
+        return tokens
+
+    def candidates(self, term):
+        """ids שה-blob שלהם עשוי להכיל את term (קבוצת-על; הניקוד עצמו בודק התאמה מדויקת)."""
+        cached = self._term_cache.get(term)
+        if cached is not None: return cached
+
+        result = None
+        for piece in term.split():
+            ids = set()
+            for token in self._tokens_containing(piece):
+                ids |= self.postings[token]
+            result = ids if result is None else result & ids
+            if not result: break
+        result = frozenset(result or ())
+
+        if len(self._term_cache) >= TERM_CACHE_LIMIT: self._term_cache.clear()
+        self._term_cache[term] = result
+        return result
+
+    def score(self, pid, query_words, concept_terms, similarity=0.0):
+        full_blob = self.blobs[pid]
+        p_name = self.names[pid]
+        score = 0
+        for term in concept_terms:
+            if term in full_blob: score += 10
+        matched = 0
+        for word in query_words:
+            if len(word) < 2: continue
+            if word in full_blob:
+                matched += 1
+                if word in p_name: score += 30
+        if matched > 0:
+            if matched == len(query_words) and len(query_words) > 1: score += 150
+            else: score += (matched * 20)
+        score += round(similarity * VECTOR_WEIGHT)
+        if score > 0 and pid in self.best_sellers: score += 10
+        return score
+
+    def rank(self, query):
+        """כל ה-ids שקיבלו ניקוד חיובי, מהגבוה לנמוך."""
+        clean_query = normalize_query(query)
+        query_words = clean_query.split()
+        concept_terms = []
+        for concept, synonyms in self.synonyms.items():
+            if concept in clean_query: concept_terms.extend(synonyms)
+
+        pool = set()
+        for term in concept_terms: pool |= self.candidates(term)
+        for word in query_words:
+            if len(word) >= 2: pool |= self.candidates(word)
+
+        similar = {}
+        if self.vectors is not None:
+            for row, similarity in self.vectors.top_k(clean_query, VECTOR_TOP_K, VECTOR_MIN_SIMILARITY):
+                pid = self.row_ids[row]
+                if pid in self.products: similar[pid] = similarity
+            pool.update(similar)
+
+        scored = []
+        for pid in pool:
+            score = self.score(pid, query_words, concept_terms, similar.get(pid, 0.0))
+            if score > 0: scored.append((-score, self.order[pid], pid))
+        scored.sort()
+        return [pid for _, _, pid in scored]
+
+    def ranked(self, query):
+        """כמו rank, אבל מחושב פעם אחת לכל שאילתה (מנורמלת) ונשמר כמערך ids קומפקטי."""
+        key = normalize_query(query)
+        return self._cached(key, lambda: self.rank(key))
+
+    def listed(self, kind, name):
+        """מוצרי הקטגוריה / התגית name (kind = "category" / "tag") בסדר הקטלוג, נשמר כמו דירוג."""
+        field = "categories" if kind == "category" else "tags"
+        return self._cached((kind, name), lambda: [pid for pid in sorted(self.products, key=self.order.get)
+                                                   if name in getattr(self.products[pid], field)])
+
+    def _cached(self, key, compute):
+        cached = self._rank_cache.get(key)
+        if cached is not None:
+            try:
+                self._rank_cache.move_to_end(key)
+            except KeyError:
+                pass  # פונה בינתיים ע"י thread אחר - התוצאה שבידינו עדיין נכונה
+            return cached
+        return RANK_FLIGHTS.do((id(self), key), lambda: self._compute_and_cache(key, compute))
+
+    def _compute_and_cache(self, key, compute):
+        result = array('q', compute())
+        # מפנים רק את הדירוג שלא נקרא הכי הרבה זמן: cursors של שאילתות פעילות ממשיכים מהדירוג שלהם
+        while len(self._rank_cache) >= RANK_CACHE_LIMIT:
+            try:
+                self._rank_cache.popitem(last=False)
+            except KeyError:
+                break
+        self._rank_cache[key] = result
+        return result
+
+    def next_page(self, query, offset=0, limit=12, skip=None):
+        """עד limit מוצרים מהדירוג החל מ-offset, והמיקום שממנו ממשיכים בפעם הבאה. skip(pid) מדלג על מוצר."""
+        return self.page_of(self.ranked(query), offset, limit, skip)
+
+    def page_of(self, ranked, offset=0, limit=12, skip=None):
+        """כמו next_page, על רשימת ids מוכנה (ranked / listed)."""
+        page = []
+        while offset < len(ranked) and len(page) < limit:
+            pid = ranked[offset]
+            offset += 1
+            if skip is None or not skip(pid): page.append(self.products[pid])
+        return page, offset
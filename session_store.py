@@ -0,0 +1,201 @@
+# session_store.py
+
+# ================= ניהול סשנים =================
+# מצב הסשן נשמר ברשומה קומפקטית (__slots__, מוצרים שנצפו במערך ממוין במקום set).
+# לחיפוש טקסט הסשן שומר רק cursor (השאילתה והמיקום בדירוג) - הדירוג עצמו משותף ב-SearchIndex.
+# היסטוריית השיחה נשמרת כאן כטקסט נקי (בלי HTML), עם תקרת טוקנים, וגרסה שהווידג'ט מסתנכרן מולה.
+# שני מימושים לאותו ממשק: בזיכרון התהליך (ברירת מחדל), או SQLite מקומי משותף לכמה workers.
+# שניהם מפנים סשנים לפי זמן חוסר פעילות (TTL) ולפי תקרת מספר סשנים (LRU).
+
+import pickle
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from sqlite_conn import LocalConnection
+
+
+class SessionState:
+    __slots__ = ("page", "last_query", "seen_ids", "cursor_query", "cursor_generation", "cursor_offset", "history",
+                 "history_version")
+
+    def __init__(self):
+        self.page = 1
+        self.last_query = None
+        self.seen_ids = array('q')  # ממוין, לחיפוש בינארי
+        self.cursor_query = None    # שאילתת הטקסט (או (kind, שם) של קטגוריה / תגית) שה-cursor שייך לה
+        self.cursor_generation = None  # SearchIndex.generation של הדירוג שה-cursor שייך לו
+        self.cursor_offset = 0      # המיקום הבא ברשימה המדורגת שלה
+        self.history = []           # [(role, טקסט, טוקנים)] מהישן לחדש
+        self.history_version = 0    # עולה בכל תור; הווידג'ט שולח את הגרסה שהוא מכיר
+
+    def start_query(self, query):
+        # שאילתה חדשה: מתחילים מהעמוד הראשון, בלי cursor ובלי רשימת נצפים
+        self.last_query = query
+        self.page = 1
+        self.reset_seen()
+        self.cursor_query = None
+        self.cursor_generation = None
+        self.cursor_offset = 0
+
+    def add_history(self, entries, token_budget):
+        self.history.extend(e for e in entries if e)
+        self._trim_history(token_budget)
+        self.history_version += 1
+
+    def replace_history(self, entries, token_budget):
+        # סנכרון מחדש מהווידג'ט (הסשן פג בשרת, או שתי לשוניות על אותו סשן)
+        self.history = [e for e in entries if e]
+        self._trim_history(token_budget)
+
+    def _trim_history(self, token_budget):
+        # ההודעות הישנות יוצאות ראשונות
+        total = sum(tokens for _, _, tokens in self.history)
+        drop = 0
+        while total > token_budget and drop < len(self.history):
+            total -= self.history[drop][2]
+            drop += 1
+        if drop: del self.history[:drop]
+
+    def has_seen(self, product_id):
+        i = bisect_left(self.seen_ids, product_id)
+        return i < len(self.seen_ids) and self.seen_ids[i] == product_id
+
+    def mark_seen(self, product_id):
+        i = bisect_left(self.seen_ids, product_id)
+        if i == len(self.seen_ids) or self.seen_ids[i] != product_id:
+            self.seen_ids.insert(i, product_id)
+
+    def reset_seen(self):
+        self.seen_ids = array('q')
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __setstate__(self, state):
+        self.__init__()
+        for slot, value in state.items():
+            if slot in self.__slots__: setattr(self, slot, value)
+
+
+class SessionBackend:
+    """ממשק משותף: get מחזיר תמיד SessionState (חדש אם אין/פג תוקף), save שומר אותו בחזרה."""
+
+    def __init__(self, ttl_seconds, max_sessions):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.created = 0
+        self.evicted_ttl = 0
+        self.evicted_lru = 0
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def save(self, session_id, state):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {
+            "active": len(self),
+            "capacity": self.max_sessions,
+            "created": self.created,
+            "evicted_ttl": self.evicted_ttl,
+            "evicted_lru": self.evicted_lru,
+        }
+
+
+class MemorySessionStore(SessionBackend):
+    def __init__(self, ttl_seconds=3600, max_sessions=10000):
+        super().__init__(ttl_seconds, max_sessions)
+        self._sessions = OrderedDict()  # session_id -> (last_access, state), מהישן לחדש
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                state = SessionState()
+                self.created += 1
+                while len(self._sessions) >= self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evicted_lru += 1
+            else:
+                state = entry[1]
+            self._sessions[session_id] = (now, state)
+            return state
+
+    def save(self, session_id, state):
+        # האובייקט חי בזיכרון - מספיק לרענן את זמן הגישה
+        with self._lock:
+            if session_id in self._sessions:
+                self._sessions[session_id] = (time.monotonic(), state)
+                self._sessions.move_to_end(session_id)
+
+    def _evict_expired(self, now):
+        # הסדר הוא סדר הגישה, לכן הפגי-תוקף תמיד בראש הרשימה
+        while self._sessions:
+            last_access, _ = next(iter(self._sessions.values()))
+            if now - last_access < self.ttl_seconds: break
+            self._sessions.popitem(last=False)
+            self.evicted_ttl += 1
+
+
+class SqliteSessionStore(SessionBackend):
+    CLEANUP_EVERY = 200  # ניקוי פגי-תוקף ועודפים כל N שמירות
+
+    def __init__(self, db_path="sessions.db", ttl_seconds=3600, max_sessions=10000):
+        super().__init__(ttl_seconds, max_sessions)
+        self.db_path = db_path
+        self._conn = LocalConnection(db_path)
+        self._saves = 0
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, last_access REAL NOT NULL, data BLOB NOT NULL)")
+        self._conn().execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def get(self, session_id):
+        row = self._conn().execute("SELECT last_access, data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is not None:
+            if time.time() - row[0] < self.ttl_seconds:
+                try:
+                    return pickle.loads(row[1])
+                except Exception as e:
+                    print(f"⚠️ Dropping unreadable session {session_id}: {e}")
+            else:
+                self.evicted_ttl += 1
+        self.created += 1
+        return SessionState()
+
+    def save(self, session_id, state):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO sessions (id, last_access, data) VALUES (?, ?, ?)",
+                     (session_id, time.time(), pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)))
+        self._saves += 1
+        if self._saves % self.CLEANUP_EVERY == 0: self._cleanup(conn)
+
+    def _cleanup(self, conn):
+        self.evicted_ttl += conn.execute("DELETE FROM sessions WHERE last_access < ?",
+                                         (time.time() - self.ttl_seconds,)).rowcount
+        excess = len(self) - self.max_sessions
+        if excess > 0:
+            self.evicted_lru += conn.execute(
+                "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions ORDER BY last_access LIMIT ?)",
+                (excess,)).rowcount
+
+
+def create_session_store(backend="memory", ttl_seconds=3600, max_sessions=10000, db_path="sessions.db"):
+    if backend == "sqlite":
+        return SqliteSessionStore(db_path, ttl_seconds=ttl_seconds, max_sessions=max_sessions)
+    return MemorySessionStore(ttl_seconds=ttl_seconds, max_sessions=max_sessions)
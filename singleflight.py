@@ -0,0 +1,104 @@
+# singleflight.py
+
+# ================= Single-flight: חישוב אחד לבקשות זהות שמגיעות יחד =================
+# כשהרבה גולשים שואלים את אותו דבר באותו רגע (קמפיין), כל אחד מהם היה מריץ את אותו דירוג חיפוש
+# או את אותה קריאה לחנות. כאן הראשון עם מפתח מסוים מחשב, וכל מי שמגיע עם אותו מפתח בזמן שהחישוב
+# רץ מחכה לו ומקבל את אותה תוצאה (או את אותה חריגה). אחרי שהחישוב נגמר המפתח משתחרר -
+# ה-cache (STORE_PAGE_CACHE, rank cache) הוא מה ששומר תוצאות לאורך זמן, לא השכבה הזו.
+
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _FlightStats:
+    def __init__(self, name):
+        self.name = name
+        self.leaders = 0    # חישובים שרצו בפועל
+        self.coalesced = 0  # קריאות שקיבלו תוצאה של חישוב שכבר רץ
+
+    def stats(self):
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+class SingleFlight(_FlightStats):
+    """ל-threads (Flask / gunicorn gthread)."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._calls = {}  # key -> _Call
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None, executor=None):
+        """
+        fn() פעם אחת לכל המחכים על key. timeout: כמה הקורא הזה מוכן לחכות - TimeoutError, והחישוב עצמו ממשיך.
+        executor: החישוב רץ שם ולא ב-thread של הקורא הראשון, כך שגם הוא מחכה רק timeout שלו.
+        בלי executor הקורא הראשון מחשב בעצמו וה-timeout חל רק על המצטרפים.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            if executor is None: return self._run(key, call, fn)
+            executor.submit(self._run, key, call, fn)
+        if not call.done.wait(timeout):
+            raise TimeoutError(f"{self.name}: gave up waiting for {key!r}")
+        if call.error is not None: raise call.error
+        return call.result
+
+    def _run(self, key, call, fn):
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.error = RuntimeError(f"{self.name}: computation for {key!r} was aborted")
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class AsyncSingleFlight(_FlightStats):
+    """אותו דבר ל-asyncio (asgi_app.py). לא thread-safe - כל הקריאות מאותו event loop."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._calls = {}  # key -> Future
+
+    async def do(self, key, coro_fn, timeout=None):
+        """החישוב רץ ב-task משלו; timeout הוא כמה הקורא הזה (גם הראשון) מוכן לחכות - TimeoutError."""
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.create_task(self._run(key, coro_fn))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # נקרא, גם אם אף אחד לא חיכה
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        # shield: קורא שהתייאש (או בוטל) לא מבטל את החישוב של כולם
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+    async def _run(self, key, coro_fn):
+        try:
+            return await coro_fn()
+        except asyncio.CancelledError:
+            raise RuntimeError(f"{self.name}: computation for {key!r} was cancelled")
+        finally:
+            self._calls.pop(key, None)
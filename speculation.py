@@ -0,0 +1,86 @@
+# speculation.py
+
+# ================= חיפוש ספקולטיבי במקביל ל-AI =================
+# בלי זה הבקשה סדרתית: קודם ה-AI, אחר כך SEARCH_ACTION, ורק אז שליפת המוצרים (לפעמים קריאה לחנות).
+# כשההודעה מגיעה, app.py מנחש מה ה-AI יבקש לחפש (ההודעה עצמה, הקטגוריה/תגית הכי רלוונטית אליה,
+# או המשך של השאילתה הקודמת) ומתחיל את החיפושים האלה ברקע בזמן שהבקשה ל-OpenAI רצה.
+# החיפוש הספקולטיבי רק מחמם את ה-caches (STORE_PAGE_CACHE, rank cache) ועובר דרך ה-single-flight,
+# כך שכשה-AI מבקש אותו דבר החיפוש האמיתי מוצא תוצאה מוכנה (או מצטרף לקריאה שכבר באמצע).
+# ניחוש שלא התאים פשוט לא נקרא - הבקשה לא מחכה לו. כאן רק המעקב: hit rate וכמה זמן נחסך.
+
+import threading
+import time
+
+
+class Speculation:
+    __slots__ = ("target", "started", "finished")
+
+    def __init__(self, target):
+        self.target = target
+        self.started = None  # כשהחיפוש התחיל לרוץ בפועל, לא כשנכנס לתור של ה-pool
+        self.finished = None
+
+    def run(self, fn, *args):
+        self.started = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            self.finished = time.monotonic()
+
+    async def run_async(self, fn, *args):
+        self.started = time.monotonic()
+        try:
+            return await fn(*args)
+        finally:
+            self.finished = time.monotonic()
+
+
+class SpeculationTracker:
+    def __init__(self):
+        self.started = 0        # חיפושים ספקולטיביים שיצאו
+        self.hits = 0           # בקשות שבהן ה-AI ביקש את אחד הניחושים
+        self.misses = 0         # ה-AI חיפש משהו אחר
+        self.unused = 0         # ה-AI לא חיפש בכלל
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def track(self, target, cached=False):
+        """
+        החיפוש עצמו רץ דרך speculation.run (thread pool) או run_async (asyncio).
+        cached: התוצאה כבר ב-cache - אין מה להריץ, וניחוש נכון נספר כ-hit בלי זמן שנחסך.
+        """
+        speculation = Speculation(target)
+        with self._lock:
+            self.started += 1
+        if cached: speculation.started = speculation.finished = time.monotonic()
+        return speculation
+
+    def resolve(self, speculations, target):
+        """
+        target: החיפוש שהבקשה צריכה בפועל (None = בלי חיפוש). מחזיר את השניות שנחסכו:
+        כמה מהחיפוש כבר רץ ברקע עד שהיה צריך אותו - כולו אם הסתיים, עד עכשיו אם עוד באמצע,
+        ו-0 אם עוד מחכה בתור (אז החיפוש האמיתי עושה את כל העבודה בעצמו).
+        """
+        if not speculations: return 0.0
+        now = time.monotonic()
+        match = next((s for s in speculations if s.target == target), None) if target is not None else None
+        ran = match is not None and match.started is not None
+        saved = (min(match.finished or now, now) - match.started) if ran else 0.0
+        with self._lock:
+            if target is None: self.unused += 1
+            elif match is None: self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_seconds += saved
+        return saved
+
+    def stats(self):
+        resolved = self.hits + self.misses
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "unused": self.unused,
+            "hit_rate": self.hits / resolved if resolved else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
@@ -0,0 +1,26 @@
+# sqlite_conn.py
+
+# ================= חיבורי SQLite משותפים (WAL) =================
+# חיבור sqlite3 לא עובר בין threads, וחיבור שנפתח לפני fork (gunicorn --preload) לא שמיש בבן.
+# לכן כל thread בכל תהליך פותח חיבור משלו, פעם אחת. WAL מאפשר קוראים במקביל לכותב,
+# ו-synchronous=NORMAL מספיק בו (commit לא מחכה ל-fsync, והקובץ לא נשבר בקריסה).
+
+import os
+import sqlite3
+import threading
+
+
+class LocalConnection:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def __call__(self):
+        """החיבור של ה-thread הנוכחי (ושל התהליך הנוכחי, אחרי fork)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
@@ -0,0 +1,124 @@
+# store_api.py
+
+# ================= חיבור ל-WooCommerce (Session משותף) =================
+# כל הקריאות לחנות עוברות דרך requests.Session אחד עם pool חיבורים,
+# במקום לפתוח חיבור TCP/TLS חדש בכל wcapi.get.
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from woocommerce.oauth import OAuth
+
+from product_record import products_from_api
+
+
+class StoreClient:
+    def __init__(self, url, consumer_key, consumer_secret, version="wc/v3", timeout=60, pool_size=8):
+        self.url = url
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.version = version
+        self.timeout = timeout
+        self.api_url = f"{url.rstrip('/')}/wp-json/{version}/"
+        self.is_ssl = url.startswith("https")
+        self.pool_size = pool_size
+
+        self.session = self._new_session()
+        # gunicorn --preload: ה-master טוען את הקטלוג דרך ה-pool הזה, ו-worker שהיה יורש את אותם sockets
+        # היה קורא תשובות של תהליך אחר. כל תהליך בן פותח pool משלו
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _new_session(self):
+        session = requests.Session()
+        session.headers.update({"accept": "application/json"})
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if self.is_ssl:
+            session.auth = (self.consumer_key, self.consumer_secret)
+        return session
+
+    def _after_fork(self):
+        self.session.close()
+        self.session = self._new_session()
+
+    def _prepare(self, endpoint, params):
+        url = self.api_url + endpoint
+        params = dict(params or {})
+        if not self.is_ssl:
+            # בלי HTTPS החנות דורשת חתימת OAuth 1.0a (כמו ספריית woocommerce)
+            url = OAuth(url=f"{url}?{urlencode(params)}", consumer_key=self.consumer_key, consumer_secret=self.consumer_secret,
+                        version=self.version, method="GET", oauth_timestamp=int(time.time())).get_oauth_url()
+            params = None
+        return url, params
+
+    def get(self, endpoint, params=None, timeout=None):
+        url, params = self._prepare(endpoint, params)
+        response = self.session.get(url, params=params, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response
+
+
+class AsyncStoreClient(StoreClient):
+    """אותו ממשק, מעל httpx.AsyncClient (למצב ASGI). get הוא coroutine."""
+
+    def __init__(self, url, consumer_key, consumer_secret, version="wc/v3", timeout=60, pool_size=100):
+        import httpx  # נדרש רק במצב האסינכרוני
+
+        super().__init__(url, consumer_key, consumer_secret, version=version, timeout=timeout, pool_size=1)
+        self.session.close()
+        self.session = httpx.AsyncClient(
+            headers={"accept": "application/json"},
+            auth=(consumer_key, consumer_secret) if self.is_ssl else None,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=timeout,
+        )
+
+    async def get(self, endpoint, params=None, timeout=None):
+        url, params = self._prepare(endpoint, params)
+        response = await self.session.get(url, params=params, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response
+
+    def _after_fork(self):
+        pass  # ה-master לא מבצע קריאות async, כך שאין חיבורים פתוחים לרשת
+
+    async def aclose(self):
+        await self.session.aclose()
+
+
+def fetch_catalog(store, concurrency=8, per_page=100):
+    """מחזיר (כל המוצרים המפורסמים, הנמכרים ביותר) כ-ProductRecord. העמודים נמשכים במקביל לפי X-WP-TotalPages."""
+    base_params = {"per_page": per_page, "status": "publish"}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="catalog") as pool:
+        popular = pool.submit(store.get, "products", {"per_page": 20, "orderby": "popularity"})
+
+        first = store.get("products", dict(base_params, page=1))
+        products = products_from_api(first.json())  # כל עמוד מוקטן מיד, כך שה-JSON המלא לא מצטבר
+        total_pages = first.headers.get("X-WP-TotalPages")
+
+        if total_pages is not None:
+            pages = [pool.submit(store.get, "products", dict(base_params, page=n)) for n in range(2, int(total_pages) + 1)]
+            for future in pages:  # שומרים על סדר העמודים
+                products.extend(products_from_api(future.result().json()))
+        else:
+            # אין כותרת (proxy שמסנן כותרות?) -> דפדוף רציף עד עמוד ריק
+            page = 2
+            while True:
+                batch = store.get("products", dict(base_params, page=page)).json()
+                if not batch: break
+                products.extend(products_from_api(batch))
+                page += 1
+
+        try:
+            best_sellers = products_from_api(popular.result().json())
+        except Exception as e:
+            print(f"⚠️ Error loading best sellers: {e}")
+            best_sellers = []
+
+    return products, best_sellers
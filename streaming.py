@@ -0,0 +1,52 @@
+# streaming.py
+
+# ================= הזרמת תשובות (SSE) =================
+
+import json
+import re
+
+DIRECTIVE_MARKERS = ("SEARCH_ACTION", "SAVE_LEAD")
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class DirectiveStreamFilter:
+    """
+    מקבל את הטקסט של ה-AI בחתיכות ומחזיר רק את מה שבטוח להציג ללקוח.
+    מרגע שמופיעה פקודה (SEARCH_ACTION / SAVE_LEAD) שום דבר לא מוצג יותר - התשובה הסופית
+    מגיעה ממילא באירוע done. סוף חתיכה שיכול להיות תחילת פקודה (למשל "SEAR") מוחזק עד החתיכה הבאה.
+    הפקודות מזוהות בלי תלות באותיות גדולות/קטנות ("search_action:"), כמו ב-parse_bot_response.
+    """
+
+    def __init__(self, markers=DIRECTIVE_MARKERS):
+        self.markers = [m.upper() for m in markers]
+        self.pattern = re.compile("|".join(re.escape(m) for m in self.markers), re.IGNORECASE)
+        self.buffer = ""
+        self.emitted = 0
+        self.stopped = False
+
+    def feed(self, text):
+        if self.stopped: return ""
+        self.buffer += text
+
+        hit = self.pattern.search(self.buffer, self.emitted)
+        if hit:
+            self.stopped = True
+            return self._emit_until(hit.start())
+
+        hold = 0
+        for marker in self.markers:
+            for k in range(min(len(marker) - 1, len(self.buffer)), 0, -1):
+                if self.buffer[-k:].upper() == marker[:k]:
+                    hold = max(hold, k)
+                    break
+        return self._emit_until(len(self.buffer) - hold)
+
+    def _emit_until(self, end):
+        # backticks לפני פקודה (`SEARCH_ACTION: ...`) לא מוצגים
+        while end > self.emitted and self.buffer[end - 1] == '`': end -= 1
+        out = self.buffer[self.emitted:end]
+        self.emitted = max(self.emitted, end)
+        return out
@@ -0,0 +1,205 @@
+# stub_servers.py
+
+# ================= שרתי דמה לבדיקות עומס =================
+# מחקים את OpenAI (chat/completions, כולל stream) ואת WooCommerce (products) מקומית,
+# עם השהיה וגודל קטלוג שניתנים להגדרה - כדי למדוד קיבולת בלי לשרוף קרדיטים ובלי לגעת בחנות.
+#
+# הרצה:
+#   python stub_servers.py --catalog-size 3000 --llm-latency 0.8 --store-latency 0.3
+#   WC_URL=http://127.0.0.1:8802 OPENAI_BASE_URL=http://127.0.0.1:8801/v1 RATELIMIT_ENABLED=0 python app.py
+#   python bot_tester.py --load --sessions 50 --turns 5
+#
+# שרת החנות מגיש גם את תמונות המוצרים (/images/<id>.jpg, JPEG גדול כמו העלאה אמיתית) כשהקטלוג נבנה
+# עם image_base, כדי שגם ה-thumbnails ייבדקו בלי רשת.
+
+import argparse
+import io
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+SUBJECTS = ["אריה", "נמר", "ים", "שקיעה", "פרחים", "אנימה", "נארוטו", "רולקס", "גוצ'י", "בנקסי", "מכונית", "אישה",
+            "כדורגל", "מסי", "רונאלדו", "חוף", "יער", "הרים", "קוף", "סוס", "ניו יורק", "פריז", "קומיקס", "דרגון בול"]
+STYLES = ["פופ ארט", "אבסטרקט", "שחור לבן", "שחור וזהב", "מינימליזם", "בוהו", "גרפיטי", "פסטל", "צבעוני", "נורדי"]
+FORMATS = ["זכוכית", "קנבס", "ממוסגרת", "3 חלקים"]
+CATEGORIES = ["אנימה", "חיות", "נופים", "מותגים", "ספורט", "ערים", "אבסטרקט", "ילדים", "פופ ארט", "יוקרה"]
+
+
+def build_catalog(size, seed=42, image_base=None):
+    rnd = random.Random(seed)
+    catalog = []
+    for i in range(1, size + 1):
+        subject, style, fmt = rnd.choice(SUBJECTS), rnd.choice(STYLES), rnd.choice(FORMATS)
+        catalog.append({
+            "id": i,
+            "name": f"תמונת {fmt} {subject} {style} דגם {i // 3}",
+            "price": str(rnd.choice([149, 199, 249, 349, 499, 799])),
+            "permalink": f"https://example.test/product/{i}",
+            "date_modified": "2026-01-01T00:00:00",
+            "images": [{"src": f"{image_base}/images/{i}.jpg" if image_base else f"https://placehold.co/800x800?text={i}",
+                        "date_modified": "2026-01-01T00:00:00"}],
+            "categories": [{"id": CATEGORIES.index(c) + 1, "name": c} for c in rnd.sample(CATEGORIES, 2)],
+            "tags": [{"id": 100 + STYLES.index(style), "name": style}],
+        })
+    return catalog
+
+
+def _sleep(base, jitter=0.3):
+    if base > 0: time.sleep(base * random.uniform(1 - jitter, 1 + jitter))
+
+
+class StoreStub(BaseHTTPRequestHandler):
+    catalog = []
+    latency = 0.0
+    protocol_version = "HTTP/1.1"
+    _image = None  # אותה תמונה לכל המוצרים, נוצרת פעם אחת
+
+    def log_message(self, *args): pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/images/"):
+            return self._send_image()
+        if not url.path.rstrip("/").endswith("/products"):
+            return self._send(404, {"code": "rest_no_route"})
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        per_page, page = int(q.get("per_page", 10)), int(q.get("page", 1))
+
+        items = self.catalog
+        if "category" in q:
+            items = [p for p in items if any(str(c["id"]) == q["category"] for c in p["categories"])]
+        if "tag" in q:
+            items = [p for p in items if any(str(t["id"]) == q["tag"] for t in p["tags"])]
+        if q.get("orderby") == "popularity":
+            items = items[::7]
+
+        _sleep(self.latency)
+        total_pages = max(1, -(-len(items) // per_page))
+        self._send(200, items[(page - 1) * per_page: page * per_page], {"X-WP-TotalPages": str(total_pages), "X-WP-Total": str(len(items))})
+
+    def _send_image(self):
+        if StoreStub._image is None:
+            try:
+                from PIL import Image
+            except ImportError:
+                return self._send(404, {"code": "no_pillow"})
+            img = Image.effect_mandelbrot((2000, 2000), (-2.0, -1.5, 1.0, 1.5), 100).convert("RGB")
+            out = io.BytesIO()
+            img.save(out, "JPEG", quality=95)
+            StoreStub._image = out.getvalue()
+        _sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(self._image)))
+        self.end_headers()
+        self.wfile.write(self._image)
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class OpenAIStub(BaseHTTPRequestHandler):
+    latency = 0.0
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args): pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = body.get("messages", [])
+        user_message = messages[-1]["content"] if messages else ""
+        text = self.reply_for(user_message)
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 3
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 3, "total_tokens": prompt_tokens + len(text) // 3}
+
+        if body.get("stream"):
+            return self._stream(text, usage)
+
+        _sleep(self.latency)
+        payload = {"id": "stub", "object": "chat.completion", "created": int(time.time()), "model": body.get("model", "stub"),
+                   "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                   "usage": usage}
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def reply_for(user_message):
+        # מספיק "דומה" לבוט האמיתי: טלפון -> ליד, "עוד" -> MORE, שאלות -> טקסט, כל השאר -> חיפוש
+        if any(ch.isdigit() for ch in user_message) and "05" in user_message:
+            return "רשמתי את המספר! SAVE_LEAD: " + "".join(ch for ch in user_message if ch.isdigit() or ch == "-")
+        if "עוד" in user_message:
+            return "בטח, הנה עוד: SEARCH_ACTION: MORE"
+        if "?" in user_message or "כמה" in user_message:
+            return "המשלוח לוקח עד 10 ימי עסקים. אפשר לעזור במשהו נוסף?"
+        return f"בטח, הנה מה שמצאתי: SEARCH_ACTION: {user_message}"
+
+    def _stream(self, text, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+        for piece in pieces:
+            time.sleep(self.latency / max(1, len(pieces)))
+            chunk(json.dumps({"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": "stub",
+                              "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}, ensure_ascii=False))
+        chunk(json.dumps({"id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": "stub",
+                          "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}))
+        chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_stub_servers(host="127.0.0.1", openai_port=8801, store_port=8802, catalog_size=2000, llm_latency=0.8, store_latency=0.3):
+    StoreStub.catalog = build_catalog(catalog_size, image_base=f"http://{host}:{store_port}")
+    StoreStub.latency = store_latency
+    OpenAIStub.latency = llm_latency
+    servers = [ThreadingHTTPServer((host, openai_port), OpenAIStub), ThreadingHTTPServer((host, store_port), StoreStub)]
+    for server in servers:
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return servers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI + WooCommerce stand-ins for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--openai-port", type=int, default=8801)
+    parser.add_argument("--store-port", type=int, default=8802)
+    parser.add_argument("--catalog-size", type=int, default=2000)
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds per completion")
+    parser.add_argument("--store-latency", type=float, default=0.3, help="seconds per products page")
+    args = parser.parse_args()
+
+    start_stub_servers(args.host, args.openai_port, args.store_port, args.catalog_size, args.llm_latency, args.store_latency)
+    print(f"🧪 OpenAI stub:      http://{args.host}:{args.openai_port}/v1")
+    print(f"🧪 WooCommerce stub: http://{args.host}:{args.store_port} ({args.catalog_size} products)")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+# conftest.py - המודולים יושבים בשורש הריפו, לא בחבילה
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,40 @@
+# test_catalog_updates.py
+
+from catalog_updates import CatalogUpdateQueue
+from product_record import ProductRecord
+
+
+def record(pid, name, modified):
+    return ProductRecord(pid, name, modified=modified)
+
+
+def test_late_older_update_does_not_replace_newer():
+    queue = CatalogUpdateQueue(lambda upserts, deleted_ids: None, debounce_seconds=60, max_delay=60)
+    queue.submit(1, record(1, "new", "2026-02-01T00:00:00"))
+    queue.submit(1, record(1, "old", "2026-01-01T00:00:00"))
+    assert queue._pending[1].name == "new"
+
+
+def test_failed_batch_is_retried():
+    applied = []
+
+    def apply_fn(upserts, deleted_ids):
+        if not applied:
+            applied.append(None)
+            raise OSError("disk full")
+        applied.append(([p.name for p in upserts], deleted_ids))
+
+    queue = CatalogUpdateQueue(apply_fn, debounce_seconds=60, max_delay=60, retry_seconds=60)
+    queue._apply({1: record(1, "a", "2026-01-01T00:00:00"), 2: None})
+    assert queue.failed_batches == 1
+    assert set(queue._pending) == {1, 2}
+
+    # מה שהגיע בזמן הניסיון הכושל חדש יותר ונשאר
+    queue._pending[1] = record(1, "b", "2026-02-01T00:00:00")
+    queue._requeue({1: record(1, "a", "2026-01-01T00:00:00")})
+    assert queue._pending[1].name == "b"
+
+    batch, queue._pending = queue._pending, {}
+    queue._apply(batch)
+    assert applied[-1] == (["b"], [2])
+    assert queue.batches == 1
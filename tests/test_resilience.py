@@ -0,0 +1,43 @@
+# test_resilience.py
+
+import asyncio
+import time
+
+import pytest
+
+from resilience import CLOSED, CircuitBreaker, DeadlineExceeded, UpstreamTimer
+
+
+def test_slow_consumer_is_not_a_slow_call():
+    breaker = CircuitBreaker("test", min_calls=1, slow_call_seconds=0.05)
+    timer = UpstreamTimer()
+    with breaker.guard(timer):
+        for _ in timer.iterate([1, 2, 3]):
+            time.sleep(0.03)  # לקוח SSE איטי בין chunks
+    assert breaker._calls[-1] == (True, False)
+    assert breaker.state == CLOSED
+
+
+def test_slow_upstream_is_a_slow_call():
+    async def chunks():
+        for chunk in range(3):
+            await asyncio.sleep(0.03)
+            yield chunk
+
+    async def consume(timer):
+        return [chunk async for chunk in timer.aiterate(chunks())]
+
+    breaker = CircuitBreaker("test", min_calls=5, slow_call_seconds=0.05)
+    timer = UpstreamTimer()
+    with breaker.guard(timer):
+        assert asyncio.run(consume(timer)) == [0, 1, 2]
+    assert breaker._calls[-1] == (True, True)
+
+
+def test_own_deadline_is_not_a_failure():
+    breaker = CircuitBreaker("test", min_calls=1)
+    with pytest.raises(DeadlineExceeded):
+        with breaker.guard():
+            raise DeadlineExceeded("deadline passed")
+    assert not breaker._calls
+    assert breaker.state == CLOSED
@@ -0,0 +1,59 @@
+# test_search_index.py
+
+import copy
+
+import pytest
+
+from product_record import ProductRecord, products_from_api
+from search_index import SearchIndex, VECTOR_MIN_SIMILARITY
+from stub_servers import build_catalog
+
+QUERIES = ["אנימה", "נארוטו", "פופ ארט", "תמונת קנבס חיות", "שחור וזהב", "נארוטה"]
+
+
+def changes(products):
+    renamed = ProductRecord(products[5].id, "פוסטר נארוטו חדש", categories=("אנימה",), tags=("פופ ארט",))
+    added = [ProductRecord(1000 + i, f"תמונת קנבס חיות טרקטור {i}", categories=("חיות",)) for i in range(3)]
+    return [renamed] + added, [products[0].id, products[7].id, products[42].id]
+
+
+def rebuilt(products, upserts, deleted_ids):
+    changed = {p.id: p for p in upserts}
+    catalog = [changed.pop(p.id, p) for p in products if p.id not in deleted_ids]
+    return SearchIndex(catalog + list(changed.values()))
+
+
+def assert_same(patched, full):
+    assert patched.products == full.products
+    assert patched.postings == full.postings
+    assert sorted(patched.order, key=patched.order.get) == sorted(full.order, key=full.order.get)
+    for query in QUERIES:
+        assert list(lexical(patched).ranked(query)) == list(lexical(full).ranked(query)), query
+        if full.vectors is not None:
+            # המטריצה המתוקנת שומרת את ה-idf של הבסיס - אותם מוצרים, בדמיון קרוב
+            similar = vector_matches(patched, query)
+            expected = vector_matches(full, query)
+            assert similar.keys() == expected.keys(), query
+            assert all(abs(similar[pid] - expected[pid]) < 0.1 for pid in similar), query
+
+
+def lexical(index):
+    index = copy.copy(index)
+    index.vectors, index._term_cache, index._rank_cache = None, {}, type(index._rank_cache)()
+    return index
+
+
+def vector_matches(index, query):
+    return {index.row_ids[row]: similarity
+            for row, similarity in index.vectors.top_k(query, 50, VECTOR_MIN_SIMILARITY)}
+
+
+@pytest.mark.parametrize("size", [200, 0])
+def test_updated_matches_full_rebuild(size):
+    products = products_from_api(build_catalog(size)) if size else []
+    upserts, deleted_ids = changes(products) if size else ([ProductRecord(1, "תמונת אנימה נארוטו")], [])
+    patched = SearchIndex(products).updated(upserts, deleted_ids)
+    assert_same(patched, rebuilt(products, upserts, deleted_ids))
+    if size == 0:
+        pytest.importorskip("numpy")
+        assert patched.vectors is not None  # קטלוג שהיה ריק מקבל מטריצה בעדכון הראשון
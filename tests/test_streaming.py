@@ -0,0 +1,23 @@
+# test_streaming.py
+
+import pytest
+
+from streaming import DirectiveStreamFilter
+
+
+def stream(chunks):
+    directive_filter = DirectiveStreamFilter()
+    return "".join(directive_filter.feed(chunk) for chunk in chunks)
+
+
+@pytest.mark.parametrize("marker", ["SEARCH_ACTION", "search_action", "Search_Action", "save_lead"])
+def test_directive_hidden_in_any_case(marker):
+    assert stream(["הנה מה שמצאתי: ", f"{marker}: אריה"]) == "הנה מה שמצאתי: "
+
+
+def test_directive_split_across_chunks():
+    assert stream(["בטח! sea", "rch_Act", "ion: חתולים"]) == "בטח! "
+
+
+def test_text_that_only_looks_like_a_marker_is_released():
+    assert stream(["ראיתי sea", "gull על החוף"]) == "ראיתי seagull על החוף"
@@ -0,0 +1,25 @@
+# test_thumbnails.py
+
+import os
+
+import pytest
+
+pytest.importorskip("PIL")
+
+from thumbnails import ThumbnailCache
+
+
+def disk_bytes(cache):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(cache.cache_dir)
+               for name in names if name.endswith("." + cache.extension))
+
+
+def test_budget_is_shared_between_workers(tmp_path):
+    # שני מופעים על אותה תיקייה, כמו שני workers של gunicorn
+    workers = [ThumbnailCache(str(tmp_path), max_bytes=50_000) for _ in range(2)]
+    for i in range(40):
+        cache = workers[i % 2]
+        key = cache.key(f"https://example.test/{i}.jpg")
+        cache._store(key, cache._path(key), b"x" * 2_000)
+    assert disk_bytes(workers[0]) <= 50_000
+    assert workers[0].stats()["bytes"] == workers[1].stats()["bytes"] == disk_bytes(workers[0])
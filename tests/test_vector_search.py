@@ -0,0 +1,28 @@
+# test_vector_search.py
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from product_record import products_from_api
+from search_index import SearchIndex, VECTOR_MIN_SIMILARITY
+from stub_servers import build_catalog
+
+
+@pytest.fixture(scope="module")
+def index():
+    return SearchIndex(products_from_api(build_catalog(400)))
+
+
+@pytest.mark.parametrize("query", ["טרקטור", "פינגויין סגול"])
+def test_unrelated_query_matches_nothing(index, query):
+    # n-grams שאינם בקטלוג נספרים באורך השאילתה, כך ש-n-gram מוכר אחד לא מספיק להתאמה
+    assert index.vectors.top_k(query, min_similarity=VECTOR_MIN_SIMILARITY) == []
+    assert len(index.ranked(query)) == 0
+
+
+@pytest.mark.parametrize("query, word", [("נארוטה", "נארוטו"), ("פופארט", "פופ ארט")])
+def test_typo_still_matches(index, query, word):
+    rows = index.vectors.top_k(query, min_similarity=VECTOR_MIN_SIMILARITY)
+    assert rows
+    assert word in index.blobs[index.row_ids[rows[0][0]]]
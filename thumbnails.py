@@ -0,0 +1,233 @@
+# thumbnails.py
+
+# ================= תמונות ממוזערות לכרטיסי המוצרים =================
+# הכרטיס בווידג'ט מוצג ב-60x60, אבל ה-src היה קובץ ההעלאה המקורי מהחנות (לפעמים כמה MB).
+# כאן כל תמונה נמשכת פעם אחת, נחתכת לריבוע קטן ונשמרת כ-WebP (או JPEG) ב-cache על הדיסק.
+# המפתח הוא כתובת התמונה + תאריך השינוי שלה: תמונה שהוחלפה בחנות מקבלת מפתח (וכתובת) חדש,
+# ולכן הדפדפן יכול לשמור כל thumbnail לשנה. ה-cache מוגבל בגודל - הקבצים שלא הוגשו הכי הרבה זמן נמחקים.
+# התקציב משותף לכל ה-workers: הגודל הכולל נשמר בקובץ ליד ה-cache ומתעדכן תחת נעילת קובץ, זמן השינוי של
+# כל קובץ הוא ה-LRU, ולפני פינוי סורקים את התיקייה מחדש - כך שה-cache לא גדל ל-workers כפול המגבלה.
+# Pillow אופציונלי - בלעדיו הכרטיסים ממשיכים להצביע על התמונה המקורית.
+
+import hashlib
+import io
+import os
+import threading
+import time
+
+import requests
+
+from file_lock import file_lock
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+THUMBNAILS_SUPPORTED = Image is not None
+TOUCH_SECONDS = 3600  # הגשה מעדכנת את זמן הקובץ (ה-LRU) לכל היותר פעם בשעה, לא כתיבה לדיסק בכל בקשה
+EVICT_TO = 0.9        # פינוי יורד ל-90% מהמגבלה, כדי שלא כל קובץ חדש יגרום לסריקה נוספת
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024, size=160, image_format="webp", quality=80,
+                 fetch_timeout=15, max_source_bytes=25 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = size
+        if image_format == "webp" and not features.check("webp"): image_format = "jpeg"
+        self.image_format = image_format
+        self.extension = "webp" if image_format == "webp" else "jpg"
+        self.media_type = f"image/{image_format}"
+        self.quality = quality
+        self.fetch_timeout = fetch_timeout
+        self.max_source_bytes = max_source_bytes
+        self._usage_path = os.path.join(cache_dir, "usage")  # "בתים קבצים" של כל ה-cache, משותף לכל ה-workers
+        self._files = 0
+        self._total = 0
+        self._inflight = {}          # key -> Event: בקשות מקבילות לאותה תמונה מחכות ליצירה אחת
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._shared_lock():
+            self._write_usage(*self._scan())  # מה שנשאר מהריצה הקודמת
+        # gunicorn --preload: ה-thread של החימום ב-master עלול להחזיק את הנעילה או חיבור ברגע ה-fork
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.session = requests.Session()
+
+    def _shared_lock(self):
+        # כל עדכון של התקציב המשותף (בין threads ובין workers) עובר כאן אחד אחרי השני
+        return file_lock(os.path.join(self.cache_dir, "usage.lock"))
+
+    def _scan(self):
+        """(בתים, קבצים) של מה שעל הדיסק. מה שמעבר למגבלה נמחק, מהקובץ שלא הוגש הכי הרבה זמן."""
+        found = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if ".tmp" in name:
+                    # כתיבה שנקטעה (קובץ זמני טרי שייך אולי ל-worker אחר שכותב עכשיו)
+                    if time.time() - st.st_mtime > 300: self._remove(path)
+                    continue
+                if not name.endswith("." + self.extension): continue
+                found.append((st.st_mtime, path, st.st_size))
+        found.sort()
+        total, files = sum(size for _, _, size in found), len(found)
+        if total > self.max_bytes:
+            for _, path, size in found[:-1]:
+                if total <= self.max_bytes * EVICT_TO: break
+                if self._remove(path):
+                    total -= size
+                    files -= 1
+                    self.evictions += 1
+        return total, files
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def _read_usage(self):
+        try:
+            with open(self._usage_path) as f:
+                total, files = f.read().split()
+            return int(total), int(files)
+        except (OSError, ValueError):
+            return None
+
+    def _write_usage(self, total, files):
+        self._total, self._files = total, files
+        tmp_path = f"{self._usage_path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "w") as f:
+            f.write(f"{total} {files}")
+        os.replace(tmp_path, self._usage_path)
+
+    def key(self, url, version=""):
+        raw = f"{url}|{version}|{self.size}|{self.image_format}|{self.quality}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24]
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{self.extension}")
+
+    def get(self, url, version=""):
+        """נתיב לקובץ ה-thumbnail (נוצר עכשיו אם צריך), או None אם התמונה לא נטענה."""
+        key = self.key(url, version)
+        path = self._path(key)
+        if self._lookup(key, path): return path
+
+        with self._lock:
+            event = self._inflight.get(key)
+            owner = event is None
+            if owner: event = self._inflight[key] = threading.Event()
+        if not owner:
+            event.wait(self.fetch_timeout * 2)
+            return path if os.path.exists(path) else None
+
+        self.misses += 1
+        try:
+            self._store(key, path, self._render(url))
+            return path
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ Thumbnail failed for {url}: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def warm(self, items):
+        """יצירה מראש ברקע, [(url, version)] - למשל הנמכרים ביותר בכל טעינת קטלוג."""
+        items = [(url, version) for url, version in items if url]
+        if not items: return None
+        thread = threading.Thread(target=lambda: [self.get(url, version) for url, version in items],
+                                  name="thumbnail-warm", daemon=True)
+        thread.start()
+        return thread
+
+    def _lookup(self, key, path):
+        # הדיסק הוא המקור: worker אחר אולי כבר יצר את הקובץ, או מחק אותו בפינוי
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if time.time() - st.st_mtime > TOUCH_SECONDS:
+            try:
+                os.utime(path)  # זמן השינוי הוא ה-LRU המשותף
+            except OSError:
+                pass
+        self.hits += 1
+        return True
+
+    def _render(self, url):
+        response = self.session.get(url, timeout=self.fetch_timeout, stream=True)
+        try:
+            response.raise_for_status()
+            data = response.raw.read(self.max_source_bytes + 1, decode_content=True)
+        finally:
+            response.close()
+        if len(data) > self.max_source_bytes: raise ValueError("source image too large")
+
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft("RGB", (self.size * 2, self.size * 2))  # JPEG: פענוח ברזולוציה מוקטנת, הרבה יותר מהיר
+            img = ImageOps.exif_transpose(img)
+            has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+            img = img.convert("RGBA" if has_alpha else "RGB")
+            if has_alpha and self.image_format == "jpeg":
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            # כמו object-fit: cover בכרטיס - חיתוך למרכז ולא הקטנה עם שוליים
+            img = ImageOps.fit(img, (self.size, self.size), Image.LANCZOS)
+            out = io.BytesIO()
+            if self.image_format == "webp":
+                img.save(out, "WEBP", quality=self.quality, method=4)
+            else:
+                img.save(out, "JPEG", quality=self.quality, optimize=True)
+        return out.getvalue()
+
+    def _store(self, key, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        with self._shared_lock():
+            try:
+                replaced = os.path.getsize(path)  # worker אחר יצר את אותה תמונה בינתיים
+            except OSError:
+                replaced = None
+            os.replace(tmp_path, path)
+            usage = self._read_usage()
+            if usage is None:
+                usage = self._scan()
+            else:
+                total, files = usage
+                usage = (total + len(data) - (replaced or 0), files + (replaced is None))
+                # מעבר למגבלה: סריקה מחדש של התיקייה (כל ה-workers) ופינוי לפי זמן ההגשה האחרון
+                if usage[0] > self.max_bytes: usage = self._scan()
+            self._write_usage(*usage)
+
+    def stats(self):
+        usage = self._read_usage() or (self._total, self._files)
+        return {
+            "files": usage[1],
+            "bytes": usage[0],
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+            "evictions": self.evictions,
+        }
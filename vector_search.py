@@ -0,0 +1,160 @@
+# vector_search.py
+
+# ================= דמיון וקטורי (n-grams של תווים) =================
+# כל מוצר מיוצג כוקטור TF-IDF של רצפי 3 תווים מהשם, הקטגוריות והתגיות, כך שגם שגיאות כתיב
+# ("נארוטה", "פופארט") מוצאות את המוצר בלי שירות embeddings חיצוני.
+# המטריצה נשמרת בעמודות (n-gram -> שורות המוצרים), כי שאילתה נוגעת רק בכמה עשרות n-grams:
+# הציון לכל הקטלוג מחושב במכפלה אחת (bincount על העמודות של השאילתה) ובחירת top-k ב-argpartition.
+# עדכון מוצרים בודדים (webhooks) לא בונה את המטריצה מחדש: PatchedVectors מסתיר את השורות הישנות
+# ומחזיק את הגרסאות החדשות במטריצה קטנה עם אותו אוצר n-grams, עד שמצטברים מספיק שינויים לבנייה מלאה.
+# numpy אופציונלי - בלעדיו החיפוש נשאר על מילות מפתח בלבד.
+
+import math
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NGRAM = 3
+FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")  # "שלום" ו-"שלומ" מקבלים אותם n-grams
+PATCH_REBUILD_RATIO = 0.1  # מעל 10% שורות מתוקנות -> בנייה מלאה
+
+
+def char_ngrams(text, n=NGRAM):
+    grams = Counter()
+    for word in text.lower().translate(FINAL_LETTERS).split():
+        if len(word) < n - 1:
+            continue
+        padded = f" {word} "
+        for i in range(len(padded) - n + 1):
+            grams[padded[i:i + n]] += 1
+    return grams
+
+
+class VectorSearch:
+    size = 0
+
+    def __len__(self):
+        return self.size
+
+    def similarities(self, query):
+        raise NotImplementedError
+
+    def top_k(self, query, k=200, min_similarity=0.2):
+        """[(שורה, דמיון)] של עד k המוצרים הדומים ביותר, מהגבוה לנמוך."""
+        scores = self.similarities(query)
+        if scores is None:
+            return []
+        if k < self.size:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(self.size)
+        top = top[scores[top] >= min_similarity]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(row), float(scores[row])) for row in top]
+
+
+class NgramVectors(VectorSearch):
+    def __init__(self, texts, vocabulary=None):
+        # vocabulary: NgramVectors קיים שה-n-grams וה-idf שלו משמשים כמו שהם (n-grams חדשים לא מקבלים עמודה, רק נספרים באורך השורה)
+        self.size = len(texts)
+        self.columns = vocabulary.columns if vocabulary is not None else {}  # n-gram -> מספר עמודה
+        rows, cols, counts = [], [], []
+        unknown = np.zeros(self.size, dtype=np.float64)  # משקל ה-n-grams שאינם באוצר, לאורך השורה (כמו בשאילתה)
+        for row, text in enumerate(texts):
+            for gram, count in char_ngrams(text).items():
+                if vocabulary is None:
+                    col = self.columns.setdefault(gram, len(self.columns))
+                else:
+                    col = self.columns.get(gram)
+                    if col is None:
+                        unknown[row] += ((1 + math.log(count)) * vocabulary.unknown_idf) ** 2
+                        continue
+                rows.append(row)
+                cols.append(col)
+                counts.append(count)
+
+        rows = np.asarray(rows, dtype=np.int32)
+        cols = np.asarray(cols, dtype=np.int32)
+        doc_freq = np.bincount(cols, minlength=len(self.columns))
+        if vocabulary is not None:
+            self.idf, self.unknown_idf = vocabulary.idf, vocabulary.unknown_idf
+        else:
+            self.idf = (np.log((self.size + 1) / (doc_freq + 1)) + 1).astype(np.float32)
+            self.unknown_idf = math.log(self.size + 1) + 1  # ה-idf של n-gram שאף מוצר לא מכיל
+
+        # TF-IDF מנורמל לאורך 1 בכל שורה (cosine)
+        data = (1 + np.log(np.asarray(counts, dtype=np.float32))) * self.idf[cols]
+        norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=self.size) + unknown).astype(np.float32)
+        data /= norms[rows]
+
+        # מיון לפי עמודה: העמודה c היא rows[indptr[c]:indptr[c+1]]
+        order = np.argsort(cols, kind="stable")
+        self.rows = rows[order]
+        self.data = data[order]
+        self.indptr = np.zeros(len(self.columns) + 1, dtype=np.int64)
+        np.cumsum(doc_freq, out=self.indptr[1:])
+
+    def similarities(self, query):
+        """cosine בין השאילתה לכל המוצרים (מערך באורך הקטלוג), או None אם אין לשאילתה אף n-gram מוכר."""
+        grams, weights, unknown = [], [], 0.0
+        for gram, count in char_ngrams(query).items():
+            col = self.columns.get(gram)
+            if col is None:
+                # לא תורם לציון, אבל נספר באורך השאילתה - אחרת "טרקטור" שרק n-gram אחד שלו מוכר
+                # נראה דומה מאוד לכל מוצר שמכיל את ה-n-gram הזה
+                unknown += ((1 + math.log(count)) * self.unknown_idf) ** 2
+                continue
+            grams.append(col)
+            weights.append((1 + math.log(count)) * float(self.idf[col]))
+        if not grams:
+            return None
+        norm = math.sqrt(sum(w * w for w in weights) + unknown)
+        parts_rows, parts_weights = [], []
+        for col, w in zip(grams, weights):
+            start, end = self.indptr[col], self.indptr[col + 1]
+            parts_rows.append(self.rows[start:end])
+            parts_weights.append(self.data[start:end] * (w / norm))
+        return np.bincount(np.concatenate(parts_rows), weights=np.concatenate(parts_weights), minlength=self.size)
+
+
+class PatchedVectors(VectorSearch):
+    def __init__(self, base, size, patched):
+        self.base = base
+        self.size = size
+        self.patched = patched  # שורה -> הטקסט החדש שלה (None = נמחקה)
+        self.alive = np.ones(base.size, dtype=np.float32)
+        self.alive[[row for row in patched if row < base.size]] = 0
+        live = [(row, text) for row, text in patched.items() if text is not None]
+        self.delta_rows = np.asarray([row for row, _ in live], dtype=np.int64)
+        self.delta = NgramVectors([text for _, text in live], vocabulary=base) if live else None
+
+    def similarities(self, query):
+        base_scores = self.base.similarities(query)
+        if base_scores is None:
+            return None  # ל-delta אותו אוצר n-grams, כך שגם שם אין התאמה
+        scores = np.zeros(self.size, dtype=np.float64)
+        scores[:self.base.size] = base_scores * self.alive
+        if self.delta is not None:
+            scores[self.delta_rows] += self.delta.similarities(query)
+        return scores
+
+
+def build_vectors(texts):
+    if np is None or not texts:
+        return None
+    return NgramVectors(texts)
+
+
+def patch_vectors(vectors, size, changes):
+    """מטריצה עם השינויים (שורה -> טקסט, None = נמחק), או None אם כבר עדיף לבנות מחדש."""
+    if isinstance(vectors, PatchedVectors):
+        base, patched = vectors.base, dict(vectors.patched)
+    else:
+        base, patched = vectors, {}
+    patched.update(changes)
+    if len(patched) > base.size * PATCH_REBUILD_RATIO:
+        return None
+    return PatchedVectors(base, size, patched)